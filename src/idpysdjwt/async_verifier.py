@@ -0,0 +1,80 @@
+import asyncio
+import weakref
+from concurrent.futures import Executor
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from typing import Optional
+
+from cryptojwt.jwt import utc_time_sans_frac
+from idpysdjwt.verifier import VerificationResult
+from idpysdjwt.verifier import VerifiedSDJWT
+from idpysdjwt.verifier import Verifier
+
+
+class AsyncVerifier(object):
+    """
+    Verifies SD-JWTs from within an asyncio event loop. Splitting the message and
+    parsing the JWS happens on the loop, signature verification and disclosure
+    hashing are run in an executor. The number of verifications handed to the
+    executor at any one time is limited to max_in_flight.
+    """
+
+    def __init__(self,
+                 verifier: Verifier,
+                 max_workers: int = 4,
+                 max_in_flight: Optional[int] = None,
+                 executor: Optional[Executor] = None):
+        self.verifier = verifier
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+        self.max_in_flight = max_in_flight or 2 * max_workers
+        # One semaphore per event loop, a semaphore can only be used by one loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        _loop = asyncio.get_running_loop()
+        _semaphore = self._semaphores.get(_loop)
+        if _semaphore is None:
+            _semaphore = self._semaphores[_loop] = asyncio.Semaphore(self.max_in_flight)
+        return _semaphore
+
+    async def _verify(self, msg: str, key_cache: dict, timestamp: int,
+                      lazy: bool = False) -> VerifiedSDJWT:
+        _part, _verifier = self.verifier._prepare(msg)
+        async with self._get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.verifier._verify_prepared, msg, _part, _verifier, key_cache,
+                timestamp, lazy)
+
+    async def verify(self, msg: str, lazy: bool = False) -> VerifiedSDJWT:
+        """
+        :param msg: The SD-JWT
+        :param lazy: If True the payload of the result is a LazyClaims instance
+        :return: A VerifiedSDJWT instance
+        """
+        return await self._verify(msg, {}, utc_time_sans_frac(), lazy)
+
+    async def verify_many(self, messages: List[str]) -> List[VerificationResult]:
+        """
+        Verifies a number of SD-JWTs concurrently. Issuer keys are looked up once
+        per issuer, key ID and algorithm.
+
+        :param messages: List of SD-JWTs
+        :return: One VerificationResult per message in the same order as the
+            messages. If a verification failed the exception is in the error attribute.
+        """
+        key_cache = {}
+        timestamp = utc_time_sans_frac()
+        _results = await asyncio.gather(
+            *[self._verify(msg, key_cache, timestamp) for msg in messages],
+            return_exceptions=True)
+
+        res = []
+        for msg, _verified in zip(messages, _results):
+            if isinstance(_verified, BaseException):
+                res.append(VerificationResult(message=msg, error=_verified))
+            else:
+                res.append(VerificationResult.from_verified(_verified))
+        return res
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
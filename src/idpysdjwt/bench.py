@@ -0,0 +1,829 @@
+"""
+Throughput measurements for the SD-JWT entities.
+
+Run all benchmarks with
+
+    python -m idpysdjwt.bench
+
+or a selection of them by giving their names as arguments, --list shows them.
+The results can be written to a JSON file with --json and compared with an
+earlier run with --baseline. The exit code is 1 if any measurement got more than
+--threshold (default 10%) worse.
+
+    python -m idpysdjwt.bench roles batch_sizes --json before.json
+    python -m idpysdjwt.bench roles batch_sizes --baseline before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from typing import Callable
+from typing import List
+from typing import Optional
+
+from cryptojwt import KeyJar
+from cryptojwt.key_jar import build_keyjar
+
+ISSUER_ID = "https://example.org/issuer"
+
+SELECTIVE_ATTRIBUTE_DISCLOSURES = {
+    "": {
+        "given_name": "John",
+        "family_name": "Doe",
+    },
+    "address": {
+        "street_address": "123 Main St",
+        "locality": "Anytown",
+        "country": "US"
+    },
+    "foo": {
+        "bar": {
+            "bell": True
+        }
+    }
+}
+
+SELECTIVE_ARRAY_DISCLOSURES = {
+    "nationalities": ["US", "DE"],
+    "team": {
+        "group": ['A', 'B']
+    }
+}
+
+BENCHMARKS = {}
+
+
+def benchmark(func: Callable) -> Callable:
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def measure(func: Callable, number: int) -> float:
+    """
+    :param func: What to measure
+    :param number: How many times the function should be run
+    :return: Best number of runs per second over 3 repetitions
+    """
+    best = None
+    for _ in range(3):
+        _start = time.perf_counter()
+        for _ in range(number):
+            func()
+        _spent = time.perf_counter() - _start
+        if best is None or _spent < best:
+            best = _spent
+    return number / best
+
+
+def issuer_key_jar(key_conf: Optional[list] = None):
+    _key_jar = build_keyjar(key_conf or [{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+    _key_jar.import_jwks(_key_jar.export_jwks(private=True), ISSUER_ID)
+    return _key_jar
+
+
+def make_issuer(key_jar=None, sign_alg: str = "ES256", **kwargs):
+    from idpysdjwt.issuer import Issuer
+
+    return Issuer(key_jar=key_jar or issuer_key_jar(), iss=ISSUER_ID, sign_alg=sign_alg,
+                  lifetime=600,
+                  objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+                  array_disclosure=SELECTIVE_ARRAY_DISCLOSURES, **kwargs)
+
+
+def make_presentations(number: int, key_binding: bool = True) -> tuple:
+    """
+    :return: tuple with a list of presentations and a Verifier that can verify them
+    """
+    from idpysdjwt.holder import Holder
+    from idpysdjwt.verifier import Verifier
+
+    _issuer_key_jar = issuer_key_jar()
+    _holder_key_jar = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+    _issuer = make_issuer(key_jar=_issuer_key_jar,
+                          holder_key=_holder_key_jar.get_signing_key(key_type="EC")[0])
+    _holder_key_jar.import_jwks(_issuer_key_jar.export_jwks(), ISSUER_ID)
+
+    res = []
+    for _msg in _issuer.create_holder_messages([{"sub": f"user_{i}"} for i in range(number)]):
+        _holder = Holder(key_jar=_holder_key_jar, sign_alg="ES256")
+        _holder.parse(_msg)
+        res.append(_holder.create_verifier_message(list(_holder.disclosure_by_hash.keys()),
+                                                   key_holder_jwt=key_binding,
+                                                   aud="https://example.com/verifier"))
+
+    _verifier_key_jar = KeyJar()
+    _verifier_key_jar.import_jwks(_issuer_key_jar.export_jwks(), ISSUER_ID)
+    return res, Verifier(key_jar=_verifier_key_jar)
+
+
+@benchmark
+def batch_issuance(batch_size: int = 500) -> dict:
+    _issuer = make_issuer()
+    _payloads = [{"sub": f"user_{i}"} for i in range(batch_size)]
+
+    def _loop():
+        for payload in _payloads:
+            _issuer.create_holder_message(payload=payload)
+
+    def _batch():
+        _issuer.create_holder_messages(_payloads)
+
+    _single = measure(_loop, 1) * batch_size
+    _bulk = measure(_batch, 1) * batch_size
+    return {
+        "single (credentials/s)": round(_single),
+        "batch (credentials/s)": round(_bulk),
+        "speedup": round(_bulk / _single, 2),
+    }
+
+
+@benchmark
+def parallel_issuance(number: int = 2000) -> dict:
+    from idpysdjwt.engine import IssuanceEngine
+
+    _issuer = make_issuer()
+    _payloads = [{"sub": f"user_{i}"} for i in range(number)]
+    res = {}
+    _workers = 1
+    while True:
+        with IssuanceEngine(_issuer, max_workers=_workers) as engine:
+            # warm up the worker processes
+            engine.issue(_payloads[:_workers * engine.chunk_size])
+            res[f"{_workers} workers (credentials/s)"] = round(
+                measure(lambda: engine.issue(_payloads), 1) * number)
+        if _workers >= (os.cpu_count() or 1):
+            break
+        _workers = min(_workers * 2, os.cpu_count())
+    return res
+
+
+@benchmark
+def async_verification(number: int = 500, concurrency: int = 50) -> dict:
+    from idpysdjwt.async_verifier import AsyncVerifier
+
+    _presentations, _verifier = make_presentations(number)
+    _async_verifier = AsyncVerifier(_verifier)
+
+    async def _sync_handler(msg):
+        return _verifier.verify(msg)
+
+    async def _async_handler(msg):
+        return await _async_verifier.verify(msg)
+
+    async def _load(handler) -> tuple:
+        # Stand-in for the HTTP layer, a fixed number of clients sending requests
+        # back to back through an in-process queue.
+        _queue = asyncio.Queue()
+        for msg in _presentations:
+            _queue.put_nowait(msg)
+
+        _lag = [0.0]
+        _done = asyncio.Event()
+
+        async def _ticker():
+            while not _done.is_set():
+                _start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                _lag[0] = max(_lag[0], time.perf_counter() - _start - 0.001)
+
+        async def _client():
+            while not _queue.empty():
+                msg = _queue.get_nowait()
+                await asyncio.sleep(0)  # the request arrives
+                await handler(msg)
+
+        _tick = asyncio.ensure_future(_ticker())
+        _start = time.perf_counter()
+        await asyncio.gather(*[_client() for _ in range(concurrency)])
+        _spent = time.perf_counter() - _start
+        _done.set()
+        await _tick
+        return number / _spent, _lag[0]
+
+    _sync_rate, _sync_lag = asyncio.run(_load(_sync_handler))
+    _async_rate, _async_lag = asyncio.run(_load(_async_handler))
+    _async_verifier.shutdown()
+    return {
+        "on the loop (presentations/s)": round(_sync_rate),
+        "on the loop, max loop lag (ms)": round(_sync_lag * 1000, 2),
+        "AsyncVerifier (presentations/s)": round(_async_rate),
+        "AsyncVerifier, max loop lag (ms)": round(_async_lag * 1000, 2),
+    }
+
+
+@benchmark
+def disclosure_cache(number: int = 200, repeat: int = 20) -> dict:
+    from idpysdjwt.cache import DisclosureCache
+    from idpysdjwt.disclosure import ObjectDisclosure
+    from idpysdjwt.disclosure import parse_disclosure
+
+    _presentations, _ = make_presentations(number, key_binding=False)
+    _disclosures = [d for p in _presentations for d in p.split("~")[1:-1]]
+    # Popular credentials, the same disclosures are seen again and again
+    _workload = _disclosures * repeat
+    _cache = DisclosureCache(max_size=len(_disclosures))
+
+    def _uncached():
+        for d in _workload:
+            parse_disclosure(d)
+
+    def _cached():
+        for d in _workload:
+            parse_disclosure(d, cache=_cache)
+
+    _plain = measure(_uncached, 1) * len(_workload)
+    _with_cache = measure(_cached, 1) * len(_workload)
+    res = {
+        "without cache (disclosures/s)": round(_plain),
+        "with cache (disclosures/s)": round(_with_cache),
+        "hit ratio": round(_cache.hits / (_cache.hits + _cache.misses), 3),
+    }
+
+    # Disclosures of objects and arrays
+    _workload = [ObjectDisclosure({"street_address": f"{i} Main St", "locality": "Anytown",
+                                   "country": "US", "phone": ["+1 555 0100", "+1 555 0101"]},
+                                  "address").make()[0]
+                 for i in range(number)] * repeat
+    _cache = DisclosureCache(max_size=number)
+    res["structured, without cache (disclosures/s)"] = round(
+        measure(_uncached, 1) * len(_workload))
+    res["structured, with cache (disclosures/s)"] = round(measure(_cached, 1) * len(_workload))
+    return res
+
+
+@benchmark
+def lazy_claims(number: int = 200) -> dict:
+    _presentations, _verifier = make_presentations(number, key_binding=False)
+
+    def _eager():
+        for msg in _presentations:
+            _verifier.verify(msg).get(["address", "country"])
+
+    def _lazy():
+        for msg in _presentations:
+            _verifier.verify(msg, lazy=True).get(["address", "country"])
+
+    return {
+        "eager, one claim read (presentations/s)": round(measure(_eager, 1) * number),
+        "lazy, one claim read (presentations/s)": round(measure(_lazy, 1) * number),
+    }
+
+
+@benchmark
+def presentation(number: int = 2000) -> dict:
+    from idpysdjwt.disclosure import b64_encode
+    from idpysdjwt.holder import Holder
+
+    _issuer_key_jar = issuer_key_jar()
+    _msg = make_issuer(key_jar=_issuer_key_jar).create_holder_message(payload={"sub": "sub"})
+    _holder_key_jar = KeyJar()
+    _holder_key_jar.import_jwks(_issuer_key_jar.export_jwks(), ISSUER_ID)
+    _holder = Holder(key_jar=_holder_key_jar)
+    _holder.parse(_msg)
+    _hashes = list(_holder.disclosure_by_hash.keys())
+
+    def _reencode():
+        # What create_verifier_message used to do
+        _parts = [_holder.sdjwt.split("~")[0]]
+        _parts.extend([b64_encode(_holder.disclosure_by_hash[h]) for h in _hashes])
+        _parts.append("")
+        return "~".join(_parts)
+
+    def _passthrough():
+        return _holder.create_verifier_message(_hashes)
+
+    return {
+        "re-encoded disclosures (presentations/s)": round(measure(_reencode, number)),
+        "original disclosures (presentations/s)": round(measure(_passthrough, number)),
+    }
+
+
+@benchmark
+def key_binding(number: int = 1000) -> dict:
+    from cryptojwt import JWT
+    from idpyoidc.util import rndstr
+
+    from idpysdjwt.key_binding import KeyBindingSigner
+
+    _key_jar = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+    _jwt = JWT(key_jar=_key_jar, sign_alg="ES256")
+    _signer = KeyBindingSigner(_jwt.pack_key(), sign_alg="ES256")
+    _audiences = [f"https://verifier{i}.example.com" for i in range(10)]
+
+    def _pack():
+        for aud in _audiences:
+            _jwt.pack({"nonce": rndstr()}, aud=aud)
+
+    def _batch():
+        _signer.sign_many(_audiences, presentation="a.b.c~d~")
+
+    _packed = measure(_pack, number // 10) * len(_audiences)
+    _prepared = measure(_batch, number // 10) * len(_audiences)
+    return {
+        "JWT.pack (KB-JWTs/s)": round(_packed),
+        "KeyBindingSigner.sign_many (KB-JWTs/s)": round(_prepared),
+        "signer stats (KB-JWTs/s)": round(_signer.stats()["signed_per_second"]),
+    }
+
+
+def peak_memory(func: Callable) -> int:
+    """
+    :return: Peak number of bytes allocated while running func
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def compact_parser(sizes: tuple = (10, 100, 1000)) -> dict:
+    from idpysdjwt.compact import CompactSDJWT
+    from idpysdjwt.disclosure import parse_disclosure
+    from idpysdjwt.template import CredentialTemplate
+
+    res = {}
+    for size in sizes:
+        # A diploma like credential with a long array of courses
+        _template = CredentialTemplate(
+            {"": {"given_name": "John", "family_name": "Doe"}},
+            {"courses": [{"name": f"Course {i}", "credits": 7.5} for i in range(size - 2)]})
+        _payload, _disclosures = _template.construct({"sub": "sub"})
+        _msg = "~".join(["header.payload.signature"] + _disclosures + [""]).encode("ascii")
+        _wanted = _payload["_sd"]
+
+        def _split():
+            _part = _msg.decode("ascii").split("~")
+            _by_hash = {}
+            for d in _part[1:-1]:
+                _disc, _hash = parse_disclosure(d)
+                _by_hash[_hash] = _disc
+            return [_by_hash[d] for d in _wanted]
+
+        def _lazy():
+            _parser = CompactSDJWT(_msg)
+            return [_parser.disclosure(d) for d in _wanted]
+
+        res[f"{size} disclosures, split (peak bytes)"] = peak_memory(_split)
+        res[f"{size} disclosures, CompactSDJWT (peak bytes)"] = peak_memory(_lazy)
+    return res
+
+
+@benchmark
+def hash_algorithms(sizes: tuple = (10, 100, 1000)) -> dict:
+    from idpysdjwt.disclosure import HASH_ALGORITHMS
+    from idpysdjwt.template import CredentialTemplate
+
+    res = {}
+    for size in sizes:
+        _template = CredentialTemplate(
+            {"": {f"claim_{i}": f"value {i}" for i in range(size)}})
+        for hash_func in HASH_ALGORITHMS:
+            _rate = measure(lambda: _template.construct({"sub": "sub"}, hash_func=hash_func),
+                            max(1, 10000 // size))
+            res[f"{size} disclosures, {hash_func} (credentials/s)"] = round(_rate, 1)
+    return res
+
+
+@benchmark
+def disclosure_encoding(number: int = 1000) -> dict:
+    from idpysdjwt.disclosure import ObjectDisclosure
+    from idpysdjwt.disclosure import encode_disclosures
+
+    _claims = [(f"claim_{i}", f"value {i}") for i in range(number)]
+
+    def _one_by_one():
+        return [ObjectDisclosure(v, k).make() for k, v in _claims]
+
+    def _batched():
+        return encode_disclosures([[k, v] for k, v in _claims])
+
+    res = {}
+    for name, func in [("one by one", _one_by_one), ("batched", _batched)]:
+        res[f"{name} (disclosures/s)"] = round(measure(func, 10) * number)
+        res[f"{name}, peak bytes per disclosure"] = round(peak_memory(func) / number)
+    return res
+
+
+@benchmark
+def disclosure_memory(number: int = 100000) -> dict:
+    from idpysdjwt.disclosure import ObjectDisclosure
+    from idpysdjwt.disclosure import encode_disclosures
+    from idpysdjwt.disclosure import parse_disclosure
+    from idpysdjwt.table import DisclosureTable
+
+    _encoded = [d for d, _ in encode_disclosures(
+        [[f"claim_{i % 50}", f"value {i}"] for i in range(number)])]
+
+    def _size(build: Callable) -> int:
+        # The memory still allocated when the structure has been built
+        tracemalloc.start()
+        try:
+            _kept = build()  # noqa: F841
+            return tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+    def _dict():
+        return {_hash: _disc for _disc, _hash in (parse_disclosure(d) for d in _encoded)}
+
+    def _table():
+        _table = DisclosureTable()
+        for d in _encoded:
+            _table.add(d)
+        return _table
+
+    def _objects():
+        return [ObjectDisclosure(f"value {i}", f"claim_{i % 50}") for i in range(number)]
+
+    return {
+        "dict of lists (bytes per disclosure)": round(_size(_dict) / number),
+        "DisclosureTable (bytes per disclosure)": round(_size(_table) / number),
+        "ObjectDisclosure with __slots__ (bytes per disclosure)": round(_size(_objects) / number),
+    }
+
+
+@benchmark
+def recursive_disclosures(depths: tuple = (1, 10, 100), number: int = 200) -> dict:
+    from idpysdjwt.claims import ClaimIndex
+    from idpysdjwt.claims import expand
+    from idpysdjwt.disclosure import parse_disclosure
+    from idpysdjwt.template import Disclosed
+    from idpysdjwt.template import build_disclosures
+
+    res = {}
+    for depth in depths:
+        # Every level is disclosed on its own and holds two more disclosed claims
+        _claims = {"name": Disclosed("leaf")}
+        for i in range(depth):
+            _claims = {"level": Disclosed(i), "name": Disclosed(f"level {i}"),
+                       "inner": Disclosed(_claims)}
+        _payload, _disclosures = build_disclosures(_claims)
+        _by_hash = dict(parse_disclosure(d)[::-1] for d in _disclosures)
+        _path = ["inner"] * depth + ["name"]
+
+        res[f"depth {depth}, build (credentials/s)"] = round(
+            measure(lambda: build_disclosures(_claims), number), 1)
+        res[f"depth {depth}, resolve (credentials/s)"] = round(
+            measure(lambda: expand(_payload, _by_hash.get), number), 1)
+        res[f"depth {depth}, index and select (credentials/s)"] = round(
+            measure(lambda: ClaimIndex(_payload, _by_hash).digests([_path]), number), 1)
+    return res
+
+
+def latencies(func: Callable, number: int) -> dict:
+    """
+    :return: Median and 99th percentile latency of func in milliseconds
+    """
+    _spent = []
+    for _ in range(number):
+        _start = time.perf_counter()
+        func()
+        _spent.append(time.perf_counter() - _start)
+    _spent.sort()
+    return {"p50": round(_spent[len(_spent) // 2] * 1000, 3),
+            "p99": round(_spent[int(len(_spent) * 0.99)] * 1000, 3)}
+
+
+@benchmark
+def decoy_digests(number: int = 2000, minimum: int = 32) -> dict:
+    from idpysdjwt.decoy import DecoyPolicy
+
+    _inline = DecoyPolicy(minimum=minimum)
+    # A pool that is always empty, every decoy is made on the request path
+    _inline.pool("sha-256").size = 0
+    # Big enough for the whole run
+    _pooled = DecoyPolicy(minimum=minimum, pool_size=number * minimum * 4)
+    _pooled.pool("sha-256").fill()
+
+    res = {}
+    _key_jar = issuer_key_jar()
+    for name, decoys in [("no decoys", None), ("decoys made inline", _inline),
+                         ("decoys from pool", _pooled)]:
+        _issuer = make_issuer(key_jar=_key_jar, decoys=decoys)
+        for key, val in latencies(lambda: _issuer.create_holder_message(payload={"sub": "sub"}),
+                                  number).items():
+            res[f"{name}, {key} (ms)"] = val
+    _inline.close()
+    _pooled.close()
+    return res
+
+
+@benchmark
+def value_cache(batch_size: int = 1000) -> dict:
+    from idpysdjwt.cache import SerializationCache
+    from idpysdjwt.template import CredentialTemplate
+
+    # An employee credential, most values are shared by many holders
+    _template = CredentialTemplate(
+        {"": {"given_name": "", "family_name": "", "employer": "Example Corp",
+              "employment_type": "full-time"},
+         "address": {"locality": "Anytown", "country": "US"}},
+        {"nationalities": ["US"], "groups": ["staff", "engineering"]})
+    _values = [{"": {"given_name": f"Given {i}", "family_name": f"Family {i % 50}"},
+                "address": {"locality": ["Anytown", "Othertown"][i % 2]}}
+               for i in range(batch_size)]
+    _cache = SerializationCache()
+
+    def _batch(cache):
+        for values in _values:
+            _template.construct({"sub": "sub"}, objective_values=values, value_cache=cache)
+
+    _plain = measure(lambda: _batch(None), 1) * batch_size
+    _cached = measure(lambda: _batch(_cache), 1) * batch_size
+    return {
+        "without cache (credentials/s)": round(_plain),
+        "with cache (credentials/s)": round(_cached),
+        "speedup": round(_cached / _plain, 2),
+        "hit ratio": round(_cache.hits / (_cache.hits + _cache.misses), 3),
+    }
+
+
+SIGNING_KEYS = {
+    "ES256": {"type": "EC", "crv": "P-256", "use": ["sig"]},
+    "ES384": {"type": "EC", "crv": "P-384", "use": ["sig"]},
+    "EdDSA": {"type": "OKP", "crv": "Ed25519", "use": ["sig"]},
+    "RS256": {"type": "RSA", "use": ["sig"]},
+    "PS256": {"type": "RSA", "use": ["sig"]},
+}
+
+
+@benchmark
+def prepared_signer(number: int = 500) -> dict:
+    res = {}
+    for alg, key_conf in SIGNING_KEYS.items():
+        _key_jar = issuer_key_jar([key_conf])
+        for name, prepared in [("JWT.pack", False), ("prepared signer", True)]:
+            _issuer = make_issuer(key_jar=_key_jar, sign_alg=alg, prepared_signer=prepared)
+            _latency = latencies(lambda: _issuer.create_holder_message(payload={"sub": "sub"}),
+                                 number)
+            res[f"{alg}, {name}, p50 (ms)"] = _latency["p50"]
+    return res
+
+
+@benchmark
+def key_index(issuers: int = 24, number: int = 960) -> dict:
+    from idpysdjwt.key_index import KeyIndex
+    from idpysdjwt.verifier import Verifier
+
+    # Dozens of issuers, each with a couple of keys
+    _verifier_key_jar = KeyJar()
+    _presentations = []
+    for i in range(issuers):
+        _key_jar = build_keyjar([SIGNING_KEYS["ES256"], SIGNING_KEYS["ES256"]])
+        _iss = f"https://issuer{i}.example.org"
+        _key_jar.import_jwks(_key_jar.export_jwks(private=True), _iss)
+        _verifier_key_jar.import_jwks(_key_jar.export_jwks(issuer_id=_iss), _iss)
+        _issuer = make_issuer(key_jar=_key_jar)
+        _issuer.iss = _iss
+        _presentations.extend(_issuer.create_holder_messages(
+            [{"sub": f"user_{j}"} for j in range(number // issuers)]))
+
+    _index = KeyIndex()
+    _plain = Verifier(key_jar=_verifier_key_jar)
+    _indexed = Verifier(key_jar=_verifier_key_jar, key_index=_index)
+
+    def _verify(verifier):
+        for msg in _presentations:
+            verifier.verify(msg)
+
+    res = {
+        "KeyJar lookup (presentations/s)": round(
+            measure(lambda: _verify(_plain), 1) * len(_presentations)),
+        "KeyIndex (presentations/s)": round(
+            measure(lambda: _verify(_indexed), 1) * len(_presentations)),
+    }
+    res.update({f"index {k}": v for k, v in _index.stats().items()})
+    return res
+
+
+@benchmark
+def json_backends(number: int = 500) -> dict:
+    from idpysdjwt import json_codec
+
+    _presentations, _verifier = make_presentations(number, key_binding=False)
+    # Payloads with many disclosures, where the JSON work is noticeable
+    _issuer = make_issuer()
+    for i in range(50):
+        _issuer.add_object_disclosure([], f"claim_{i}", {"value": f"value {i}", "n": [i, i + 1]})
+    _payloads = [{"sub": f"user_{i}"} for i in range(number)]
+
+    res = {}
+    for backend in ["json", "auto", "orjson"]:
+        try:
+            json_codec.set_backend(backend)
+        except ValueError:  # orjson not installed
+            continue
+        try:
+            res[f"{backend}, issuance (credentials/s)"] = round(
+                measure(lambda: _issuer.create_holder_messages(_payloads), 1) * number)
+            res[f"{backend}, verification (presentations/s)"] = round(
+                measure(lambda: [_verifier.verify(m) for m in _presentations], 1) * number)
+        finally:
+            json_codec.set_backend()
+    return res
+
+
+@benchmark
+def instrumentation(number: int = 1000) -> dict:
+    from idpysdjwt.instrumentation import StatsInstrumentation
+
+    _presentations, _verifier = make_presentations(1)
+    _issuer = make_issuer()
+    res = {}
+    for name, _instrumentation in [("off", None), ("StatsInstrumentation",
+                                                   StatsInstrumentation())]:
+        _issuer.instrumentation = _verifier.instrumentation = _instrumentation
+        res[f"{name}, issuance (credentials/s)"] = round(measure(
+            lambda: _issuer.create_holder_message(payload={"sub": "sub"}), number))
+        res[f"{name}, verification (presentations/s)"] = round(measure(
+            lambda: _verifier.verify(_presentations[0]), number))
+    return res
+
+
+def credential_shape(shape: str, size: int) -> tuple:
+    """
+    :param shape: 'flat', 'nested' or 'array'
+    :param size: The number of disclosures
+    :return: tuple with object and array disclosure specifications
+    """
+    if shape == "flat":
+        return {"": {f"claim_{i}": f"value {i}" for i in range(size)}}, None
+    if shape == "nested":
+        # Objects ten claims wide, three levels deep
+        _objects = {}
+        for i in range(size):
+            _path = (f"group_{i // 100}", f"section_{i // 10 % 10}")
+            _objects.setdefault(_path[0], {}).setdefault(_path[1], {})[f"claim_{i}"] = i
+        return _objects, None
+    if shape == "array":
+        return ({"": {"given_name": "John"}},
+                {"entries": [{"name": f"Entry {i}", "value": i} for i in range(size - 1)]})
+    raise ValueError(f"Unknown credential shape {shape}")
+
+
+@benchmark
+def roles(shapes: tuple = ("flat", "nested", "array"),
+          sizes: tuple = (10, 100, 1000),
+          algs: tuple = ("ES256", "EdDSA", "RS256")) -> dict:
+    from idpysdjwt.holder import Holder
+    from idpysdjwt.issuer import Issuer
+    from idpysdjwt.verifier import Verifier
+
+    _holder_key_jar = build_keyjar([SIGNING_KEYS["ES256"]])
+    res = {}
+    for alg in algs:
+        _key_jar = issuer_key_jar([SIGNING_KEYS[alg]])
+        _holder_key_jar.import_jwks(_key_jar.export_jwks(issuer_id=ISSUER_ID), ISSUER_ID)
+        _verifier_key_jar = KeyJar()
+        _verifier_key_jar.import_jwks(_key_jar.export_jwks(issuer_id=ISSUER_ID), ISSUER_ID)
+
+        for shape in shapes:
+            for size in sizes:
+                _objects, _arrays = credential_shape(shape, size)
+                _issuer = Issuer(key_jar=_key_jar, iss=ISSUER_ID, sign_alg=alg, lifetime=600,
+                                 objective_disclosure=_objects, array_disclosure=_arrays)
+                _msg = _issuer.create_holder_message(payload={"sub": "sub"})
+                _holder = Holder(key_jar=_holder_key_jar)
+                _holder.parse(_msg)
+                _hashes = list(_holder.disclosure_by_hash.keys())
+                _presentation = _holder.create_verifier_message(_hashes)
+                _verifier = Verifier(key_jar=_verifier_key_jar)
+
+                _number = max(1, 1000 // size)
+                _name = f"{alg}, {shape}, {size} disclosures"
+                res[f"{_name}, issue (credentials/s)"] = round(measure(
+                    lambda: _issuer.create_holder_message(payload={"sub": "sub"}), _number), 1)
+                res[f"{_name}, present (presentations/s)"] = round(measure(
+                    lambda: _holder.create_verifier_message(_hashes), _number), 1)
+                res[f"{_name}, verify (presentations/s)"] = round(measure(
+                    lambda: _verifier.parse(_presentation), _number), 1)
+    return res
+
+
+@benchmark
+def batch_sizes(sizes: tuple = (1, 10, 100, 1000)) -> dict:
+    _issuer = make_issuer()
+    res = {}
+    for size in sizes:
+        _payloads = [{"sub": f"user_{i}"} for i in range(size)]
+        _rate = measure(lambda: _issuer.create_holder_messages(_payloads), max(1, 1000 // size))
+        res[f"batch of {size} (credentials/s)"] = round(_rate * size)
+    return res
+
+
+def run(names: Optional[list] = None, out: Callable = print) -> dict:
+    """
+    :param names: The benchmarks to run, default all
+    :param out: Where progress is reported
+    :return: Benchmark name as key and its measurements as value
+    """
+    res = {}
+    for name in names or list(BENCHMARKS.keys()):
+        if name not in BENCHMARKS:
+            raise KeyError(f"Unknown benchmark {name}")
+        out(name)
+        res[name] = BENCHMARKS[name]()
+        for key, val in res[name].items():
+            out(f"    {key}: {val}")
+    return res
+
+
+def report(results: dict) -> dict:
+    """
+    :param results: What run returned
+    :return: A JSON serializable report with the environment the results come from
+    """
+    from idpysdjwt import __version__
+
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": int(time.time()),
+        "results": results,
+    }
+
+
+# Measurements where more is better: throughput, speedups, ratios and cache hits.
+# Everything else, like latencies, sizes, misses and errors, is a cost.
+_HIGHER_IS_BETTER = re.compile(r"/s\)|\b(speedup|ratio|hits?)\b", re.IGNORECASE)
+_COST = re.compile(r"\b(miss|misses|error|errors)\b", re.IGNORECASE)
+
+
+def _higher_is_better(measurement: str) -> bool:
+    return (_HIGHER_IS_BETTER.search(measurement) is not None
+            and _COST.search(measurement) is None)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> List[str]:
+    """
+    Compares two reports. Throughput should not go down, latencies and sizes
+    should not go up, by more than threshold. A measurement in the baseline that
+    is missing from a benchmark in this run is also a regression. Benchmarks that
+    were not run are not compared.
+
+    :param baseline: A report from an earlier run
+    :param current: A report from this run
+    :param threshold: Allowed relative change
+    :return: One line per regression
+    """
+    res = []
+    for name, measurements in current["results"].items():
+        _before = baseline["results"].get(name, {})
+        for key, _old in _before.items():
+            if isinstance(_old, (int, float)) and not isinstance(measurements.get(key),
+                                                                 (int, float)):
+                res.append(f"{name}: {key}: {_old} -> missing")
+        for key, val in measurements.items():
+            _old = _before.get(key)
+            if not isinstance(_old, (int, float)) or not isinstance(val, (int, float)) or not _old:
+                continue
+            _change = (val - _old) / _old
+            if not _higher_is_better(key):
+                _change = -_change
+            if _change < -threshold:
+                res.append(f"{name}: {key}: {_old} -> {val} ({_change:+.1%})")
+    return res
+
+
+def main(argv: Optional[list] = None) -> int:
+    _parser = argparse.ArgumentParser(prog="python -m idpysdjwt.bench")
+    _parser.add_argument("names", nargs="*", help="Benchmarks to run, default all")
+    _parser.add_argument("--json", dest="json_file", help="Write the results to this file")
+    _parser.add_argument("--baseline", help="Compare with the results in this file")
+    _parser.add_argument("--threshold", type=float, default=0.1,
+                         help="Allowed relative change before it is a regression")
+    _parser.add_argument("--list", action="store_true", help="List the benchmarks")
+    args = _parser.parse_args(argv)
+
+    if args.list:
+        for name in BENCHMARKS:
+            print(name)
+        return 0
+
+    _report = report(run(args.names))
+    if args.json_file:
+        with open(args.json_file, "w") as fp:
+            json.dump(_report, fp, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            _regressions = compare(json.load(fp), _report, args.threshold)
+        if _regressions:
+            print("Regressions")
+            for line in _regressions:
+                print(f"    {line}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
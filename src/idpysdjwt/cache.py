@@ -0,0 +1,276 @@
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Optional
+
+from cryptojwt import KeyJar
+from idpysdjwt import json_codec
+
+
+# id(object) as key and a weak reference to the object together with a value as
+# value. Ids are reused, the reference tells if the object is the one the value
+# belongs to.
+_thumbprints = {}
+_fingerprints = {}
+# Reentrant, the garbage collector may run a callback while the lock is held
+_memo_lock = threading.RLock()
+
+
+def _recall(memo: dict, obj):
+    _entry = memo.get(id(obj))
+    if _entry is not None and _entry[0]() is obj:
+        return _entry[1]
+    return None
+
+
+def _remember(memo: dict, obj, value):
+    _id = id(obj)
+
+    def _forget(ref):
+        with _memo_lock:
+            if memo.get(_id, (None,))[0] is ref:
+                del memo[_id]
+
+    with _memo_lock:
+        memo[_id] = (weakref.ref(obj, _forget), value)
+
+
+def _thumbprint(key) -> bytes:
+    res = _recall(_thumbprints, key)
+    if res is None:
+        res = key.thumbprint("SHA-256")
+        _remember(_thumbprints, key, res)
+    return res
+
+
+def key_jar_fingerprint(key_jar: KeyJar, max_age: float = 0.0) -> int:
+    """
+    A value that changes when keys are added to, removed from or marked as
+    inactive in a key jar. Keys are identified by issuer, kid and JWK thumbprint.
+    Remote key bundles are not refreshed.
+
+    :param key_jar: A KeyJar instance
+    :param max_age: A fingerprint of the same key jar that is less than max_age
+        seconds old is returned as it is
+    :return: An integer
+    """
+    _now = time.monotonic()
+    if max_age:
+        _known = _recall(_fingerprints, key_jar)
+        if _known is not None and _now - _known[0] < max_age:
+            return _known[1]
+
+    _state = []
+    for issuer_id, _issuer in key_jar.items():
+        for kb in _issuer.get_bundles():
+            _state.extend((issuer_id, k.kid, _thumbprint(k), k.inactive_since)
+                          for k in kb.keys(update=False))
+    res = hash(tuple(_state))
+    _remember(_fingerprints, key_jar, (_now, res))
+    return res
+
+
+class VerifiedJWTCache(object):
+    """
+    A bounded LRU cache that maps the digest of a compact signed JWT to the claims
+    it carried after the signature had been verified. Entries are dropped when
+    they are older than ttl seconds, when the JWT expires or when the keys in the
+    verifier's key jar has changed since the entry was added. The key jar is
+    checked for changes at most every check_interval seconds.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: int = 300, check_interval: float = 1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str, fingerprint: int, now: int) -> Optional[dict]:
+        """
+        :param token: The compact signed JWT
+        :param fingerprint: The present fingerprint of the key jar
+        :param now: The present time
+        :return: A copy of the verified claims or None
+        """
+        _key = self._key(token)
+        with self._lock:
+            _entry = self._cache.get(_key)
+            if _entry is not None:
+                _claims, _expires, _fingerprint = _entry
+                if _expires <= now or _fingerprint != fingerprint:
+                    del self._cache[_key]
+                else:
+                    self._cache.move_to_end(_key)
+                    self.hits += 1
+                    return dict(_claims)
+            self.misses += 1
+        return None
+
+    def put(self, token: str, claims: dict, fingerprint: int, now: int, skew: int = 0):
+        """
+        :param token: The compact signed JWT
+        :param claims: The verified claims
+        :param fingerprint: The fingerprint of the key jar used for the verification
+        :param now: The present time
+        :param skew: Allowed time skew
+        """
+        _expires = now + self.ttl
+        if "exp" in claims:
+            _expires = min(_expires, int(claims["exp"]) + skew)
+
+        _key = self._key(token)
+        with self._lock:
+            self._cache[_key] = (dict(claims), _expires, fingerprint)
+            self._cache.move_to_end(_key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def _copy_json(value):
+    # Decoded JSON only contains dicts, lists and immutable scalars
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
+class DisclosureCache(object):
+    """
+    A bounded LRU cache that maps a disclosure and a hash algorithm to the decoded
+    disclosure and its digest. The cache keeps a copy of its own and every hit
+    gets a new copy, objects and arrays included, so results can be changed
+    without affecting the cache or other results.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, disclosure: str, hash_func: str) -> Optional[tuple]:
+        """
+        :param disclosure: The base64url encoded disclosure
+        :param hash_func: The hash algorithm
+        :return: tuple with the decoded disclosure and its digest or None
+        """
+        _key = (disclosure, hash_func)
+        with self._lock:
+            _entry = self._cache.get(_key)
+            if _entry is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(_key)
+            self.hits += 1
+
+        _decoded, _hash, _structured = _entry
+        if _structured:
+            return _copy_json(_decoded), _hash
+        return list(_decoded), _hash
+
+    def put(self, disclosure: str, hash_func: str, decoded: list, digest: str):
+        _key = (disclosure, hash_func)
+        # Only disclosures of objects and arrays need the deep copy on a hit
+        _structured = any(isinstance(v, (dict, list)) for v in decoded)
+        _entry = (_copy_json(list(decoded)) if _structured else tuple(decoded), digest,
+                  _structured)
+        with self._lock:
+            self._cache[_key] = _entry
+            self._cache.move_to_end(_key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+    def __len__(self):
+        return len(self._cache)
+
+
+# Values that are JSON serialized the same way every time and can be dictionary
+# keys. Not floats, -0.0 equals 0.0 but is written differently and NaN never
+# equals itself.
+_SCALARS = (str, int, bool, type(None))
+
+
+class SerializationCache(object):
+    """
+    A bounded cache of the JSON text of claim names and values used when
+    disclosures are encoded. Only strings, integers, booleans, None and tuples of
+    those are cached, other values, floats included, are serialized every time.
+    The type is part of the key, so 1 and True are kept apart. When max_size is
+    reached the cache is emptied, which keeps lookups free from locking and
+    bookkeeping. The text is made by idpysdjwt.json_codec.dumps and the cache is
+    emptied if the backend changes.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        self._backend = json_codec.backend
+
+    @staticmethod
+    def _key(value):
+        if isinstance(value, _SCALARS):
+            return type(value), value
+        if isinstance(value, tuple) and all(isinstance(v, _SCALARS) for v in value):
+            return tuple, tuple((type(v), v) for v in value)
+        return None
+
+    def dumps(self, value) -> str:
+        """
+        :param value: A claim name or value
+        :return: The same text as json_codec.dumps(value)
+        """
+        _key = self._key(value)
+        if _key is None:
+            return json_codec.dumps(value)
+        if self._backend != json_codec.backend:
+            self._cache = {}
+            self._backend = json_codec.backend
+        _text = self._cache.get(_key)
+        if _text is None:
+            self.misses += 1
+            _text = json_codec.dumps(value)
+            if len(self._cache) >= self.max_size:
+                self._cache.clear()
+            self._cache[_key] = _text
+        else:
+            self.hits += 1
+        return _text
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,267 @@
+import threading
+from typing import Callable
+from typing import List
+from typing import Union
+
+# Marks a claim that is not present
+_MISSING = object()
+
+
+def expand(value, lookup: Callable):
+    """
+    Replaces all digests in a value with the disclosed claims. Digests that can
+    not be resolved are dropped. Disclosed values are themselves expanded so
+    disclosures can be nested to any depth. The walk is iterative, the depth of
+    the value is not limited by the recursion limit.
+
+    :param value: A part of a SD-JWT payload
+    :param lookup: Function that maps a digest to a decoded disclosure or None
+    :return: The value with all disclosures applied
+    """
+    if not isinstance(value, (dict, list)):
+        return value
+
+    _seen = set()
+
+    def _lookup(digest):
+        # A digest may only be used once, otherwise a small credential could
+        # expand into a very large one
+        if digest in _seen:
+            raise ValueError(f"Digest {digest} used more than once")
+        _seen.add(digest)
+        return lookup(digest)
+
+    _root = [None]
+    _stack = [(value, _root, 0)]
+    while _stack:
+        item, parent, key = _stack.pop()
+        if isinstance(item, dict):
+            _out = resolve_object(item, _lookup)
+            _children = _out.items()
+        else:
+            _out = resolve_array(item, _lookup)
+            _children = enumerate(_out)
+        parent[key] = _out
+        _stack.extend((v, _out, k) for k, v in _children if isinstance(v, (dict, list)))
+    return _root[0]
+
+
+def resolve_object(item: dict, lookup: Callable) -> dict:
+    """
+    Resolves the digests on one level of an object. Values are left as they are.
+    """
+    res = {}
+    for _hash in item.get("_sd", []):
+        _val = lookup(_hash)
+        if _val:
+            res[_val[1]] = _val[2]
+
+    for k, v in item.items():
+        if k not in ['_sd', '_sd_alg']:
+            res[k] = v
+    return res
+
+
+def resolve_array(item: list, lookup: Callable) -> list:
+    """
+    Resolves the digests on one level of an array. Values are left as they are.
+    """
+    res = []
+    for v in item:
+        if isinstance(v, dict) and "..." in v and len(v) == 1:
+            _val = lookup(v["..."])
+            if _val:
+                res.append(_val[1])
+        else:
+            res.append(v)
+    return res
+
+
+class LazyClaims(object):
+    """
+    A view of a verified SD-JWT payload where disclosures are applied only to the
+    parts of the payload that are accessed. Resolved parts are remembered. A
+    digest that is used for more than one claim raises ValueError when the second
+    claim is accessed. Can be used by many threads.
+    """
+
+    def __init__(self, payload: dict, disclosures):
+        """
+        :param payload: The verified payload of the issuer signed JWT
+        :param disclosures: Either a dictionary with digests as keys and decoded
+            disclosures as values or a idpysdjwt.compact.CompactSDJWT instance
+        """
+        self._payload = payload
+        if isinstance(disclosures, dict):
+            self._lookup = disclosures.get
+        else:
+            self._lookup = disclosures.disclosure
+        self._nodes = {}
+        # Digest as key and the path of the claim it was used for as value
+        self._owners = {}
+        # Guards the resolved parts and the disclosure lookup
+        self._lock = threading.RLock()
+
+    def _resolver(self, path: tuple) -> Callable:
+        def _lookup(digest):
+            if self._owners.setdefault(digest, path) != path:
+                raise ValueError(f"Digest {digest} used more than once")
+            return self._lookup(digest)
+
+        return _lookup
+
+    def _node(self, path: tuple, value):
+        # Must be called with the lock held
+        _node = self._nodes.get(path)
+        if _node is None:
+            if isinstance(value, dict):
+                _node = resolve_object(value, self._resolver(path))
+            elif isinstance(value, list):
+                _node = resolve_array(value, self._resolver(path))
+            else:
+                return value
+            self._nodes[path] = _node
+        return _node
+
+    def _expand(self, path: tuple, value):
+        # Same as expand but every level is resolved through _node. Must be called
+        # with the lock held.
+        _root = [None]
+        _stack = [(path, value, _root, 0)]
+        while _stack:
+            _path, _value, parent, key = _stack.pop()
+            _out = self._node(_path, _value)
+            if isinstance(_out, dict):
+                _out = dict(_out)
+                _children = _out.items()
+            else:
+                _out = list(_out)
+                _children = enumerate(_out)
+            parent[key] = _out
+            _stack.extend((_path + (k,), v, _out, k) for k, v in _children
+                          if isinstance(v, (dict, list)))
+        return _root[0]
+
+    def get(self, path: Union[str, List[Union[str, int]]], default=None):
+        """
+        :param path: The path to a claim. A claim name or a list of claim names
+            and array positions
+        :param default: What to return if the claim is not there
+        :return: The claim value with all disclosures applied
+        """
+        if isinstance(path, str):
+            path = [path]
+
+        with self._lock:
+            return self._get(path, default)
+
+    def _get(self, path: list, default):
+        _node = self._node((), self._payload)
+        _path = ()
+        for step in path:
+            if isinstance(_node, dict):
+                _value = _node.get(step, _MISSING)
+            elif isinstance(_node, list) and isinstance(step, int):
+                if -len(_node) <= step < len(_node):
+                    # Negative positions are stored as the positive ones
+                    step %= len(_node)
+                    _value = _node[step]
+                else:
+                    _value = _MISSING
+            else:
+                _value = _MISSING
+
+            if _value is _MISSING:
+                return default
+            _path += (step,)
+            _node = self._node(_path, _value)
+
+        if isinstance(_node, (dict, list)):
+            return self._expand(_path, _node)
+        return _node
+
+    def __getitem__(self, item):
+        _value = self.get(item, _MISSING)
+        if _value is _MISSING:
+            raise KeyError(item)
+        return _value
+
+    def __contains__(self, item):
+        return self.get(item, _MISSING) is not _MISSING
+
+    def keys(self):
+        with self._lock:
+            return self._node((), self._payload).keys()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return self._expand((), self._payload)
+
+
+class ClaimIndex(object):
+    """
+    Maps claim paths to the digests of the disclosures that has to be released
+    for the claim to be visible to a verifier. A path is a sequence of claim names
+    and array positions. Array positions are the positions in the array in the
+    issuer signed JWT. The index is a tree with one node per claim, so building
+    it is linear in the size of the credential however deep disclosures are nested.
+    """
+
+    def __init__(self, payload: dict, disclosure_by_hash: dict):
+        # A node is [the digest of the disclosure that holds the claim or None,
+        # {claim name or array position: node}]
+        self.root = [None, {}]
+        self._build(payload, disclosure_by_hash)
+
+    def _build(self, payload: dict, disclosure_by_hash: dict):
+        _stack = [(payload, self.root)]
+        while _stack:
+            item, node = _stack.pop()
+            if isinstance(item, dict):
+                for _hash in item.get("_sd", []):
+                    _val = disclosure_by_hash.get(_hash)
+                    if _val:
+                        _child = node[1][_val[1]] = [_hash, {}]
+                        _stack.append((_val[2], _child))
+                for k, v in item.items():
+                    if k not in ['_sd', '_sd_alg']:
+                        _child = node[1][k] = [None, {}]
+                        _stack.append((v, _child))
+            elif isinstance(item, list):
+                for i, v in enumerate(item):
+                    if isinstance(v, dict) and "..." in v and len(v) == 1:
+                        _val = disclosure_by_hash.get(v["..."])
+                        if _val:
+                            _child = node[1][i] = [v["..."], {}]
+                            _stack.append((_val[1], _child))
+                    else:
+                        _child = node[1][i] = [None, {}]
+                        _stack.append((v, _child))
+
+    def digests(self, claims: List[List[Union[str, int]]]) -> List[str]:
+        """
+        :param claims: List of claim paths
+        :return: The digests of the disclosures that has to be released. For each
+            claim first the ones needed to reach it, outermost first, then the ones
+            below it.
+        """
+        res = {}
+        for claim in claims:
+            _node = self.root
+            for step in claim:
+                _node = _node[1].get(step)
+                if _node is None:
+                    raise KeyError(claim)
+                if _node[0]:
+                    res[_node[0]] = None
+
+            _below = []
+            _stack = list(_node[1].values())
+            while _stack:
+                _child = _stack.pop()
+                if _child[0]:
+                    _below.append(_child[0])
+                _stack.extend(_child[1].values())
+            for _hash in sorted(_below):
+                res[_hash] = None
+        return list(res.keys())
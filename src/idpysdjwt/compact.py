@@ -0,0 +1,177 @@
+import base64
+import re
+from typing import Iterator
+from typing import Optional
+from typing import Union
+
+from idpysdjwt import json_codec
+from idpysdjwt.disclosure import digest_function
+
+SEPARATOR = re.compile(b"~")
+
+
+def referenced_digests(payload: dict, unique: bool = False) -> set:
+    """
+    Collects the digests referenced from a payload, both the ones in '_sd' lists
+    and the ones in array elements of the form {'...': digest}.
+
+    :param payload: A SD-JWT payload or a disclosed value
+    :param unique: If True a digest that is referenced more than once raises ValueError
+    :return: A set of digests
+    """
+    res = set()
+
+    def _add(digest):
+        if unique and digest in res:
+            raise ValueError(f"Digest {digest} used more than once")
+        res.add(digest)
+
+    _stack = [payload]
+    while _stack:
+        item = _stack.pop()
+        if isinstance(item, dict):
+            if "..." in item and len(item) == 1:
+                _add(item["..."])
+                continue
+            for key, val in item.items():
+                if key == "_sd" and isinstance(val, list):
+                    for _digest in val:
+                        _add(_digest)
+                elif isinstance(val, (dict, list)):
+                    _stack.append(val)
+        elif isinstance(item, list):
+            _stack.extend(v for v in item if isinstance(v, (dict, list)))
+    return res
+
+
+class CompactSDJWT(object):
+    """
+    Parser for the compact SD-JWT format
+    <JWT>~<Disclosure 1>~...~<Disclosure N>~<optional KB-JWT>
+    working directly on a buffer. Disclosures are handed out as memoryview slices
+    of the buffer. A disclosure is only base64 and JSON decoded when it is asked for.
+    """
+
+    def __init__(self, msg: Union[str, bytes, bytearray, memoryview], hash_func: str = "sha-256"):
+        if isinstance(msg, str):
+            msg = msg.encode("ascii")
+        self._buffer = memoryview(msg)
+        self.hash_func = hash_func
+        self._jwt_end = None
+        self._kb_start = None
+        self._spans = None
+        self._digests = None
+        self._decoded = {}
+
+    def iter_spans(self) -> Iterator[tuple]:
+        """
+        Lazily finds the disclosures.
+
+        :return: An iterator over (start, end) offsets of the disclosures
+        """
+        if self._spans is not None:
+            yield from self._spans
+            return
+
+        _spans = []
+        _start = None
+        for _match in SEPARATOR.finditer(self._buffer):
+            if _start is None:
+                self._jwt_end = _match.start()
+            else:
+                _spans.append((_start, _match.start()))
+                yield _spans[-1]
+            _start = _match.end()
+
+        if _start is None:  # No separator at all, just a JWT
+            self._jwt_end = len(self._buffer)
+            _start = len(self._buffer)
+        self._kb_start = _start
+        self._spans = _spans
+
+    def _scan(self):
+        if self._spans is None:
+            for _ in self.iter_spans():
+                pass
+
+    @property
+    def jwt(self) -> str:
+        if self._jwt_end is None:
+            _match = SEPARATOR.search(self._buffer)
+            self._jwt_end = _match.start() if _match else len(self._buffer)
+        return str(self._buffer[:self._jwt_end], "ascii")
+
+    @property
+    def key_binding_jwt(self) -> str:
+        self._scan()
+        return str(self._buffer[self._kb_start:], "ascii")
+
+    def iter_disclosures(self) -> Iterator[memoryview]:
+        for _start, _end in self.iter_spans():
+            yield self._buffer[_start:_end]
+
+    def digests(self) -> dict:
+        """
+        :return: A dictionary with digest as key and the (start, end) offsets of the
+            disclosure as value.
+        """
+        if self._digests is None:
+            _digest = digest_function(self.hash_func)
+            self._digests = {}
+            for _start, _end in self.iter_spans():
+                self._digests[_digest(self._buffer[_start:_end])] = (_start, _end)
+        return self._digests
+
+    def disclosure(self, digest: str) -> Optional[list]:
+        """
+        :param digest: The digest of a disclosure
+        :return: The decoded disclosure or None if there is no disclosure with that digest
+        """
+        if digest in self._decoded:
+            return self._decoded[digest]
+
+        _span = self.digests().get(digest)
+        if _span is None:
+            return None
+        _raw = self._buffer[_span[0]:_span[1]]
+        _padding = b"=" * (-len(_raw) % 4)
+        _value = json_codec.loads(base64.urlsafe_b64decode(bytes(_raw) + _padding))
+        self._decoded[digest] = _value
+        return _value
+
+    @property
+    def decoded(self) -> dict:
+        """The disclosures decoded so far, digest as key and decoded disclosure as value."""
+        return self._decoded
+
+    def disclosure_string(self, digest: str) -> Optional[str]:
+        _span = self.digests().get(digest)
+        if _span is None:
+            return None
+        return str(self._buffer[_span[0]:_span[1]], "ascii")
+
+    def resolve(self, payload: dict) -> dict:
+        """
+        Decodes the disclosures that are referenced from the payload or from
+        disclosures that are themselves referenced.
+
+        :param payload: The verified payload of the JWT
+        :return: A dictionary with digest as key and decoded disclosure as value
+        """
+        res = {}
+        _available = self.digests()
+        _todo = [d for d in referenced_digests(payload) if d in _available]
+        while _todo:
+            _digest = _todo.pop()
+            if _digest in res:
+                continue
+            _value = self.disclosure(_digest)
+            res[_digest] = _value
+            if isinstance(_value[-1], (dict, list)):
+                _todo.extend(d for d in referenced_digests(_value[-1])
+                             if d in _available and d not in res)
+        return res
+
+    def __len__(self):
+        self._scan()
+        return len(self._spans)
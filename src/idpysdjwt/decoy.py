@@ -0,0 +1,196 @@
+import base64
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from idpysdjwt.disclosure import hash_name
+
+# Bytes of randomness behind every decoy digest
+DECOY_RANDOM_SIZE = 16
+
+
+class DecoyPool(object):
+    """
+    A pool of decoy digests, digests over random data that do not belong to any
+    disclosure. The pool is refilled by a background thread when it runs low so
+    that issuing a credential only has to take digests out of it. If the pool is
+    empty the digests are made inline.
+    """
+
+    def __init__(self, hash_func: str = "sha-256", size: int = 4096, refill_at: int = 1024):
+        self.hash_func = hash_func
+        self.size = size
+        self.refill_at = refill_at
+        # Counts the decoys that had to be made on the request path
+        self.generated_inline = 0
+        self._constructor = getattr(hashlib, hash_name(hash_func))
+        self._digests = deque()
+        self._wanted = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def _generate(self, number: int) -> List[str]:
+        _random = memoryview(secrets.token_bytes(number * DECOY_RANDOM_SIZE))
+        _encode = base64.urlsafe_b64encode
+        return [str(_encode(self._constructor(_random[i:i + DECOY_RANDOM_SIZE]).digest())
+                    .rstrip(b"="), "ascii")
+                for i in range(0, number * DECOY_RANDOM_SIZE, DECOY_RANDOM_SIZE)]
+
+    def fill(self, pause: bool = False):
+        """
+        Fills the pool up to size in the calling thread.
+
+        :param pause: Give other threads the interpreter between every batch
+        """
+        while len(self._digests) < self.size and not self._closed:
+            self._digests.extend(self._generate(min(64, self.size - len(self._digests))))
+            if pause:
+                time.sleep(0)
+
+    def _run(self):
+        while not self._closed:
+            self._wanted.wait()
+            self._wanted.clear()
+            # Small batches so that requests are not held up by the refill
+            self.fill(pause=True)
+
+    def _start(self):
+        with self._lock:
+            # A forked process does not inherit the thread
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="decoy-pool",
+                                                daemon=True)
+                self._thread.start()
+
+    def take(self, number: int) -> List[str]:
+        """
+        :param number: How many decoy digests that are needed
+        :return: List of decoy digests
+        """
+        if len(self._digests) < self.refill_at and not self._closed:
+            self._start()
+            self._wanted.set()
+
+        res = []
+        try:
+            for _ in range(number):
+                res.append(self._digests.popleft())
+        except IndexError:
+            self.generated_inline += number - len(res)
+            res.extend(self._generate(number - len(res)))
+        return res
+
+    def close(self):
+        """
+        Stops the refill thread. Digests that are taken after this are made inline.
+        """
+        self._closed = True
+        self._wanted.set()
+        _thread = self._thread
+        if _thread is not None and self._pid == os.getpid() and \
+                _thread is not threading.current_thread():
+            _thread.join()
+
+    def __len__(self):
+        return len(self._digests)
+
+
+class DecoyPolicy(object):
+    """
+    Decides how many decoy digests are added to each '_sd' list, so that a
+    verifier can not tell how many claims that were left undisclosed.
+
+    The number is the larger of a fixed count and the padding needed to reach
+    minimum digests on the level, plus a random number from random_range
+    (inclusive).
+
+    Decoys are only added to '_sd' lists, not to arrays. Array elements are
+    addressed by position in claim paths (ClaimIndex, LazyClaims) and a decoy
+    element would move the elements that follow it.
+    """
+
+    def __init__(self,
+                 count: int = 0,
+                 minimum: int = 0,
+                 random_range: Optional[Tuple[int, int]] = None,
+                 pool_size: int = 4096):
+        if count < 0 or minimum < 0 or pool_size < 0:
+            raise ValueError("count, minimum and pool_size can not be negative")
+        if random_range is not None:
+            if len(random_range) != 2 or not 0 <= random_range[0] <= random_range[1]:
+                raise ValueError(f"random_range {random_range} is not (low, high) "
+                                 f"with 0 <= low <= high")
+        self.count = count
+        self.minimum = minimum
+        self.random_range = random_range
+        self.pool_size = pool_size
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def number(self, real: int) -> int:
+        """
+        :param real: The number of digests on the level that belongs to disclosures
+        :return: The number of decoys to add
+        """
+        res = self.count
+        if self.minimum > real + res:
+            res = self.minimum - real
+        if self.random_range:
+            _low, _high = self.random_range
+            res += _low + secrets.randbelow(_high - _low + 1)
+        return res
+
+    def pool(self, hash_func: str) -> DecoyPool:
+        _pool = self._pools.get(hash_func)
+        if _pool is None:
+            with self._lock:
+                _pool = self._pools.get(hash_func)
+                if _pool is None:
+                    _pool = DecoyPool(hash_func, size=self.pool_size,
+                                      refill_at=self.pool_size // 4)
+                    if self._closed:
+                        _pool.close()
+                    self._pools[hash_func] = _pool
+        return _pool
+
+    def digests(self, real: int, hash_func: str = "sha-256") -> List[str]:
+        """
+        :param real: The number of digests on the level that belongs to disclosures
+        :param hash_func: The hash algorithm of the credential
+        :return: The decoy digests to add to the level
+        """
+        _number = self.number(real)
+        if not _number:
+            return []
+        return self.pool(hash_func).take(_number)
+
+    def close(self):
+        """
+        Stops the refill threads of the pools. Decoys are still added but made inline.
+        """
+        with self._lock:
+            self._closed = True
+            _pools = list(self._pools.values())
+        for _pool in _pools:
+            _pool.close()
+
+    def __getstate__(self):
+        # Pools hold threads, every process builds its own
+        _state = self.__dict__.copy()
+        _state["_pools"] = {}
+        del _state["_lock"]
+        return _state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
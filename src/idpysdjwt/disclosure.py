@@ -1,27 +1,149 @@
-import json
+import base64
+import hashlib
 import secrets
+from typing import Callable
 from typing import List
+from typing import Optional
+from typing import Union
 
 from cryptojwt import as_unicode
 from cryptojwt import b64d
 from cryptojwt import b64encode_item
-from cryptojwt.jwk import DIGEST_HASH
 from cryptojwt.utils import as_bytes
 from cryptojwt.utils import b64e
-
-
-def make_hash(disclosure, hash_func: str = "sha-256"):
-    _hash = DIGEST_HASH[hash_func.upper()](disclosure)
-    return as_unicode(b64encode_item(_hash))
-
-
-def parse_disclosure(specification: str, hash_func: str = "sha-256") -> tuple:
-    _disc = b64d(as_bytes(specification))
+from idpysdjwt import json_codec
+
+# The hash algorithms that can be used for _sd_alg, named as in the IANA
+# "Named Information Hash Algorithm" registry, and the hashlib names for them.
+HASH_ALGORITHMS = {
+    "sha-256": "sha256",
+    "sha-384": "sha384",
+    "sha-512": "sha512",
+    "sha3-256": "sha3_256",
+    "sha3-384": "sha3_384",
+    "sha3-512": "sha3_512",
+}
+
+_DIGEST_FUNCTIONS = {}
+
+
+def hash_name(hash_func: str) -> str:
+    """Translates names like 'sha-256' into the names hashlib uses, 'sha256'."""
+    _name = HASH_ALGORITHMS.get(hash_func.lower())
+    if _name is None:
+        raise ValueError(f"Not recognized hash algorithm {hash_func}")
+    return _name
+
+
+def digest_function(hash_func: Union[str, Callable] = "sha-256") -> Callable:
+    """
+    Resolves a hash algorithm name once into a function that maps a disclosure to
+    its base64url encoded digest.
+
+    :param hash_func: Hash algorithm name, e.g. 'sha-256' or 'sha3-512'. A function
+        returned by this function is passed through as it is.
+    :return: A function that takes a str or bytes-like disclosure and returns the digest.
+        The function has the algorithm name as attribute 'name'.
+    """
+    if callable(hash_func):
+        return hash_func
+
+    _func = _DIGEST_FUNCTIONS.get(hash_func)
+    if _func is None:
+        _constructor = getattr(hashlib, hash_name(hash_func))
+
+        def _func(disclosure) -> str:
+            if isinstance(disclosure, str):
+                disclosure = disclosure.encode("ascii")
+            return as_unicode(b64encode_item(_constructor(disclosure).digest()))
+
+        # The name to use for _sd_alg
+        _func.name = hash_func.lower()
+        _DIGEST_FUNCTIONS[hash_func] = _func
+    return _func
+
+
+def make_hash(disclosure, hash_func: Union[str, Callable] = "sha-256") -> str:
+    return digest_function(hash_func)(disclosure)
+
+
+def parse_disclosure(specification: str, hash_func: str = "sha-256", cache=None) -> tuple:
+    """
+    :param specification: A base64url encoded disclosure
+    :param hash_func: Hash algorithm used to calculate the digest
+    :param cache: An optional idpysdjwt.cache.DisclosureCache instance
+    :return: tuple with the decoded disclosure and its digest
+    """
+    if cache is not None:
+        _cached = cache.get(specification, hash_func)
+        if _cached is not None:
+            return _cached
+
+    _disc = json_codec.loads(b64d(as_bytes(specification)))
     _hash = make_hash(specification, hash_func)
-    return json.loads(_disc), _hash
+    if cache is not None:
+        cache.put(specification, hash_func, _disc, _hash)
+    return _disc, _hash
+
+
+SALT_SIZE = 16
+
+
+def make_salts(number: int, size: int = SALT_SIZE) -> List[str]:
+    """
+    Draws the randomness for a number of salts in one call.
+
+    :param number: The number of salts
+    :param size: The number of random bytes per salt
+    :return: List of base64url encoded salts
+    """
+    _random = memoryview(secrets.token_bytes(number * size))
+    _encode = base64.urlsafe_b64encode
+    return [str(_encode(_random[i:i + size]).rstrip(b"="), "ascii")
+            for i in range(0, number * size, size)]
+
+
+def encode_disclosures(specs: List[list],
+                       hash_func: Union[str, Callable] = "sha-256",
+                       salts: Optional[List[str]] = None,
+                       value_cache=None) -> List[tuple]:
+    """
+    Salts, encodes and hashes a number of disclosures in one pass.
+
+    :param specs: The disclosures without salts, [name, value] for object
+        properties and [value] for array elements
+    :param hash_func: Hash algorithm name or a function returned by digest_function
+    :param salts: Salts to use, one per spec, by default new ones are created
+    :param value_cache: An optional idpysdjwt.cache.SerializationCache. The JSON text
+        of names and values is then taken from the cache and spliced in after the salt.
+    :return: List of (disclosure, digest) tuples in the same order as specs
+    """
+    _digest = digest_function(hash_func)
+    if salts is None:
+        salts = make_salts(len(specs))
+    elif len(salts) != len(specs):
+        raise ValueError(f"{len(salts)} salts for {len(specs)} disclosures")
+    _encode = base64.urlsafe_b64encode
+    res = []
+    if value_cache is None:
+        _dumps = json_codec.dumps
+        for _salt, _spec in zip(salts, specs):
+            _encoded = _encode(_dumps([_salt, *_spec]).encode("utf-8")).rstrip(b"=")
+            res.append((str(_encoded, "ascii"), _digest(_encoded)))
+    else:
+        _dumps = value_cache.dumps
+        _sep = json_codec.SEPARATOR
+        for _salt, _spec in zip(salts, specs):
+            # Same text as dumps([salt, *spec]), salts are base64url and need no escaping
+            _text = f'["{_salt}"{_sep}{_sep.join([_dumps(v) for v in _spec])}]'
+            _encoded = _encode(_text.encode("utf-8")).rstrip(b"=")
+            res.append((str(_encoded, "ascii"), _digest(_encoded)))
+    return res
 
 
 class Disclosure(object):
+    # No per instance __dict__, batch jobs may hold very many of these
+    __slots__ = ()
 
     def __init__(self):
         pass
@@ -31,17 +153,18 @@ class Disclosure(object):
 
 
 def b64_encode(spec:list) -> str:
-    return as_unicode(b64e(as_bytes(json.dumps(spec))))
+    return as_unicode(b64e(as_bytes(json_codec.dumps(spec))))
 
 
 class ObjectDisclosure(Disclosure):
+    __slots__ = ("_value", "_name")
 
     def __init__(self, value, name: str):
         Disclosure.__init__(self)
         self._name = name
         self._value = value
 
-    def make(self, hash_func: str = "sha-256", salt: str = "") -> tuple:
+    def make(self, hash_func: Union[str, Callable] = "sha-256", salt: str = "") -> tuple:
         _salt = salt or as_unicode(b64e(secrets.token_bytes(16)))
 
         if self._name:
@@ -50,13 +173,14 @@ class ObjectDisclosure(Disclosure):
             _spec = [_salt, self._value]
 
         _disclosure = b64_encode(_spec)
-        return _disclosure, make_hash(_disclosure)
+        return _disclosure, make_hash(_disclosure, hash_func)
 
     def eval(self):
         return {self._name: self._value}
 
 
 class ArrayDisclosure(Disclosure):
+    __slots__ = ("_value",)
 
     def __init__(self, value):
         Disclosure.__init__(self)
@@ -66,10 +190,12 @@ class ArrayDisclosure(Disclosure):
         _salt = salt or as_unicode(b64e(secrets.token_bytes(16)))
         return b64_encode([_salt, val])
 
-    def make(self, hash_func: str = "sha-256", salt: List[str] = None) -> list:
+    def make(self, hash_func: Union[str, Callable] = "sha-256", salt: List[str] = None) -> list:
         if salt:
+            if len(salt) != len(self._value):
+                raise ValueError(f"{len(salt)} salts for {len(self._value)} disclosures")
+            _digest = digest_function(hash_func)
             _disc_arr = [self._make_single(val, sal) for val, sal in zip(self._value, salt)]
-        else:
-            _disc_arr = [self._make_single(val) for val in self._value]
+            return [(_d, _digest(_d)) for _d in _disc_arr]
 
-        return [(_d, make_hash(_d, hash_func)) for _d in _disc_arr]
+        return encode_disclosures([[val] for val in self._value], hash_func)
@@ -0,0 +1,121 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List
+from typing import Optional
+
+from cryptojwt import KeyJar
+from cryptojwt.jwk.jwk import key_from_jwk_dict
+from cryptojwt.jwt import utc_time_sans_frac
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.template import CredentialTemplate
+
+# The issuer used by a worker process, set up once by _init_worker
+_ISSUER = None
+
+
+def _init_worker(jwks: dict, config: dict, attributes: dict, template: CredentialTemplate):
+    global _ISSUER
+
+    _key_jar = KeyJar()
+    for owner, _jwks in jwks.items():
+        _key_jar.import_jwks(_jwks, owner)
+
+    _holder_key = config.pop("holder_key", None)
+    _ISSUER = Issuer(key_jar=_key_jar, **config)
+    for name, value in attributes.items():
+        setattr(_ISSUER, name, value)
+    _ISSUER.template = template
+    if _holder_key:
+        _ISSUER.holder_key = key_from_jwk_dict(_holder_key)
+
+
+def _issue(payloads: List[dict], kwargs: dict) -> List[str]:
+    return _ISSUER.create_holder_messages(payloads, **kwargs)
+
+
+class IssuanceEngine(object):
+    """
+    Spreads issuance over a pool of processes. Every worker gets a copy of the
+    issuer's keys, settings and credential template when it starts, after that
+    only payloads and the resulting SD-JWTs are passed between the processes.
+    An issuer with instrumentation can not be used, the measurements would stay
+    in the worker processes.
+    """
+
+    def __init__(self,
+                 issuer: Issuer,
+                 max_workers: Optional[int] = None,
+                 chunk_size: int = 100):
+        if issuer.instrumentation is not None:
+            raise ValueError("IssuanceEngine can not report instrumentation from its "
+                             "worker processes, use an issuer without instrumentation")
+        self.chunk_size = chunk_size
+        _jwks = {
+            owner: issuer.key_jar.export_jwks(private=True, issuer_id=owner)
+            for owner in issuer.key_jar.owners()
+        }
+        # Issuer constructor arguments, all but key_jar, the disclosure
+        # specifications, which are in the template, and instrumentation
+        _config = {
+            "iss": issuer.iss,
+            "lifetime": issuer.lifetime,
+            "sign": issuer.sign,
+            "sign_alg": issuer.alg,
+            "encrypt": issuer.encrypt,
+            "enc_enc": issuer.enc_enc,
+            "enc_alg": issuer.enc_alg,
+            "msg_cls": issuer.msg_cls,
+            "iss2msg_cls": issuer.iss2msg_cls,
+            "skew": issuer.skew,
+            "allowed_sign_algs": issuer.allowed_sign_algs,
+            "allowed_enc_algs": issuer.allowed_enc_algs,
+            "allowed_enc_encs": issuer.allowed_enc_encs,
+            "zip": issuer.zip,
+            "hash_func": issuer.hash_func,
+            "decoys": issuer.decoys,
+            "value_cache": issuer.value_cache,
+            "prepared_signer": issuer.prepared_signer,
+            "key_check_interval": issuer.key_check_interval,
+        }
+        if issuer.holder_key:
+            _config["holder_key"] = issuer.holder_key.serialize()
+        # Settings that are not constructor arguments
+        _attributes = {
+            "with_jti": issuer.with_jti,
+            "typ2msg_cls": getattr(issuer, "typ2msg_cls", {}),
+            "allowed_max_lifetime": getattr(issuer, "allowed_max_lifetime", None),
+            "objective_disclosure": issuer.objective_disclosure,
+            "array_disclosure": issuer.array_disclosure,
+        }
+
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker,
+            initargs=(_jwks, _config, _attributes, issuer.template))
+
+    def issue(self, payloads: List[dict], **kwargs) -> List[str]:
+        """
+        Issues one SD-JWT per payload.
+
+        :param payloads: A list of claims that should be visible in the payloads
+        :param kwargs: Extra keyword arguments passed on to Issuer.create_holder_messages
+        :return: List of SD-JWTs in the same order as the payloads
+        """
+        if "iat" not in kwargs:
+            # All chunks should have the same issued at time
+            kwargs["iat"] = utc_time_sans_frac()
+
+        _chunks = [payloads[i:i + self.chunk_size]
+                   for i in range(0, len(payloads), self.chunk_size)]
+        res = []
+        for _msgs in self.executor.map(_issue, _chunks, repeat(kwargs)):
+            res.extend(_msgs)
+        return res
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
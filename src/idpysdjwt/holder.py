@@ -1,13 +1,91 @@
 from typing import List
+from typing import Optional
+from typing import Union
 
-from idpyoidc.util import rndstr
+from cryptojwt import KeyJar
+from cryptojwt.exception import VerificationError
 
+from .cache import DisclosureCache
+from .cache import VerifiedJWTCache
+from .cache import key_jar_fingerprint
+from .claims import ClaimIndex
 from .disclosure import b64_encode
+from .instrumentation import Instrumentation
+from .instrumentation import start_timer
+from .key_binding import KeyBindingSigner
+from .key_index import KeyIndex
+from .replay import ReplayStore
 from .verifier import Verifier
 
 
 class Holder(Verifier):
 
+    def __init__(
+            self,
+            key_jar: KeyJar = None,
+            iss: str = "",
+            lifetime: int = 0,
+            sign: bool = True,
+            sign_alg: str = "RS256",
+            encrypt: bool = False,
+            enc_enc: str = "A128GCM",
+            enc_alg: str = "RSA-OAEP-256",
+            msg_cls=None,
+            iss2msg_cls=None,
+            skew: int = 15,
+            allowed_sign_algs: List[str] = None,
+            allowed_enc_algs: List[str] = None,
+            allowed_enc_encs: List[str] = None,
+            zip: str = "",
+            sdjwt: str = "",
+            jwt_cache: Optional[VerifiedJWTCache] = None,
+            disclosure_cache: Optional[DisclosureCache] = None,
+            replay_store: Optional[ReplayStore] = None,
+            replay_window: int = 300,
+            key_index: Optional[KeyIndex] = None,
+            instrumentation: Optional[Instrumentation] = None,
+            kb_cache_ttl: int = 0,
+            key_check_interval: float = 1.0,
+    ):
+        # Set by parse, which Verifier.__init__ calls if sdjwt is given
+        self.claim_index = None
+        # For how long a key binding JWT may be reused for the same verifier, nonce
+        # and presentation. 0 means never.
+        self.kb_cache_ttl = kb_cache_ttl
+        # How often, in seconds, the key jar is checked for new holder keys
+        self.key_check_interval = key_check_interval
+        self._kb_signer = None
+        self._kb_fingerprint = None
+        Verifier.__init__(self,
+                          key_jar=key_jar,
+                          iss=iss,
+                          lifetime=lifetime,
+                          sign=sign,
+                          sign_alg=sign_alg,
+                          encrypt=encrypt,
+                          enc_enc=enc_enc,
+                          enc_alg=enc_alg,
+                          msg_cls=msg_cls,
+                          iss2msg_cls=iss2msg_cls,
+                          skew=skew,
+                          allowed_sign_algs=allowed_sign_algs,
+                          allowed_enc_algs=allowed_enc_algs,
+                          allowed_enc_encs=allowed_enc_encs,
+                          zip=zip,
+                          sdjwt=sdjwt,
+                          jwt_cache=jwt_cache,
+                          disclosure_cache=disclosure_cache,
+                          replay_store=replay_store,
+                          replay_window=replay_window,
+                          key_index=key_index,
+                          instrumentation=instrumentation,
+                          )
+
+    def parse(self, msg):
+        Verifier.parse(self, msg)
+        # Built once per credential, used when creating presentations
+        self.claim_index = ClaimIndex(self.jwt, self.disclosure_by_hash)
+
     def add_value(self, orig, new):
         if orig:
             if isinstance(orig, list):
@@ -25,19 +103,108 @@ class Holder(Verifier):
         else:
             return new
 
-    def create_key_binding_jwt(self, aud: str) -> str:
-        # _jwt = JWT(self.key_jar, sign_alg=self.alg)
-        return self.pack({'nonce': rndstr()}, aud=aud)
+    def key_binding_signer(self) -> KeyBindingSigner:
+        """
+        The signer is prepared once and replaced when the keys in the key jar changes,
+        which is checked at most every key_check_interval seconds. sd_hash is
+        calculated with the hash algorithm of the credential.
+        """
+        _fingerprint = key_jar_fingerprint(self.key_jar, self.key_check_interval)
+        _hash_func = (self.jwt or {}).get("_sd_alg", "sha-256")
+        if (self._kb_signer is None or self._kb_fingerprint != _fingerprint
+                or self._kb_signer.hash_func != _hash_func):
+            self._kb_signer = KeyBindingSigner(self.pack_key(self.iss), sign_alg=self.alg,
+                                               hash_func=_hash_func,
+                                               lifetime=self.lifetime,
+                                               cache_ttl=self.kb_cache_ttl)
+            self._kb_fingerprint = _fingerprint
+        return self._kb_signer
+
+    def create_key_binding_jwt(self, aud: str, nonce: str = "", presentation: str = "") -> str:
+        return self.key_binding_signer().sign(aud, nonce=nonce, presentation=presentation)
+
+    def _presentation(self, disclosures: List[str]) -> str:
+        _jwt, _separator, _ = self.sdjwt.partition("~")
+        if not _separator:
+            raise VerificationError("Not a SD-JWT, there is no '~' after the JWT")
+        _out_parts = [_jwt]
+        for _hash in disclosures:
+            # The disclosures are passed on exactly as they were received
+            _disclosure = self.disclosure_string_by_hash.get(_hash)
+            if _disclosure is None:
+                _disclosure = b64_encode(self.disclosure_by_hash[_hash])
+            _out_parts.append(_disclosure)
+        _out_parts.append('')
+        return "~".join(_out_parts)
 
     def create_verifier_message(self,
                                 disclosures: List[str],
                                 key_holder_jwt: bool = False,
-                                aud: str = ''):
-        _in_part = self.sdjwt.split("~")
-        _out_parts = [_in_part[0]]
-        _out_parts.extend([b64_encode(self.disclosure_by_hash[_hash]) for _hash in disclosures])
-        if key_holder_jwt:
-            _out_parts.append(self.create_key_binding_jwt(aud))
-        else:
-            _out_parts.append('')
-        return "~".join(_out_parts)
+                                aud: str = '',
+                                nonce: str = ''):
+        _timer = start_timer(self.instrumentation, self, "present")
+        try:
+            res = self._presentation(disclosures)
+            if _timer is not None:
+                _timer.mark("select")
+            if key_holder_jwt:
+                res += self.create_key_binding_jwt(aud, nonce=nonce, presentation=res)
+                if _timer is not None:
+                    _timer.mark("key_binding")
+        except BaseException as err:
+            if _timer is not None:
+                _timer.failed(err)
+            raise
+        if _timer is not None:
+            _timer.done(disclosures=len(disclosures), nbytes=len(res))
+        return res
+
+    def create_verifier_messages(self,
+                                 disclosures: List[str],
+                                 audiences: List[str],
+                                 nonces: Optional[List[str]] = None) -> List[str]:
+        """
+        Creates the same presentation for a number of verifiers, each with its own
+        key binding JWT.
+
+        :param disclosures: The digests of the disclosures to release
+        :param audiences: The verifiers
+        :param nonces: The nonces the verifiers supplied
+        :return: List of presentations in the same order as the audiences
+        """
+        _timer = start_timer(self.instrumentation, self, "present_many")
+        try:
+            _presentation = self._presentation(disclosures)
+            if _timer is not None:
+                _timer.mark("select")
+            _kb_jwts = self.key_binding_signer().sign_many(audiences, nonces=nonces,
+                                                           presentation=_presentation)
+            res = [_presentation + _kb_jwt for _kb_jwt in _kb_jwts]
+        except BaseException as err:
+            if _timer is not None:
+                _timer.failed(err)
+            raise
+        if _timer is not None:
+            _timer.mark("key_binding")
+            _timer.done(disclosures=len(disclosures), nbytes=sum(len(r) for r in res))
+        return res
+
+    def present(self,
+                claims: Optional[List[List[Union[str, int]]]] = None,
+                key_holder_jwt: bool = False,
+                aud: str = '',
+                nonce: str = ''):
+        """
+        Creates a presentation that discloses the given claims.
+
+        :param claims: List of claim paths, e.g. [["address", "country"], ["nationalities", 0]].
+            If the claim is inside a disclosed object, that disclosure is released too.
+        :param key_holder_jwt: Whether a key binding JWT should be added
+        :param aud: The audience of the key binding JWT
+        :param nonce: The nonce supplied by the verifier
+        :return: A SD-JWT
+        """
+        if self.claim_index is None:
+            raise ValueError("No credential, parse one before creating a presentation")
+        return self.create_verifier_message(self.claim_index.digests(claims or []),
+                                            key_holder_jwt=key_holder_jwt, aud=aud, nonce=nonce)
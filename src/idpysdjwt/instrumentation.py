@@ -0,0 +1,257 @@
+"""
+Timing of what the issuer, holder and verifier spend their time on.
+
+Instrumentation is off unless an Instrumentation instance is given to the
+entity, then the only cost is a check for None per stage. When on, every
+operation is timed stage by stage and reported as an Operation to
+Instrumentation.record. An operation that raises an exception is reported
+too, with the name of the exception as error and the stages it completed.
+
+The operations and their stages are
+
+* Issuer, issue: construct, sign, serialize
+* Issuer, issue_batch: prepare, construct, sign, serialize. Stage times are summed
+  over the credentials in the batch. Also used by issue with a prepared signer.
+* Holder, present and present_many: select, key_binding
+* Verifier (and Holder when parsing), verify: split, signature, disclosures,
+  expand, key_binding
+
+The entity is the class name of the instance, so subclasses are reported under
+their own names.
+
+Apart from CallbackInstrumentation and StatsInstrumentation there are
+OpenTelemetryInstrumentation and PrometheusInstrumentation, which need the
+opentelemetry-api and prometheus_client packages.
+"""
+import threading
+import time
+from typing import Callable
+from typing import NamedTuple
+from typing import Optional
+
+try:
+    from opentelemetry import trace
+except ImportError:  # pragma: no cover
+    trace = None
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+
+class Operation(NamedTuple):
+    """The measurements of one operation."""
+    entity: str
+    name: str
+    # When the operation started, seconds since the epoch
+    start: float
+    seconds: float
+    # Stage name as key and the time spent in the stage as value, in the order
+    # the stages were entered
+    stages: dict
+    disclosures: int = 0
+    # The size of the SD-JWT created or verified
+    nbytes: int = 0
+    # The class name of the exception if the operation failed, empty if it succeeded
+    error: str = ""
+
+
+class StageTimer(object):
+    """Times the stages of one operation."""
+
+    __slots__ = ("instrumentation", "entity", "name", "start", "stages", "_begin", "_mark",
+                 "_ended")
+
+    def __init__(self, instrumentation: "Instrumentation", entity: str, name: str):
+        self.instrumentation = instrumentation
+        self.entity = entity
+        self.name = name
+        self.start = time.time()
+        self.stages = {}
+        self._begin = self._mark = time.perf_counter()
+        self._ended = False
+
+    def mark(self, stage: str):
+        """
+        Ends a stage. The stage started when the previous one ended.
+
+        :param stage: The name of the stage
+        """
+        _now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + _now - self._mark
+        self._mark = _now
+
+    def done(self, disclosures: int = 0, nbytes: int = 0):
+        """
+        Ends the operation and reports it.
+
+        :param disclosures: The number of disclosures in the SD-JWT
+        :param nbytes: The size of the SD-JWT
+        """
+        self._ended = True
+        self.instrumentation.record(
+            Operation(entity=self.entity, name=self.name, start=self.start,
+                      seconds=time.perf_counter() - self._begin, stages=self.stages,
+                      disclosures=disclosures, nbytes=nbytes))
+
+    def failed(self, error: BaseException):
+        """
+        Ends an operation that raised an exception and reports it, unless it has
+        already been reported.
+
+        :param error: The exception
+        """
+        if self._ended:
+            return
+        self._ended = True
+        self.instrumentation.record(
+            Operation(entity=self.entity, name=self.name, start=self.start,
+                      seconds=time.perf_counter() - self._begin, stages=self.stages,
+                      error=type(error).__name__))
+
+
+class Instrumentation(object):
+    """Receives the measurements. Subclasses override record."""
+
+    def timer(self, entity: str, name: str) -> StageTimer:
+        return StageTimer(self, entity, name)
+
+    def record(self, operation: Operation):
+        """
+        Called once per operation. Does nothing, measurements are dropped.
+
+        :param operation: The measurements
+        """
+
+
+def start_timer(instrumentation: Optional[Instrumentation], entity,
+                name: str) -> Optional[StageTimer]:
+    """
+    :param instrumentation: An Instrumentation instance or None
+    :param entity: The instance that does the operation
+    :param name: The name of the operation
+    :return: A StageTimer or None if instrumentation is off
+    """
+    if instrumentation is None:
+        return None
+    return instrumentation.timer(type(entity).__name__, name)
+
+
+class CallbackInstrumentation(Instrumentation):
+    """Calls a function with every Operation."""
+
+    def __init__(self, callback: Callable[[Operation], None]):
+        self.callback = callback
+
+    def record(self, operation: Operation):
+        self.callback(operation)
+
+
+class StatsInstrumentation(Instrumentation):
+    """Keeps count, total and max time per entity, operation and stage in memory."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _add(self, key: tuple, seconds: float, disclosures: int = 0, nbytes: int = 0,
+             error: str = ""):
+        # Must be called with the lock held
+        _entry = self._stats.get(key)
+        if _entry is None:
+            _entry = self._stats[key] = {"count": 0, "seconds": 0.0, "max": 0.0,
+                                         "disclosures": 0, "bytes": 0, "errors": 0}
+        _entry["count"] += 1
+        _entry["seconds"] += seconds
+        _entry["max"] = max(_entry["max"], seconds)
+        _entry["disclosures"] += disclosures
+        _entry["bytes"] += nbytes
+        if error:
+            _entry["errors"] += 1
+
+    def record(self, operation: Operation):
+        with self._lock:
+            self._add((operation.entity, operation.name, "total"), operation.seconds,
+                      operation.disclosures, operation.nbytes, operation.error)
+            for stage, seconds in operation.stages.items():
+                self._add((operation.entity, operation.name, stage), seconds)
+
+    def stats(self) -> dict:
+        """
+        :return: (entity, operation, stage) as key and a dictionary with count,
+            seconds, max, disclosures, bytes and errors as value. The stage 'total'
+            is the whole operation, failed ones included, errors counts the failed
+            ones.
+        """
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """
+    Creates one span per operation, named <entity>.<operation>, with the stage
+    times, the number of disclosures and the size as attributes. The span of a
+    failed operation has error status and the exception name as error.type.
+    """
+
+    def __init__(self, tracer=None):
+        if trace is None:
+            raise ValueError("opentelemetry-api is not installed")
+        self.tracer = tracer or trace.get_tracer("idpysdjwt")
+
+    def record(self, operation: Operation):
+        _start = int(operation.start * 1e9)
+        _attributes = {f"sdjwt.stage.{k}.seconds": v for k, v in operation.stages.items()}
+        _attributes["sdjwt.disclosures"] = operation.disclosures
+        _attributes["sdjwt.bytes"] = operation.nbytes
+        if operation.error:
+            _attributes["error.type"] = operation.error
+        _span = self.tracer.start_span(f"{operation.entity}.{operation.name}",
+                                       start_time=_start, attributes=_attributes)
+        if operation.error:
+            _span.set_status(trace.Status(trace.StatusCode.ERROR))
+        _span.end(end_time=_start + int(operation.seconds * 1e9))
+
+
+class PrometheusInstrumentation(Instrumentation):
+    """
+    Exports the histograms <prefix>_operation_seconds and <prefix>_stage_seconds
+    and the counters <prefix>_disclosures, <prefix>_bytes and <prefix>_errors, all
+    labelled with entity and operation. The errors are also labelled with the
+    exception name as error.
+    """
+
+    def __init__(self, registry=None, prefix: str = "sdjwt"):
+        if prometheus_client is None:
+            raise ValueError("prometheus_client is not installed")
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+        _labels = ["entity", "operation"]
+        self.operation_seconds = prometheus_client.Histogram(
+            f"{prefix}_operation_seconds", "Time per SD-JWT operation", _labels,
+            registry=registry)
+        self.stage_seconds = prometheus_client.Histogram(
+            f"{prefix}_stage_seconds", "Time per stage of a SD-JWT operation",
+            _labels + ["stage"], registry=registry)
+        self.disclosures = prometheus_client.Counter(
+            f"{prefix}_disclosures", "Disclosures handled", _labels, registry=registry)
+        self.bytes = prometheus_client.Counter(
+            f"{prefix}_bytes", "Size of the SD-JWTs handled", _labels, registry=registry)
+        self.errors = prometheus_client.Counter(
+            f"{prefix}_errors", "Failed SD-JWT operations", _labels + ["error"],
+            registry=registry)
+
+    def record(self, operation: Operation):
+        _labels = (operation.entity, operation.name)
+        self.operation_seconds.labels(*_labels).observe(operation.seconds)
+        for stage, seconds in operation.stages.items():
+            self.stage_seconds.labels(*_labels, stage).observe(seconds)
+        self.disclosures.labels(*_labels).inc(operation.disclosures)
+        self.bytes.labels(*_labels).inc(operation.nbytes)
+        if operation.error:
+            self.errors.labels(*_labels, operation.error).inc()
@@ -1,12 +1,51 @@
 import json
+import uuid
+from typing import Any
+from typing import Iterable
 from typing import List
+from typing import NamedTuple
 from typing import Optional
 
-from cryptojwt import JWK
 from cryptojwt import JWT
 from cryptojwt import KeyJar
+from cryptojwt.jwk import JWK
+from cryptojwt.jwk.asym import AsymmetricKey
+from cryptojwt.jws import Signer
+from cryptojwt.jws.jws import SIGNER_ALGS
+from cryptojwt.utils import b64encode_item
 from idpysdjwt import SD_TYP
+from idpysdjwt.cache import SerializationCache
+from idpysdjwt.cache import key_jar_fingerprint
+from idpysdjwt.decoy import DecoyPolicy
+from idpysdjwt.disclosure import digest_function
+from idpysdjwt.instrumentation import Instrumentation
+from idpysdjwt.instrumentation import start_timer
 from idpysdjwt.payload import Payload
+from idpysdjwt.template import CredentialTemplate
+
+# The create_holder_message arguments the prepared signer can handle
+_PREPARED_ARGS = {"kid", "issuer_id", "recv", "aud", "iat"}
+# Prepared signers kept per issuer, one per combination of key and JWS headers
+MAX_PREPARED_SIGNERS = 64
+
+
+class PreparedSigner(NamedTuple):
+    """A signing key resolved from the key jar together with the encoded protected header."""
+    key: JWK
+    signing_key: Any
+    signer: Signer
+    b64_header: str
+    # The key jar fingerprint when the signer was prepared
+    fingerprint: int
+
+    def sign(self, payload: str) -> str:
+        """
+        :param payload: The JSON encoded payload
+        :return: A compact JWS
+        """
+        _input = f"{self.b64_header}.{b64encode_item(payload).decode('utf-8')}"
+        _sig = self.signer.sign(_input.encode("utf-8"), self.signing_key)
+        return f"{_input}.{b64encode_item(_sig).decode('utf-8')}"
 
 
 class Issuer(JWT):
@@ -29,7 +68,13 @@ class Issuer(JWT):
                  zip: str = "",
                  objective_disclosure: Optional[dict] = None,
                  array_disclosure: Optional[dict] = None,
-                 holder_key: Optional[dict] = None
+                 holder_key: Optional[dict] = None,
+                 hash_func: str = "sha-256",
+                 decoys: Optional[DecoyPolicy] = None,
+                 value_cache: Optional[SerializationCache] = None,
+                 prepared_signer: bool = False,
+                 instrumentation: Optional[Instrumentation] = None,
+                 key_check_interval: float = 1.0
                  ):
         JWT.__init__(self,
                        key_jar=key_jar,
@@ -50,55 +95,245 @@ class Issuer(JWT):
 
         self.objective_disclosure = objective_disclosure
         self.array_disclosure = array_disclosure
-        self.payload = Payload()
+        # The disclosure specifications are compiled once and then used for every
+        # credential issued by this instance.
+        self.template = CredentialTemplate(objective_disclosure, array_disclosure)
+        # Shares the template, also holds the disclosures of the latest credential
+        self.payload = Payload.from_template(self.template)
         self.holder_key = holder_key
+        # Used for the disclosure digests and announced as _sd_alg
+        digest_function(hash_func)
+        self.hash_func = hash_func
+        # Decoy digests hide the number of selectively disclosable claims
+        self.decoys = decoys
+        # Claim values that repeat across credentials are serialized once
+        self.value_cache = value_cache
+        # If set, create_holder_message signs with a prepared signer instead of JWT.pack
+        self.prepared_signer = prepared_signer
+        # How often, in seconds, the key jar is checked for new signing keys
+        self.key_check_interval = key_check_interval
+        self._signers = {}
+        self._signers_fingerprint = None
+        # Optional receiver of per stage timings, see idpysdjwt.instrumentation
+        self.instrumentation = instrumentation
 
     def add_object_disclosure(self, path: List[str], key: str, value):
-        self.payload.add_object_disclosure(path, key, value)
+        self.template.add_object_disclosure(path, key, value)
 
     def add_array_disclosure(self, path: List[str], values: list):
-        self.payload.add_array_disclosure(path, values)
+        self.template.add_array_disclosure(path, values)
+
+    @staticmethod
+    def _jws_headers(jws_headers: Optional[dict] = None) -> dict:
+        if jws_headers is None:
+            jws_headers = {"typ": SD_TYP}
+        elif 'typ' not in jws_headers:
+            jws_headers['typ'] = SD_TYP
+        return jws_headers
+
+    def prepare_signer(self,
+                       jws_headers: Optional[dict] = None,
+                       kid: str = "",
+                       issuer_id: str = "") -> PreparedSigner:
+        """
+        Picks the signing key and encodes the protected header. The result is kept
+        and reused until the keys in the key jar changes, which is checked at most
+        every key_check_interval seconds.
+
+        :param jws_headers: JWS headers
+        :param kid: Key ID of the signing key
+        :param issuer_id: The owner of the keys that are to be used for signing
+        :return: A PreparedSigner instance
+        """
+        jws_headers = self._jws_headers(jws_headers)
+        if not issuer_id and self.iss:
+            issuer_id = self.iss
+
+        _fingerprint = key_jar_fingerprint(self.key_jar, self.key_check_interval)
+        if _fingerprint != self._signers_fingerprint:
+            # Prepared with keys that may be gone
+            self._signers = {}
+            self._signers_fingerprint = _fingerprint
+        _signers = self._signers
+        _cache_key = (issuer_id, kid, self.alg, json.dumps(jws_headers, sort_keys=True))
+        _prepared = _signers.get(_cache_key)
+        if _prepared is not None:
+            return _prepared
+
+        _key = self.pack_key(issuer_id, kid)
+        if isinstance(_key, AsymmetricKey):
+            _signing_key = _key.private_key()
+        else:
+            _signing_key = _key.key
+
+        # Same header as cryptojwt.jws.jws.JWS.sign_compact would have produced
+        _header = {"alg": self.alg}
+        _header.update(jws_headers)
+        _header["alg"] = self.alg
+        if _key.kid:
+            _header["kid"] = _key.kid
+
+        _prepared = PreparedSigner(key=_key, signing_key=_signing_key,
+                                   signer=SIGNER_ALGS[self.alg],
+                                   b64_header=b64encode_item(_header).decode("utf-8"),
+                                   fingerprint=_fingerprint)
+        if len(_signers) >= MAX_PREPARED_SIGNERS:
+            _signers.clear()
+        _signers[_cache_key] = _prepared
+        return _prepared
 
     def create_holder_message(self,
                               payload: Optional[dict] = None,
                               jws_headers: Optional[dict] = None,
                               holder_key: Optional[dict] = None,
+                              hash_func: Optional[str] = None,
                               **kwargs) -> str:
-        if jws_headers is None:
-            jws_headers = {"typ": SD_TYP}
-        elif 'typ' not in jws_headers:
-            jws_headers['typ'] = SD_TYP
+        if (self.prepared_signer and self.sign and not self.encrypt and self.alg != "none"
+                and set(kwargs).issubset(_PREPARED_ARGS)):
+            return self.create_holder_messages([payload or {}], jws_headers=jws_headers,
+                                               holder_key=holder_key, hash_func=hash_func,
+                                               **kwargs)[0]
 
-        _jwt = self.pack(payload=payload, jws_headers=jws_headers, **kwargs)
+        _timer = start_timer(self.instrumentation, self, "issue")
+        try:
+            jws_headers = self._jws_headers(jws_headers)
+            _load, _disclosure = self.template.construct(
+                payload, hash_func=hash_func or self.hash_func,
+                holder_key=holder_key or self.holder_key, decoys=self.decoys,
+                value_cache=self.value_cache)
+            if _timer is not None:
+                _timer.mark("construct")
+            _jwt = self.pack(payload=_load, jws_headers=jws_headers, **kwargs)
+        except BaseException as err:
+            if _timer is not None:
+                _timer.failed(err)
+            raise
+        if _timer is not None:
+            _timer.mark("sign")
 
         # The message format is
         # <JWT>~<Disclosure 1>~<Disclosure 2>~...~<Disclosure N>~<optional KB-JWT>
         _parts = [_jwt]
-        _parts.extend(self.get_disclosure())
+        _parts.extend(_disclosure)
         # No key binding JWT from here
         _parts.append("")
+        self.payload.disclosure = _disclosure
+
+        res = "~".join(_parts)
+        if _timer is not None:
+            _timer.mark("serialize")
+            _timer.done(disclosures=len(_disclosure), nbytes=len(res))
+        return res
+
+    def create_holder_messages(self,
+                               payloads: Iterable[dict],
+                               jws_headers: Optional[dict] = None,
+                               holder_key: Optional[dict] = None,
+                               kid: str = "",
+                               issuer_id: str = "",
+                               recv: str = "",
+                               aud: Optional[List[str]] = None,
+                               iat: Optional[int] = None,
+                               hash_func: Optional[str] = None) -> List[str]:
+        """
+        Creates one SD-JWT per payload. The signing key is picked and the
+        protected header is encoded once, see prepare_signer, and all credentials
+        in the batch gets the same issued at time.
+
+        :param payloads: An iterable of claims that should be visible in the payloads
+        :param jws_headers: JWS headers
+        :param holder_key: If a holder key should be bound to the credentials
+        :param kid: Key ID of the signing key
+        :param issuer_id: The owner of the keys that are to be used for signing
+        :param recv: The intended immediate receiver
+        :param aud: Intended audience
+        :param iat: Override issued at (default current timestamp)
+        :param hash_func: Hash algorithm for the disclosure digests, default self.hash_func
+        :return: List of SD-JWTs in the same order as the payloads
+        """
+        jws_headers = self._jws_headers(jws_headers)
+        hash_func = hash_func or self.hash_func
 
-        return "~".join(_parts)
+        if not self.sign or self.encrypt or self.alg == "none":
+            return [
+                self.create_holder_message(payload=payload, jws_headers=dict(jws_headers),
+                                           holder_key=holder_key, kid=kid, issuer_id=issuer_id,
+                                           recv=recv, aud=aud, iat=iat, hash_func=hash_func)
+                for payload in payloads
+            ]
+
+        _timer = start_timer(self.instrumentation, self, "issue_batch")
+        try:
+            _prepared = self.prepare_signer(jws_headers, kid=kid, issuer_id=issuer_id)
+            _init = self.pack_init(recv, aud, iat)
+            holder_key = holder_key or self.holder_key
+            _digest = digest_function(hash_func)
+            if _timer is not None:
+                _timer.mark("prepare")
+
+            res = []
+            _disclosures = 0
+            _disclosure = []
+            for payload in payloads:
+                _load, _disclosure = self.template.construct(payload,
+                                                             hash_func=_digest,
+                                                             holder_key=holder_key,
+                                                             decoys=self.decoys,
+                                                             value_cache=self.value_cache)
+                _load.update(_init)
+                if self.with_jti:
+                    _load["jti"] = uuid.uuid4().hex
+                if _timer is not None:
+                    _timer.mark("construct")
+
+                _parts = [_prepared.sign(self.message(signing_key=_prepared.key, **_load))]
+                if _timer is not None:
+                    _timer.mark("sign")
+                _parts.extend(_disclosure)
+                _parts.append("")
+                res.append("~".join(_parts))
+                if _timer is not None:
+                    _timer.mark("serialize")
+                    _disclosures += len(_disclosure)
+        except BaseException as err:
+            if _timer is not None:
+                _timer.failed(err)
+            raise
+        self.payload.disclosure = _disclosure
+
+        if _timer is not None:
+            _timer.done(disclosures=_disclosures, nbytes=sum(len(r) for r in res))
+        return res
 
     def message(self,
-                signing_key: Optional[JWK] = None, # Not used
-                holder_key: Optional[JWK] = None,
-                **kwargs):
-        # This is used as a callback from cryptojwt.JWT
-        self.payload.args = kwargs
+                signing_key: Optional[JWK] = None,  # Not used
+                holder_key: Optional[AsymmetricKey] = None,
+                **kwargs) -> str:
+        """
+        Callback from cryptojwt.JWT.pack. Claims that are not yet a SD-JWT payload
+        gets their disclosures added from the template, the disclosures are then
+        available from get_disclosure.
 
-        if self.objective_disclosure:
-            self.payload.add_objects([], self.objective_disclosure)
-        if self.array_disclosure:
-            self.payload.add_arrays([], self.array_disclosure)
+        :param signing_key: Not used
+        :param holder_key: If a holder key should be bound to the credential
+        :param kwargs: The claims
+        :return: The JSON encoded payload
+        """
+        if "_sd_alg" in kwargs:
+            # Already constructed, as by create_holder_message
+            return JWT.message(self, signing_key, **kwargs)
 
-        holder_key = holder_key or self.holder_key
-        _load = self.payload.construct(hash_func='sha-256', holder_key=holder_key)
+        self.payload.args = kwargs
+        _load, self.payload.disclosure = self.template.construct(
+            kwargs, hash_func=self.hash_func, holder_key=holder_key or self.holder_key,
+            decoys=self.decoys, value_cache=self.value_cache)
         return json.dumps(_load)
 
     def get_disclosure(self):
+        """
+        :return: The disclosures of the latest credential created by this instance
+        """
         if not self.payload.disclosure:
             return ""
         else:
             return self.payload.disclosure
-
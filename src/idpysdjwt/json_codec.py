@@ -0,0 +1,95 @@
+"""
+The JSON encoding and decoding used for disclosures.
+
+Three backends are available:
+
+* 'auto', the default. orjson, if it is installed, is used for decoding. Encoding
+  is done with the json module so the output is the same whether orjson is
+  installed or not.
+* 'json', the json module for both.
+* 'orjson', orjson for both. Disclosures are then encoded without white space and
+  with non-ASCII characters as UTF-8. They are still deterministic and any
+  verifier can read them, but they are not byte for byte the same as with 'json'.
+
+The payload of the issuer signed JWT is always encoded with the json module.
+
+The backend is process global and read without locking, by SerializationCache
+among others. Call set_backend once, at startup, before any credentials are
+issued or verified.
+"""
+import json
+import math
+from typing import Callable
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# What is placed between the items of a JSON array by dumps
+SEPARATOR = ", "
+
+
+def _non_finite(value) -> bool:
+    """
+    :return: True if there is a NaN or infinite float anywhere in value
+    """
+    _stack = [value]
+    while _stack:
+        _item = _stack.pop()
+        if isinstance(_item, float):
+            if not math.isfinite(_item):
+                return True
+        elif isinstance(_item, dict):
+            _stack.extend(_item.values())
+        elif isinstance(_item, (list, tuple)):
+            _stack.extend(_item)
+    return False
+
+
+def _orjson_dumps(value) -> str:
+    try:
+        res = orjson.dumps(value).decode("utf-8")
+    except TypeError:
+        # Integers larger than 64 bits, for instance. Same format as orjson.
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    # orjson writes NaN and infinity as null, the json module keeps them
+    if "null" in res and _non_finite(value):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return res
+
+
+def _orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except ValueError:
+        # orjson does not handle everything the json module does, like integers
+        # larger than 64 bits or NaN
+        return json.loads(data)
+
+
+backend = "auto"
+dumps: Callable = json.dumps
+loads: Callable = _orjson_loads if orjson else json.loads
+
+
+def set_backend(name: str = "auto"):
+    """
+    Changes the backend for the whole process. Not to be called while other
+    threads encode or decode disclosures.
+
+    :param name: 'auto', 'json' or 'orjson'
+    """
+    global backend, dumps, loads, SEPARATOR
+
+    if name == "orjson" and orjson is None:
+        raise ValueError("orjson is not installed")
+    if name == "orjson":
+        dumps, loads, SEPARATOR = _orjson_dumps, _orjson_loads, ","
+    elif name == "json":
+        dumps, loads, SEPARATOR = json.dumps, json.loads, ", "
+    elif name == "auto":
+        dumps, loads, SEPARATOR = json.dumps, _orjson_loads if orjson else json.loads, ", "
+    else:
+        raise ValueError(f"Unknown JSON backend {name}")
+    backend = name
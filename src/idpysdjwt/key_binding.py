@@ -0,0 +1,145 @@
+import hashlib
+import threading
+import time
+from typing import List
+from typing import Optional
+
+from cryptojwt.jwk.asym import AsymmetricKey
+from cryptojwt.jws.jws import SIGNER_ALGS
+from cryptojwt.jwt import utc_time_sans_frac
+from cryptojwt.utils import b64encode_item
+from idpyoidc.util import rndstr
+from idpysdjwt import KB_TYP
+from idpysdjwt.disclosure import hash_name
+
+
+def sd_hash(presentation: str, hash_func: str = "sha-256") -> str:
+    """
+    The digest over a presentation, the issuer signed JWT and the disclosures
+    including the last '~', that binds a key binding JWT to the presentation.
+
+    :param presentation: <JWT>~<Disclosure 1>~...~<Disclosure N>~
+    :param hash_func: Hash algorithm
+    :return: base64url encoded digest
+    """
+    _digest = hashlib.new(hash_name(hash_func), presentation.encode("ascii")).digest()
+    return b64encode_item(_digest).decode("utf-8")
+
+
+class KeyBindingSigner(object):
+    """
+    Signs key binding JWTs with one holder key. The key handle and the protected
+    header are prepared once. If cache_ttl is set, a key binding JWT is reused
+    for the same audience, nonce and presentation for that many seconds.
+    """
+
+    def __init__(self,
+                 key,
+                 sign_alg: str = "ES256",
+                 hash_func: str = "sha-256",
+                 lifetime: int = 0,
+                 cache_ttl: int = 0,
+                 cache_size: int = 256):
+        self.key = key
+        self.alg = sign_alg
+        self.hash_func = hash_func
+        self.lifetime = lifetime
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+
+        if isinstance(key, AsymmetricKey):
+            self._signing_key = key.private_key()
+        else:
+            self._signing_key = key.key
+        self._signer = SIGNER_ALGS[sign_alg]
+
+        _header = {"alg": sign_alg, "typ": KB_TYP}
+        if key.kid:
+            _header["kid"] = key.kid
+        self._b64_header = b64encode_item(_header).decode("utf-8")
+
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.signed = 0
+        self.cache_hits = 0
+        self.seconds = 0.0
+
+    def _sign(self, payload: dict) -> str:
+        _start = time.perf_counter()
+        _input = f"{self._b64_header}.{b64encode_item(payload).decode('utf-8')}"
+        _sig = self._signer.sign(_input.encode("utf-8"), self._signing_key)
+        _jwt = f"{_input}.{b64encode_item(_sig).decode('utf-8')}"
+        with self._lock:
+            self.signed += 1
+            self.seconds += time.perf_counter() - _start
+        return _jwt
+
+    def sign(self,
+             aud: str,
+             nonce: str = "",
+             presentation: str = "",
+             iat: Optional[int] = None) -> str:
+        """
+        :param aud: The verifier
+        :param nonce: A nonce supplied by the verifier. A random one is used if none is given.
+        :param presentation: If given, the digest over it is added as sd_hash
+        :param iat: Issued at, default now
+        :return: A signed key binding JWT
+        """
+        return self.sign_many([aud], nonces=[nonce], presentation=presentation, iat=iat)[0]
+
+    def sign_many(self,
+                  audiences: List[str],
+                  nonces: Optional[List[str]] = None,
+                  presentation: str = "",
+                  iat: Optional[int] = None) -> List[str]:
+        """
+        Signs one key binding JWT per audience for the same presentation.
+
+        :param audiences: The verifiers
+        :param nonces: One nonce per verifier, random nonces are used for missing ones
+        :param presentation: If given, the digest over it is added as sd_hash
+        :param iat: Issued at, default now
+        :return: List of signed key binding JWTs in the same order as the audiences
+        """
+        iat = iat or utc_time_sans_frac()
+        _sd_hash = sd_hash(presentation, self.hash_func) if presentation else ""
+        nonces = nonces or []
+
+        res = []
+        for i, aud in enumerate(audiences):
+            nonce = nonces[i] if i < len(nonces) else ""
+            _key = None
+            if self.cache_ttl and nonce:
+                _key = (aud, nonce, _sd_hash)
+                with self._lock:
+                    _cached = self._cache.get(_key)
+                    if _cached and _cached[1] > iat:
+                        self.cache_hits += 1
+                        res.append(_cached[0])
+                        continue
+
+            _payload = {"nonce": nonce or rndstr(), "aud": aud, "iat": iat}
+            if self.lifetime:
+                _payload["exp"] = iat + self.lifetime
+            if _sd_hash:
+                _payload["sd_hash"] = _sd_hash
+            _jwt = self._sign(_payload)
+
+            if _key:
+                with self._lock:
+                    if len(self._cache) >= self.cache_size:
+                        self._cache = {k: v for k, v in self._cache.items() if v[1] > iat}
+                        if len(self._cache) >= self.cache_size:
+                            self._cache.pop(next(iter(self._cache)))
+                    self._cache[_key] = (_jwt, iat + self.cache_ttl)
+            res.append(_jwt)
+        return res
+
+    def stats(self) -> dict:
+        return {
+            "signed": self.signed,
+            "cache_hits": self.cache_hits,
+            "seconds": self.seconds,
+            "signed_per_second": self.signed / self.seconds if self.seconds else 0.0,
+        }
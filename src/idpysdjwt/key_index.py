@@ -0,0 +1,119 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from cryptojwt import KeyJar
+from cryptojwt.jwk.asym import AsymmetricKey
+from cryptojwt.jws.jws import SIGNER_ALGS
+from idpysdjwt.cache import _recall
+from idpysdjwt.cache import _remember
+from idpysdjwt.cache import key_jar_fingerprint
+
+
+class KeyIndex(object):
+    """
+    Maps (issuer, kid, alg) to the public key objects, as used by the
+    cryptography package, that can verify a JWS from that issuer. The index is
+    emptied when the keys in the key jar changes, which is checked at most every
+    check_interval seconds. Entries are dropped after ttl seconds so that keys
+    fetched from remote key bundles are refreshed. One index can be shared by
+    any number of threads and key jars.
+    """
+
+    def __init__(self, ttl: int = 300, check_interval: float = 1.0, max_size: int = 1024):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._index = OrderedDict()
+        # id(key_jar) as key and a weak reference to the key jar together with
+        # [number, checked, fingerprint] as value, see idpysdjwt.cache._remember.
+        # The number stands in for the key jar in the index and is never reused,
+        # entries of a key jar that is gone are dropped by ttl and max_size.
+        self._key_jars = {}
+        self._numbers = itertools.count()
+        self._lock = threading.Lock()
+        # Held while keys are looked up in a key jar after a miss
+        self._fill_lock = threading.Lock()
+
+    def _check(self, key_jar: KeyJar, now: float) -> list:
+        # Must be called with the lock held
+        _state = _recall(self._key_jars, key_jar)
+        if _state is None:
+            _state = [next(self._numbers), None, None]
+            _remember(self._key_jars, key_jar, _state)
+        elif now - _state[1] < self.check_interval:
+            return _state
+        _present = key_jar_fingerprint(key_jar)
+        if _state[2] is not None and _present != _state[2]:
+            self._index = OrderedDict(
+                (k, v) for k, v in self._index.items() if k[0] != _state[0])
+            self.invalidations += 1
+        _state[1] = now
+        _state[2] = _present
+        return _state
+
+    def _get(self, key: tuple, now: float) -> Optional[tuple]:
+        # Must be called with the lock held
+        _entry = self._index.get(key)
+        if _entry is not None and _entry[1] > now:
+            self._index.move_to_end(key)
+            self.hits += 1
+            return _entry[0]
+        return None
+
+    def keys(self, key_jar: KeyJar, jwt, now: Optional[float] = None) -> tuple:
+        """
+        :param key_jar: The key jar that holds the issuers' keys
+        :param jwt: A parsed JWS, cryptojwt.jws.utils.JWSig
+        :param now: The present time, default time.monotonic()
+        :return: tuple with the signer for the algorithm and the public keys
+        """
+        now = time.monotonic() if now is None else now
+        _alg = jwt.headers.get("alg", "")
+        _id = (jwt.payload().get("iss", ""), jwt.headers.get("kid", ""), _alg)
+        with self._lock:
+            _value = self._get((self._check(key_jar, now)[0],) + _id, now)
+        if _value is not None:
+            return _value
+
+        # One thread at a time fills the index, the others find what it added
+        with self._fill_lock:
+            with self._lock:
+                _state = self._check(key_jar, now)
+                _key = (_state[0],) + _id
+                _value = self._get(_key, now)
+                if _value is not None:
+                    return _value
+                self.misses += 1
+                _fingerprint = _state[2]
+
+            _public_keys = tuple(
+                k.public_key() if isinstance(k, AsymmetricKey) else k.key
+                for k in key_jar.get_jwt_verify_keys(jwt))
+            _value = (SIGNER_ALGS.get(_alg), _public_keys)
+            with self._lock:
+                # Not if the key jar was found to have changed in the meantime
+                if _state[2] == _fingerprint:
+                    self._index[_key] = (_value, now + self.ttl)
+                    self._index.move_to_end(_key)
+                    while len(self._index) > self.max_size:
+                        self._index.popitem(last=False)
+        return _value
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            # A new dictionary, the weak reference callbacks hold on to the old one
+            self._key_jars = {}
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+                "size": len(self._index)}
+
+    def __len__(self):
+        return len(self._index)
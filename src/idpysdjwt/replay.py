@@ -0,0 +1,130 @@
+import heapq
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class ReplayStoreFull(Exception):
+    """Raised when a value can not be remembered because the store is full."""
+
+
+class ReplayStore(object):
+    """
+    Remembers values, like the nonce in a key binding JWT, for as long as a
+    message carrying them could be accepted.
+    """
+
+    def add(self, key: str, expires_at: int, now: Optional[int] = None) -> bool:
+        """
+        Atomically checks if key has been seen before and if not remembers it.
+
+        :param key: The value to remember
+        :param expires_at: When the value can be forgotten
+        :param now: The present time, default time.time()
+        :return: True if the key was new, False if it has been seen before
+        :raises ReplayStoreFull: If the key is new but can not be remembered
+        """
+        raise NotImplementedError()
+
+
+class MemoryReplayStore(ReplayStore):
+    """
+    In memory store. Entries are placed in buckets of granularity seconds, a heap
+    of the bucket times tells which bucket expires next. Expired buckets are
+    dropped as time moves on. Entries that have not expired are never dropped, if
+    max_entries is reached new keys are refused with ReplayStoreFull.
+    """
+
+    def __init__(self, max_entries: int = 100000, granularity: int = 1):
+        self.max_entries = max_entries
+        self.granularity = granularity
+        self._seen = {}
+        self._buckets = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _expire(self, now: int):
+        # Buckets are dropped when all of their time span has passed
+        _current = now // self.granularity - 1
+        while self._heap and self._heap[0] <= _current:
+            for key in self._buckets.pop(heapq.heappop(self._heap)):
+                del self._seen[key]
+
+    def add(self, key: str, expires_at: int, now: Optional[int] = None) -> bool:
+        now = int(time.time()) if now is None else now
+        with self._lock:
+            self._expire(now)
+            if key in self._seen:
+                return False
+            if len(self._seen) >= self.max_entries:
+                raise ReplayStoreFull(f"{len(self._seen)} entries that have not expired")
+
+            _bucket = expires_at // self.granularity
+            self._seen[key] = _bucket
+            _keys = self._buckets.get(_bucket)
+            if _keys is None:
+                _keys = self._buckets[_bucket] = []
+                heapq.heappush(self._heap, _bucket)
+            _keys.append(key)
+            return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class SQLiteReplayStore(ReplayStore):
+    """
+    Store in a SQLite database so that several processes can share it. Expired
+    entries are removed every purge_interval additions. Every thread has its own
+    connection, so the database must be a file.
+    """
+
+    def __init__(self, path: str, purge_interval: int = 1000, timeout: float = 5.0):
+        if path == ":memory:" or not path or path.startswith("file::memory:"):
+            # Would be a database of its own per thread
+            raise ValueError("SQLiteReplayStore needs a file, use MemoryReplayStore instead")
+        self.path = path
+        self.purge_interval = purge_interval
+        self.timeout = timeout
+        self._local = threading.local()
+        self._additions = 0
+        self._lock = threading.Lock()
+        _db = self._connection()
+        _db.execute("CREATE TABLE IF NOT EXISTS replay (key TEXT PRIMARY KEY, expires INTEGER)")
+        _db.execute("CREATE INDEX IF NOT EXISTS replay_expires ON replay (expires)")
+        _db.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        _db = getattr(self._local, "db", None)
+        if _db is None:
+            _db = sqlite3.connect(self.path, timeout=self.timeout)
+            _db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = _db
+        return _db
+
+    def add(self, key: str, expires_at: int, now: Optional[int] = None) -> bool:
+        now = int(time.time()) if now is None else now
+        _db = self._connection()
+        with _db:
+            # An expired entry with the same key is replaced
+            _db.execute("DELETE FROM replay WHERE key = ? AND expires <= ?", (key, now))
+            _cursor = _db.execute("INSERT OR IGNORE INTO replay (key, expires) VALUES (?, ?)",
+                                  (key, expires_at))
+            _new = _cursor.rowcount == 1
+
+        with self._lock:
+            self._additions += 1
+            _purge = self._additions % self.purge_interval == 0
+        if _purge:
+            self.purge(now)
+        return _new
+
+    def purge(self, now: Optional[int] = None):
+        now = int(time.time()) if now is None else now
+        _db = self._connection()
+        with _db:
+            _db.execute("DELETE FROM replay WHERE expires <= ?", (now,))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM replay").fetchone()[0]
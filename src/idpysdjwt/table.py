@@ -0,0 +1,159 @@
+import base64
+import hashlib
+import json
+from array import array
+from typing import Iterator
+from typing import Optional
+from typing import Union
+
+from cryptojwt import b64d
+from idpysdjwt import json_codec
+from idpysdjwt.disclosure import hash_name
+
+
+class DisclosureTable(object):
+    """
+    Columnar storage for a large number of decoded disclosures. Salts, claim names
+    and JSON encoded values are kept in one byte buffer per column with the row
+    boundaries in offset arrays. Digests are stored as fixed width raw bytes.
+    Rows are looked up by digest through a sorted index built when needed.
+
+    A table can be used wherever a disclosure_by_hash dictionary is read, e.g.
+    LazyClaims or idpysdjwt.claims.expand.
+    """
+
+    __slots__ = ("hash_func", "digest_size", "_salts", "_salt_ends", "_names", "_name_ends",
+                 "_has_name", "_values", "_value_ends", "_digests", "_order")
+
+    def __init__(self, hash_func: str = "sha-256"):
+        self.hash_func = hash_func
+        self.digest_size = hashlib.new(hash_name(hash_func)).digest_size
+        self._salts = bytearray()
+        self._salt_ends = array("L")
+        self._names = bytearray()
+        self._name_ends = array("L")
+        self._has_name = bytearray()
+        self._values = bytearray()
+        self._value_ends = array("Q")
+        self._digests = bytearray()
+        # Row numbers sorted on digest, None when rows have been added since it was built
+        self._order = None
+
+    @classmethod
+    def from_dict(cls, disclosure_by_hash: dict, hash_func: str = "sha-256"):
+        """
+        :param disclosure_by_hash: digest as key and decoded disclosure as value
+        :param hash_func: The hash algorithm used for the digests
+        :return: DisclosureTable instance
+        """
+        _table = cls(hash_func)
+        for _digest, _disclosure in disclosure_by_hash.items():
+            _table.add_decoded(_disclosure, _digest)
+        return _table
+
+    def add(self, disclosure: Union[str, bytes]) -> int:
+        """
+        :param disclosure: A base64url encoded disclosure
+        :return: The row number
+        """
+        if isinstance(disclosure, str):
+            disclosure = disclosure.encode("ascii")
+        _digest = hashlib.new(hash_name(self.hash_func), disclosure).digest()
+        return self._append(json_codec.loads(b64d(disclosure)), _digest)
+
+    def add_decoded(self, disclosure: list, digest: str) -> int:
+        """
+        :param disclosure: A decoded disclosure, [salt, name, value] or [salt, value]
+        :param digest: The base64url encoded digest of the disclosure
+        :return: The row number
+        """
+        return self._append(disclosure, self._raw_digest(digest))
+
+    @staticmethod
+    def _raw_digest(digest: str) -> bytes:
+        return base64.urlsafe_b64decode(digest + "=" * (-len(digest) % 4))
+
+    def _append(self, disclosure: list, digest: bytes) -> int:
+        if len(digest) != self.digest_size:
+            raise ValueError("Digest of wrong size")
+        self._salts += disclosure[0].encode("utf-8")
+        self._salt_ends.append(len(self._salts))
+        if len(disclosure) == 3:
+            self._names += disclosure[1].encode("utf-8")
+            self._has_name.append(1)
+        else:
+            self._has_name.append(0)
+        self._name_ends.append(len(self._names))
+        self._values += json.dumps(disclosure[-1], separators=(",", ":")).encode("utf-8")
+        self._value_ends.append(len(self._values))
+        self._digests += digest
+        self._order = None
+        return len(self._value_ends) - 1
+
+    @staticmethod
+    def _span(ends: array, row: int) -> tuple:
+        return (ends[row - 1] if row else 0), ends[row]
+
+    def row(self, row: int) -> list:
+        """
+        :param row: Row number
+        :return: The decoded disclosure
+        """
+        _start, _end = self._span(self._salt_ends, row)
+        res = [self._salts[_start:_end].decode("utf-8")]
+        if self._has_name[row]:
+            _start, _end = self._span(self._name_ends, row)
+            res.append(self._names[_start:_end].decode("utf-8"))
+        _start, _end = self._span(self._value_ends, row)
+        res.append(json_codec.loads(bytes(self._values[_start:_end])))
+        return res
+
+    def _digest_at(self, row: int) -> bytes:
+        return bytes(self._digests[row * self.digest_size:(row + 1) * self.digest_size])
+
+    def _find(self, digest: bytes) -> int:
+        if self._order is None:
+            self._order = array("L", sorted(range(len(self)), key=self._digest_at))
+        _low, _high = 0, len(self._order)
+        while _low < _high:
+            _mid = (_low + _high) // 2
+            if self._digest_at(self._order[_mid]) < digest:
+                _low = _mid + 1
+            else:
+                _high = _mid
+        if _low < len(self._order) and self._digest_at(self._order[_low]) == digest:
+            return self._order[_low]
+        return -1
+
+    def get(self, digest: str, default=None) -> Optional[list]:
+        """
+        :param digest: The base64url encoded digest of a disclosure
+        :return: The decoded disclosure or default if there is none with that digest
+        """
+        try:
+            _raw = self._raw_digest(digest)
+        except ValueError:
+            return default
+        _row = self._find(_raw) if len(_raw) == self.digest_size else -1
+        return default if _row < 0 else self.row(_row)
+
+    # Same interface as idpysdjwt.compact.CompactSDJWT
+    disclosure = get
+
+    def __contains__(self, digest: str) -> bool:
+        return self.get(digest) is not None
+
+    def digests(self) -> Iterator[str]:
+        for row in range(len(self)):
+            yield str(base64.urlsafe_b64encode(self._digest_at(row)).rstrip(b"="), "ascii")
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used by the columns."""
+        return sum(len(c) * getattr(c, "itemsize", 1)
+                   for c in (self._salts, self._salt_ends, self._names, self._name_ends,
+                             self._has_name, self._values, self._value_ends, self._digests,
+                             self._order or ()))
+
+    def __len__(self):
+        return len(self._value_ends)
@@ -0,0 +1,346 @@
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Union
+
+from cryptojwt.jwk.asym import AsymmetricKey
+from idpysdjwt.cache import SerializationCache
+from idpysdjwt.decoy import DecoyPolicy
+from idpysdjwt.disclosure import ArrayDisclosure
+from idpysdjwt.disclosure import ObjectDisclosure
+from idpysdjwt.disclosure import digest_function
+from idpysdjwt.disclosure import encode_disclosures
+from idpysdjwt.disclosure import make_salts
+
+
+def flatten_objects(path: tuple, spec: dict, res: dict) -> dict:
+    """
+    Flattens an object disclosure specification, the same format as
+    Issuer.objective_disclosure, into a dictionary keyed by path.
+
+    :param path: The path to the place where the specification applies
+    :param spec: The specification
+    :param res: Where the result is collected
+    :return: A dictionary with path tuples as keys and lists of (name, value) as values
+    """
+    for tag, item in spec.items():
+        where = path if tag == "" else path + (tag,)
+        for key, val in item.items():
+            if isinstance(val, dict):
+                flatten_objects(where, {key: val}, res)
+            else:
+                res.setdefault(where, []).append((key, val))
+    return res
+
+
+def flatten_arrays(path: tuple, spec: dict, res: dict) -> dict:
+    """
+    Flattens an array disclosure specification, the same format as
+    Issuer.array_disclosure, into a dictionary keyed by path.
+
+    :param path: The path to the place where the specification applies
+    :param spec: The specification
+    :param res: Where the result is collected
+    :return: A dictionary with path tuples as keys and lists of values as values
+    """
+    for tag, item in spec.items():
+        where = path if tag == "" else path + (tag,)
+        if isinstance(item, dict):
+            flatten_arrays(where, item, res)
+        else:
+            res.setdefault(where, []).extend(item)
+    return res
+
+
+class Disclosed(object):
+    """
+    Marks a claim value, or an array element, as selectively disclosable. The
+    value may itself contain Disclosed values, which gives recursive disclosures,
+    but it can not be a Disclosed value.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def build_disclosures(claims: dict,
+                      hash_func: Union[str, Callable] = "sha-256",
+                      salts: Optional[List[str]] = None,
+                      decoys: Optional[DecoyPolicy] = None,
+                      sd_lists: Optional[list] = None) -> tuple:
+    """
+    Turns a claim set where some values are wrapped in Disclosed into a payload
+    and disclosures. The tree is walked once, without Python recursion, so
+    nesting depth is limited only by memory. Inner disclosures are created
+    before the ones that contain their digests, the disclosures of one nesting
+    depth are encoded together.
+
+    :param claims: The claim set
+    :param hash_func: Which hash function to use, a name or a function returned by
+        idpysdjwt.disclosure.digest_function
+    :param salts: Salts to use, one per Disclosed value. By default new ones are created.
+    :param decoys: Decides the number of decoy digests added to each '_sd' list
+    :param sd_lists: If given, the '_sd' lists that are created are added to it
+    :return: tuple with payload and list of disclosures
+    """
+    _digest = digest_function(hash_func)
+    # Breadth first list of containers, a node is always before its children
+    # and the nodes of one depth are next to each other. A Disclosed container
+    # is a child of the container the Disclosed value is in.
+    nodes = [claims]
+    depth = [0]
+    # Where each depth starts in nodes
+    levels = [0]
+    children = []
+    _number = 0
+    i = 0
+    while i < len(nodes):
+        _node = nodes[i]
+        _children = []
+        for v in (_node.values() if isinstance(_node, dict) else _node):
+            if isinstance(v, Disclosed):
+                _number += 1
+                v = v.value
+                if isinstance(v, Disclosed):
+                    raise ValueError("A Disclosed value can not be Disclosed again")
+            if isinstance(v, (dict, list)):
+                _depth = depth[i] + 1
+                if _depth == len(levels):
+                    levels.append(len(nodes))
+                _children.append(len(nodes))
+                nodes.append(v)
+                depth.append(_depth)
+            else:
+                _children.append(None)
+        children.append(_children)
+        i += 1
+
+    if salts is None:
+        salts = make_salts(_number)
+    elif len(salts) != _number:
+        raise ValueError(f"{len(salts)} salts for {_number} Disclosed values")
+    _used = 0
+    disclosures = []
+
+    # Deepest first. The disclosures of one depth only contain digests from
+    # deeper ones, so they are salted, encoded and hashed in one go.
+    result = [None] * len(nodes)
+    levels.append(len(nodes))
+    for _level in range(len(levels) - 2, -1, -1):
+        specs = []
+        # (list, index) where each digest goes, index is None for an '_sd' list
+        targets = []
+        # ('_sd' list, digests already in the claims) to finish when hashed
+        _pending = []
+        for i in range(levels[_level + 1] - 1, levels[_level] - 1, -1):
+            _node = nodes[i]
+            _children = children[i]
+            if isinstance(_node, dict):
+                _out = {}
+                _sd = []
+                _disclosed = False
+                for (k, v), _j in zip(_node.items(), _children):
+                    if isinstance(v, Disclosed):
+                        specs.append([k, v.value if _j is None else result[_j]])
+                        targets.append((_sd, None))
+                        _disclosed = True
+                    else:
+                        _out[k] = v if _j is None else result[_j]
+                if _disclosed:
+                    _pending.append((_sd, _out.get("_sd", [])))
+                    _out["_sd"] = _sd
+                result[i] = _out
+            else:
+                _out = []
+                for v, _j in zip(_node, _children):
+                    if isinstance(v, Disclosed):
+                        specs.append([v.value if _j is None else result[_j]])
+                        targets.append((_out, len(_out)))
+                        _out.append(None)
+                    else:
+                        _out.append(v if _j is None else result[_j])
+                result[i] = _out
+        if not specs:
+            continue
+        _encoded = encode_disclosures(specs, _digest, salts=salts[_used:_used + len(specs)])
+        _used += len(specs)
+        for (_target, _index), (_discl, _hash) in zip(targets, _encoded):
+            disclosures.append(_discl)
+            if _index is None:
+                _target.append(_hash)
+            else:
+                _target[_index] = {"...": _hash}
+        for _sd, _claimed in _pending:
+            _sd.extend(_claimed)
+            if decoys:
+                _sd.extend(decoys.digests(len(_sd), _digest.name))
+            _sd.sort()
+            if sd_lists is not None:
+                sd_lists.append(_sd)
+    return result[0], disclosures
+
+
+class CredentialTemplate(object):
+    """
+    A compiled description of the shape of a credential. The disclosure
+    specifications are walked once, when the template is built. Issuing from the
+    template only creates salts, disclosures and hashes. Nothing is stored on the
+    template while issuing so one template can be used for any number of credentials.
+    """
+
+    def __init__(self,
+                 objective_disclosure: Optional[dict] = None,
+                 array_disclosure: Optional[dict] = None):
+        self._objects = {}
+        self._arrays = {}
+        self._plan = None
+        if objective_disclosure:
+            self.add_objects([], objective_disclosure)
+        if array_disclosure:
+            self.add_arrays([], array_disclosure)
+
+    def add_objects(self, path: List[str], spec: dict):
+        flatten_objects(tuple(path), spec, self._objects)
+        self._plan = None
+
+    def add_object_disclosure(self, path: List[str], key: str, value):
+        self._objects.setdefault(tuple(path), []).append((key, value))
+        self._plan = None
+
+    def add_arrays(self, path: List[str], spec: dict):
+        flatten_arrays(tuple(path), spec, self._arrays)
+        self._plan = None
+
+    def add_array_disclosure(self, path: List[str], values: list):
+        self._arrays.setdefault(tuple(path), []).extend(values)
+        self._plan = None
+
+    def compile(self) -> list:
+        """
+        Precomputes, per path, the prefixes that has to be walked and the
+        disclosures that should be placed there.
+
+        :return: A list of (path, prefixes, is_array, disclosure) tuples
+        """
+        plan = []
+        for path, items in self._objects.items():
+            if not items:
+                continue
+            _prefixes = [path[:i] for i in range(1, len(path) + 1)]
+            plan.append((path, _prefixes, False, [ObjectDisclosure(v, k) for k, v in items]))
+        for path, values in self._arrays.items():
+            if not values:
+                continue
+            _prefixes = [path[:i] for i in range(1, len(path) + 1)]
+            plan.append((path, _prefixes, True, ArrayDisclosure(values)))
+        self._plan = plan
+        return plan
+
+    @staticmethod
+    def _node(copied: dict, prefixes: list, leaf_type):
+        # Containers that comes from the arguments are copied the first time they
+        # are visited so the arguments are never modified.
+        _where = copied[()]
+        _last = len(prefixes) - 1
+        for i, prefix in enumerate(prefixes):
+            _next = copied.get(prefix)
+            if _next is None:
+                _next = _where.get(prefix[-1])
+                if _next is None:
+                    _next = leaf_type() if i == _last else {}
+                else:
+                    _next = _next.copy()
+                _where[prefix[-1]] = _next
+                copied[prefix] = _next
+            _where = _next
+        return _where
+
+    def construct(self,
+                  args: Optional[dict] = None,
+                  hash_func: Union[str, Callable] = "sha-256",
+                  holder_key: Optional[AsymmetricKey] = None,
+                  objective_values: Optional[dict] = None,
+                  array_values: Optional[dict] = None,
+                  decoys: Optional[DecoyPolicy] = None,
+                  value_cache: Optional[SerializationCache] = None) -> tuple:
+        """
+        Creates the payload of a SD-JWT and the disclosures that goes with it.
+
+        :param args: Claims that should be visible in the payload. Values wrapped in
+            Disclosed are made selectively disclosable, also when nested.
+        :param hash_func: Which hash function to use, a name or a function returned by
+            idpysdjwt.disclosure.digest_function
+        :param holder_key: If a holder key should be bound to the credential
+        :param objective_values: Values that should replace the ones in the template.
+            Same format as the objective disclosure specification.
+        :param array_values: Values that should replace the ones in the template.
+            Same format as the array disclosure specification.
+        :param decoys: Decides the number of decoy digests added to each '_sd' list
+        :param value_cache: Cache of the JSON text of claim names and values
+        :return: tuple with payload and list of disclosures
+        """
+        plan = self._plan
+        if plan is None:
+            plan = self.compile()
+        # Resolved once for all disclosures in the credential
+        _digest = digest_function(hash_func)
+
+        _obj_val = {}
+        if objective_values:
+            for path, items in flatten_objects((), objective_values, {}).items():
+                for key, val in items:
+                    _obj_val[(path, key)] = val
+        _arr_val = flatten_arrays((), array_values, {}) if array_values else {}
+
+        _nested = []
+        _sd_lists = {}
+        res = dict(args or {})
+        if any(isinstance(v, (dict, list, Disclosed)) for v in res.values()):
+            _collected = []
+            res, _nested = build_disclosures(res, _digest, sd_lists=_collected)
+            _sd_lists = {id(_sd): _sd for _sd in _collected}
+        copied = {(): res}
+        # What to encode and where the digests should go
+        specs = []
+        targets = []
+        for path, prefixes, is_array, spec in plan:
+            if is_array:
+                _node = self._node(copied, prefixes, list)
+                for val in _arr_val.get(path, spec._value):
+                    specs.append([val])
+                    targets.append((_node, True))
+            else:
+                _node = self._node(copied, prefixes, dict)
+                _old = _node.get("_sd", [])
+                # Replaced by a copy
+                _sd_lists.pop(id(_old), None)
+                _sd = list(_old)
+                _node["_sd"] = _sd
+                _sd_lists[id(_sd)] = _sd
+                for _od in spec:
+                    _value = _od._value
+                    if _obj_val:
+                        _value = _obj_val.get((path, _od._name), _value)
+                    # Same shape as ObjectDisclosure.make, no name if it is empty
+                    specs.append([_od._name, _value] if _od._name else [_value])
+                    targets.append((_sd, False))
+
+        # All salts are drawn, and all disclosures encoded and hashed, in one go
+        disclosure = list(_nested)
+        _encoded = encode_disclosures(specs, _digest, value_cache=value_cache)
+        for (_target, is_array), (_discl, _hash) in zip(targets, _encoded):
+            disclosure.append(_discl)
+            _target.append({"...": _hash} if is_array else _hash)
+        for _sd in _sd_lists.values():
+            if decoys:
+                _sd.extend(decoys.digests(len(_sd), _digest.name))
+            _sd.sort()
+
+        res['_sd_alg'] = _digest.name
+        if holder_key:
+            res['cnf'] = {
+                "jwk": holder_key.serialize()
+            }
+        return res, disclosure
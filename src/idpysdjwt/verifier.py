@@ -1,13 +1,87 @@
+from types import MappingProxyType
 from typing import List
+from typing import NamedTuple
+from typing import Optional
 
 from cryptojwt import JWT
 from cryptojwt import KeyJar
+from cryptojwt.exception import BadSignature
 from cryptojwt.exception import VerificationError
-from cryptojwt.jwk import DIGEST_HASH
 from cryptojwt.jwk.jwk import key_from_jwk_dict
+from cryptojwt.jws.exception import NoSuitableSigningKeys
+from cryptojwt.jws.exception import SignerAlgError
 from cryptojwt.jws.jws import SIGNER_ALGS
 from cryptojwt.jws.jws import factory
+from cryptojwt.jwt import utc_time_sans_frac
+from idpysdjwt.cache import DisclosureCache
+from idpysdjwt.cache import VerifiedJWTCache
+from idpysdjwt.cache import key_jar_fingerprint
+from idpysdjwt.claims import LazyClaims
+from idpysdjwt.claims import expand
+from idpysdjwt.compact import CompactSDJWT
+from idpysdjwt.compact import referenced_digests
+from idpysdjwt.disclosure import digest_function
 from idpysdjwt.disclosure import parse_disclosure
+from idpysdjwt.instrumentation import Instrumentation
+from idpysdjwt.instrumentation import StageTimer
+from idpysdjwt.instrumentation import start_timer
+from idpysdjwt.key_binding import sd_hash
+from idpysdjwt.key_index import KeyIndex
+from idpysdjwt.replay import ReplayStore
+
+
+class VerifiedSDJWT(NamedTuple):
+    """
+    The result of a successful verification of a SD-JWT. The dictionaries are
+    not copied, so they must not be changed by the receiver.
+    """
+    sdjwt: str
+    jwt: dict
+    payload: dict
+    disclosure_by_hash: dict
+    payload_audience: str = ""
+    # The disclosures exactly as they appeared in the SD-JWT
+    disclosure_string_by_hash: Optional[dict] = None
+
+    def get(self, path, default=None):
+        """
+        :param path: The path to a claim. A claim name or a list of claim names
+            and array positions
+        :param default: What to return if the claim is not there
+        :return: The claim value
+        """
+        if isinstance(self.payload, LazyClaims):
+            return self.payload.get(path, default)
+
+        if isinstance(path, str):
+            path = [path]
+        _node = self.payload
+        for step in path:
+            try:
+                _node = _node[step]
+            except (KeyError, IndexError, TypeError):
+                return default
+        return _node
+
+
+class VerificationResult(NamedTuple):
+    """The outcome of verifying one SD-JWT in a batch."""
+    message: str
+    jwt: Optional[dict] = None
+    payload: Optional[dict] = None
+    disclosure_by_hash: Optional[dict] = None
+    payload_audience: str = ""
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @classmethod
+    def from_verified(cls, verified: VerifiedSDJWT) -> "VerificationResult":
+        return cls(message=verified.sdjwt, jwt=verified.jwt, payload=verified.payload,
+                   disclosure_by_hash=verified.disclosure_by_hash,
+                   payload_audience=verified.payload_audience)
 
 
 class Verifier(JWT):
@@ -30,6 +104,12 @@ class Verifier(JWT):
             allowed_enc_encs: List[str] = None,
             zip: str = "",
             sdjwt: str = "",
+            jwt_cache: Optional[VerifiedJWTCache] = None,
+            disclosure_cache: Optional[DisclosureCache] = None,
+            replay_store: Optional[ReplayStore] = None,
+            replay_window: int = 300,
+            key_index: Optional[KeyIndex] = None,
+            instrumentation: Optional[Instrumentation] = None,
     ):
 
         JWT.__init__(self,
@@ -56,83 +136,293 @@ class Verifier(JWT):
         self.payload = {}
         self.jwt = None
         self.aud = ""
+        self.payload_audience = ""
+        self.disclosure_by_hash = {}
+        self.disclosure_string_by_hash = {}
         self._hash_dict = {}
+        # Optional cache of verified issuer signed JWTs
+        self.jwt_cache = jwt_cache
+        # Optional cache of decoded disclosures and their digests
+        self.disclosure_cache = disclosure_cache
+        # Optional store of seen key binding JWT nonces. Key binding JWTs must then
+        # not be older than replay_window seconds, nor issued in the future.
+        self.replay_store = replay_store
+        self.replay_window = replay_window
+        # Optional index from issuer, kid and alg to public key objects
+        self.key_index = key_index
+        # Optional receiver of per stage timings, see idpysdjwt.instrumentation
+        self.instrumentation = instrumentation
         self.sdjwt = sdjwt
         if sdjwt:
             self.parse(sdjwt)
 
-    def _expand_array_disclosure(self, val):
-        res = []
-        for v in val:
-            if isinstance(v, dict) and "..." in v:
-                _val = self.disclosure_by_hash.get(v["..."])
-                if _val:
-                    res.append(_val[1])
-            else:
-                res.append(v)
+    def _process(self, item: dict, disclosure_by_hash: dict) -> dict:
+        # Handles disclosures nested to any depth, in objects as well as in arrays
+        return expand(item, disclosure_by_hash.get)
+
+    def evaluate(self, jwt_payload: dict, selective_disclosures: dict = None):
+        _hash_func = jwt_payload.get("_sd_alg", "sha-256")
+        _discl = [parse_disclosure(d, hash_func=_hash_func, cache=self.disclosure_cache)
+                  for d in selective_disclosures]
+        self.disclosure_by_hash = {_hash: _disc for _disc, _hash in _discl}
+
+        res = self._process(jwt_payload, self.disclosure_by_hash)
+
         return res
 
-    def _process(self, item: dict) -> dict:
-        res = {}
+    def verify(self, msg: str, lazy: bool = False) -> "VerifiedSDJWT":
+        """
+        Verifies a SD-JWT. Nothing is stored on this instance, neither are any
+        keys added to the key jar, so the same Verifier can be used by many threads.
 
-        for _hash in item.get("_sd", []):
-            _val = self.disclosure_by_hash.get(_hash)
-            if _val:
-                res.update({_val[1]: _val[2]})
+        :param msg: The SD-JWT
+        :param lazy: If True the payload of the result is a LazyClaims instance that
+            only applies disclosures to the claims that are accessed.
+            disclosure_by_hash is then a read only view of the disclosures that
+            have been decoded so far.
+        :return: A VerifiedSDJWT instance
+        """
+        return self._verify_with_keys(msg, {}, utc_time_sans_frac(), lazy=lazy)
 
-        for k, v in item.items():
-            if k in ['_sd', '_sd_alg']:
-                continue
+    def parse(self, msg):
+        _verified = self.verify(msg)
 
-            if isinstance(v, dict):
-                res[k] = self._process(v)
-            elif isinstance(v, list):
-                res[k] = self._expand_array_disclosure(v)
-            else:
-                res[k] = v
+        self.sdjwt = msg
+        self.jwt = _verified.jwt
+        self.disclosure_by_hash = _verified.disclosure_by_hash
+        self.payload = _verified.payload
+        self.payload_audience = _verified.payload_audience
+        self.disclosure_string_by_hash = _verified.disclosure_string_by_hash
 
-        return res
+    def _check_lifetime(self, info: dict, timestamp: int):
+        # Same checks as cryptojwt.jwt.JWT.unpack does
+        if "nbf" in info:
+            if timestamp < int(info["nbf"]) - self.skew:
+                raise VerificationError("Token not yet valid")
 
-    def evaluate(self, jwt_payload: dict, selective_disclosures: dict = None):
-        _discl = [parse_disclosure(d, hash_func='sha-256') for d in selective_disclosures]
-        self.disclosure_by_hash = {_hash: _disc for _disc, _hash in _discl}
+        if "exp" in info:
+            if timestamp >= int(info["exp"]) + self.skew:
+                raise VerificationError("Token expired")
 
-        res = self._process(jwt_payload)
+    def _check_replay(self, key_binding: dict, timestamp: int):
+        if "iat" not in key_binding:
+            raise VerificationError("Key binding JWT without iat")
+        _iat = int(key_binding["iat"])
+        if _iat > timestamp + self.skew:
+            raise VerificationError("Key binding JWT issued in the future")
+        # Older key binding JWTs are refused above, so the key is not needed
+        # after this. At most replay_window + 2 * skew from now, exp does not
+        # extend it.
+        _expires = _iat + self.replay_window + self.skew
+        if _expires <= timestamp:
+            raise VerificationError("Key binding JWT too old")
 
-        return res
+        if "jti" in key_binding:
+            _key = f"jti:{key_binding['jti']}"
+        elif "nonce" in key_binding:
+            _key = f"nonce:{key_binding['nonce']}"
+        else:
+            raise VerificationError("Key binding JWT without nonce")
 
-    def parse(self, msg):
-        self.sdjwt = msg
+        if not self.replay_store.add(_key, _expires, now=timestamp):
+            raise VerificationError("Replayed key binding JWT")
+
+    def _jws_factory(self, token: str):
+        if self.allowed_sign_algs:
+            return factory(token, alg=self.allowed_sign_algs)
+        else:
+            return factory(token)
+
+    def _verify_indexed(self, jws) -> dict:
+        # Verifies the issuer signed JWT with public keys from the key index
+        _alg = jws.headers.get("alg")
+        if not _alg or _alg.lower() == "none":
+            raise SignerAlgError("none not allowed")
+        if self.allowed_sign_algs and _alg not in self.allowed_sign_algs:
+            raise SignerAlgError(f"Signing algorithm {_alg} not allowed")
+
+        _signer, _keys = self.key_index.keys(self.key_jar, jws)
+        if _signer is None:
+            raise SignerAlgError(f"Unknown signing algorithm {_alg}")
+        if not _keys:
+            raise NoSuitableSigningKeys(f"No key with kid: {jws.headers.get('kid', '')}")
+
+        _input = jws.sign_input()
+        _signature = jws.signature()
+        for _key in _keys:
+            try:
+                if _signer.verify(_input, _signature, _key):
+                    return jws.payload()
+            except (BadSignature, IndexError, ValueError, TypeError):
+                continue
+        raise BadSignature()
+
+    def _needs_unpack(self, token: str) -> bool:
+        # Encrypted JWTs and message class profiles are left to JWT.unpack
+        return (token.count(".") == 4 or self.msg_cls is not None or bool(self.iss2msg_cls)
+                or bool(getattr(self, "typ2msg_cls", None))
+                or bool(getattr(self, "allowed_max_lifetime", None)))
+
+    def _prepare(self, msg: str) -> tuple:
+        # The cheap part, split the message and parse the JWS header and payload.
+        # The JWS verifier is None if the JWT must go through JWT.unpack.
         _part = msg.split("~")
+        if self._needs_unpack(_part[0]):
+            return _part, None
 
-        # deal with the signed JSON Web Token
-        self.jwt = self.unpack(_part[0])
+        _verifier = self._jws_factory(_part[0])
+        if not _verifier:
+            raise VerificationError("Not a signed JWT")
+        return _part, _verifier
 
-        # Bring in the disclosures to calculate the payload
+    def _verify_with_keys(self, msg: str, key_cache: dict, timestamp: int,
+                          lazy: bool = False) -> VerifiedSDJWT:
+        # Verifies one SD-JWT without changing the state of this instance
+        _timer = start_timer(self.instrumentation, self, "verify")
+        try:
+            _part, _verifier = self._prepare(msg)
+        except BaseException as err:
+            if _timer is not None:
+                _timer.failed(err)
+            raise
+        if _timer is not None:
+            _timer.mark("split")
+        return self._verify_prepared(msg, _part, _verifier, key_cache, timestamp, lazy,
+                                     timer=_timer)
 
-        self.payload = self.evaluate(self.jwt, _part[1:-1])
+    def _verify_jws(self, token: str, _verifier, key_cache: dict, timestamp: int) -> dict:
+        # Verifies the issuer signed JWT, unless it is in the cache
+        _jwt = None
+        if self.jwt_cache is not None:
+            _fingerprint = key_jar_fingerprint(self.key_jar, self.jwt_cache.check_interval)
+            _jwt = self.jwt_cache.get(token, _fingerprint, timestamp)
 
-        if _part[-1]:  # holder of key JWT
-            # This is the key that is carried in the JWT signed by the issuer
-            # The key belongs to the holder
-            _key = key_from_jwk_dict(self.jwt["cnf"]["jwk"])
+        if _jwt is None and self.key_index is not None:
+            _jwt = self._verify_indexed(_verifier.jwt)
+            self._check_lifetime(_jwt, timestamp)
+            if self.jwt_cache is not None:
+                self.jwt_cache.put(token, _jwt, _fingerprint, timestamp, self.skew)
+        elif _jwt is None:
+            _headers = _verifier.jwt.headers
+            _group = (_verifier.jwt.payload().get("iss", ""), _headers.get("kid", ""),
+                      _headers.get("alg", ""))
+            _keys = key_cache.get(_group)
+            if _keys is None:
+                _keys = key_cache[_group] = self.key_jar.get_jwt_verify_keys(_verifier.jwt)
 
-            self.key_jar.add_keys(issuer_id="", keys=[_key])
-            _holder_of_key = self.unpack(_part[-1])
-            if not _holder_of_key:
-                raise VerificationError("Could not verify holder of key JWT")
+            _jwt = _verifier.verify_compact(token, _keys)
+            self._check_lifetime(_jwt, timestamp)
+            if self.jwt_cache is not None:
+                self.jwt_cache.put(token, _jwt, _fingerprint, timestamp, self.skew)
+        else:
+            self._check_lifetime(_jwt, timestamp)
+        return _jwt
+
+    def _verify_prepared(self, msg: str, _part: list, _verifier, key_cache: dict,
+                         timestamp: int, lazy: bool = False,
+                         timer: Optional[StageTimer] = None) -> VerifiedSDJWT:
+        # Signature verification and disclosure hashing
+        if timer is None:
+            timer = start_timer(self.instrumentation, self, "verify")
+        try:
+            if _verifier is None:
+                _jwt = self.unpack(_part[0], timestamp=timestamp)
+                if not isinstance(_jwt, dict):
+                    # A message class instance
+                    _jwt = dict(_jwt.items())
             else:
-                self.payload_audience = _holder_of_key["aud"]
+                _jwt = self._verify_jws(_part[0], _verifier, key_cache, timestamp)
+
+            _hash_func = _jwt.get("_sd_alg", "sha-256")
+            # Raises ValueError for hash algorithms that are not supported
+            digest_function(_hash_func)
+            if timer is not None:
+                timer.mark("signature")
+
+            if lazy:
+                # Disclosures are hashed but only decoded when a claim needs them.
+                # Digests inside disclosures are checked by LazyClaims when used.
+                referenced_digests(_jwt, unique=True)
+                _parser = CompactSDJWT(msg, hash_func=_hash_func)
+                _payload = LazyClaims(_jwt, _parser)
+                # Read only, grows as claims are accessed
+                _disclosure_by_hash = MappingProxyType(_parser.decoded)
+                _disclosure_string_by_hash = None
+                if timer is not None:
+                    timer.mark("disclosures")
+            else:
+                _disclosure_by_hash = {}
+                _disclosure_string_by_hash = {}
+                for d in _part[1:-1]:
+                    _disc, _hash = parse_disclosure(d, hash_func=_hash_func,
+                                                    cache=self.disclosure_cache)
+                    _disclosure_by_hash[_hash] = _disc
+                    _disclosure_string_by_hash[_hash] = d
+                if timer is not None:
+                    timer.mark("disclosures")
+                _payload = self._process(_jwt, _disclosure_by_hash)
+                if timer is not None:
+                    timer.mark("expand")
+
+            _audience = ""
+            if _part[-1]:  # holder of key JWT
+                # Verified directly with the key the issuer bound to the credential
+                _key = key_from_jwk_dict(_jwt["cnf"]["jwk"])
+                _kb_verifier = self._jws_factory(_part[-1])
+                if not _kb_verifier:
+                    raise VerificationError("Could not verify holder of key JWT")
+                _holder_of_key = _kb_verifier.verify_compact(_part[-1], [_key])
+                self._check_lifetime(_holder_of_key, timestamp)
+                if "sd_hash" in _holder_of_key:
+                    _presentation = msg[:len(msg) - len(_part[-1])]
+                    if _holder_of_key["sd_hash"] != sd_hash(_presentation, _hash_func):
+                        raise VerificationError("sd_hash does not match the presentation")
+                if self.replay_store is not None:
+                    self._check_replay(_holder_of_key, timestamp)
+                _audience = _holder_of_key["aud"]
+                if timer is not None:
+                    timer.mark("key_binding")
+        except BaseException as err:
+            if timer is not None:
+                timer.failed(err)
+            raise
 
-        if "_sd_alg" in self.payload:
-            if self.payload['_sd_alg'] not in DIGEST_HASH:
-                raise ValueError(f"Not recognized hash algorithm {self.payload['_sd_alg']}")
+        if timer is not None:
+            timer.done(disclosures=len(_part) - 2, nbytes=len(msg))
+        return VerifiedSDJWT(sdjwt=msg, jwt=_jwt, payload=_payload,
+                             disclosure_by_hash=_disclosure_by_hash,
+                             payload_audience=_audience,
+                             disclosure_string_by_hash=_disclosure_string_by_hash)
+
+    def verify_many(self, messages: List[str]) -> List[VerificationResult]:
+        """
+        Verifies a number of SD-JWTs. Issuer keys are looked up once per
+        issuer, key ID and algorithm. Nothing is stored on this instance so it can
+        be used for other verifications at the same time.
+
+        :param messages: List of SD-JWTs
+        :return: One VerificationResult per message in the same order as the
+            messages. If a verification failed the exception is in the error attribute.
+        """
+        key_cache = {}
+        timestamp = utc_time_sans_frac()
+        res = []
+        for msg in messages:
+            try:
+                _verified = self._verify_with_keys(msg, key_cache, timestamp)
+            except Exception as err:
+                res.append(VerificationResult(message=msg, error=err))
+            else:
+                res.append(VerificationResult.from_verified(_verified))
+        return res
 
 
-def display_sdjwt(msg):
-    _part = msg.split("~")
+def display_sdjwt(msg, disclosure_cache: Optional[DisclosureCache] = None):
+    _parser = CompactSDJWT(msg)
 
     # deal with the signed JSON Web Token
-    _payload = factory(_part[0]).jwt.payload()
-    _discl = [parse_disclosure(d, hash_func='sha-256') for d in _part[1:-1]]
+    _payload = factory(_parser.jwt).jwt.payload()
+    _hash_func = _payload.get("_sd_alg", "sha-256")
+    _discl = [parse_disclosure(str(d, "ascii"), hash_func=_hash_func, cache=disclosure_cache)
+              for d in _parser.iter_disclosures()]
     return _payload, _discl
@@ -0,0 +1,88 @@
+import json
+
+from idpysdjwt.bench import compare
+from idpysdjwt.bench import credential_shape
+from idpysdjwt.bench import main
+from idpysdjwt.bench import report
+from idpysdjwt.bench import roles
+
+BASELINE = report({
+    "roles": {
+        "ES256, flat, 10 disclosures, issue (credentials/s)": 1000.0,
+        "ES256, p50 (ms)": 2.0,
+        "hit ratio": 0.9,
+    }
+})
+
+
+def test_credential_shapes():
+    for shape in ["flat", "nested", "array"]:
+        _objects, _arrays = credential_shape(shape, 100)
+        _count = 0
+        for _claims in _objects.values():
+            for _value in _claims.values():
+                _count += len(_value) if shape == "nested" else 1
+        if _arrays:
+            _count += sum(len(v) for v in _arrays.values())
+        assert _count == 100
+
+
+def test_roles():
+    res = roles(shapes=("nested",), sizes=(10,), algs=("ES256",))
+    assert set(res.keys()) == {
+        "ES256, nested, 10 disclosures, issue (credentials/s)",
+        "ES256, nested, 10 disclosures, present (presentations/s)",
+        "ES256, nested, 10 disclosures, verify (presentations/s)",
+    }
+    assert all(v > 0 for v in res.values())
+
+
+def test_compare():
+    assert compare(BASELINE, BASELINE) == []
+
+    _current = report({
+        "roles": {
+            "ES256, flat, 10 disclosures, issue (credentials/s)": 800.0,
+            "ES256, p50 (ms)": 2.1,
+            "hit ratio": 0.5,
+        }
+    })
+    _regressions = compare(BASELINE, _current)
+    assert len(_regressions) == 2
+    assert _regressions[0].startswith("roles: ES256, flat, 10 disclosures, issue")
+    assert _regressions[1].startswith("roles: hit ratio")
+
+    # Latency going up is a regression, going down is not
+    _current["results"]["roles"]["ES256, p50 (ms)"] = 3.0
+    assert len(compare(BASELINE, _current)) == 3
+    assert compare(_current, BASELINE) == []
+
+    # A measurement that is gone is a regression, a benchmark that was not run is not
+    del _current["results"]["roles"]["hit ratio"]
+    _current["results"]["roles"]["ES256, p50 (ms)"] = 2.0
+    _regressions = compare(BASELINE, _current)
+    assert _regressions[0] == "roles: hit ratio: 0.9 -> missing"
+    assert len(_regressions) == 2
+    assert compare(BASELINE, report({"batch_sizes": {}})) == []
+
+
+def test_higher_is_better():
+    _baseline = report({"key_index": {"index hits": 100, "index misses": 10, "Speedup": 2.0,
+                                      "compression ratio": 3.0, "miss ratio": 0.1,
+                                      "p99 (ms)": 3.0}})
+    _current = report({"key_index": {"index hits": 50, "index misses": 20, "Speedup": 1.0,
+                                     "compression ratio": 2.0, "miss ratio": 0.05,
+                                     "p99 (ms)": 6.0}})
+    assert [line.split(": ")[1] for line in compare(_baseline, _current)] == [
+        "index hits", "index misses", "Speedup", "compression ratio", "p99 (ms)"]
+
+
+def test_main_json(tmp_path):
+    _baseline = tmp_path / "baseline.json"
+    _baseline.write_text(json.dumps(report({"batch_sizes": {"batch of 1 (credentials/s)": 1e9}})))
+    _out = tmp_path / "out.json"
+    assert main(["batch_sizes", "--json", str(_out), "--baseline", str(_baseline)]) == 1
+    _report = json.loads(_out.read_text())
+    assert set(_report["results"]["batch_sizes"].keys()) == {
+        "batch of 1 (credentials/s)", "batch of 10 (credentials/s)",
+        "batch of 100 (credentials/s)", "batch of 1000 (credentials/s)"}
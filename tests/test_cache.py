@@ -0,0 +1,174 @@
+import gc
+import json
+
+from cryptojwt import KeyJar
+from cryptojwt.key_jar import build_keyjar
+from idpysdjwt.cache import DisclosureCache
+from idpysdjwt.cache import SerializationCache
+from idpysdjwt.cache import VerifiedJWTCache
+from idpysdjwt.cache import key_jar_fingerprint
+from idpysdjwt.disclosure import ObjectDisclosure
+from idpysdjwt.disclosure import encode_disclosures
+from idpysdjwt.disclosure import make_salts
+from idpysdjwt.disclosure import parse_disclosure
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.verifier import Verifier
+
+ALICE = "https://example.org/issuer"
+
+ALICE_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+ALICE_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(private=True), ALICE)
+
+
+def _verifier_key_jar():
+    _key_jar = KeyJar()
+    _key_jar.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+    return _key_jar
+
+
+def _message():
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure={"": {"given_name": "John", "family_name": "Doe"}})
+    return alice.create_holder_message(payload={"sub": "sub"})
+
+
+def test_verified_jwt_cache():
+    _msg = _message()
+    _jwt, _given_name, _family_name, _ = _msg.split("~")
+
+    _cache = VerifiedJWTCache(max_size=10)
+    charlie = Verifier(key_jar=_verifier_key_jar(), jwt_cache=_cache)
+
+    _res = charlie.verify(_msg)
+    assert _res.payload["given_name"] == "John"
+    assert _cache.stats() == {"hits": 0, "misses": 1, "size": 1}
+
+    # Same issuer signed JWT, different disclosures
+    _res = charlie.verify("~".join([_jwt, _family_name, ""]))
+    assert "given_name" not in _res.payload
+    assert _res.payload["family_name"] == "Doe"
+    assert _cache.stats()["hits"] == 1
+
+
+def test_verified_jwt_cache_expired():
+    _cache = VerifiedJWTCache(max_size=10, ttl=60)
+    _cache.put("token", {"exp": 1000}, 1, now=900)
+    assert _cache.get("token", 1, now=950) == {"exp": 1000}
+    assert _cache.get("token", 1, now=1000) is None
+    assert len(_cache) == 0
+
+
+def test_verified_jwt_cache_size():
+    _cache = VerifiedJWTCache(max_size=2)
+    for i in range(3):
+        _cache.put(f"token{i}", {"i": i}, 1, now=0)
+    assert len(_cache) == 2
+    assert _cache.get("token0", 1, now=0) is None
+
+
+def test_verified_jwt_cache_key_rotation():
+    _msg = _message()
+    _key_jar = _verifier_key_jar()
+    _cache = VerifiedJWTCache(check_interval=0)
+    charlie = Verifier(key_jar=_key_jar, jwt_cache=_cache)
+    charlie.verify(_msg)
+
+    _fingerprint = key_jar_fingerprint(_key_jar)
+    # The issuer publishes a new key
+    _new_key_jar = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+    _key_jar.import_jwks(_new_key_jar.export_jwks(), ALICE)
+    assert key_jar_fingerprint(_key_jar) != _fingerprint
+
+    charlie.verify(_msg)
+    assert _cache.stats()["hits"] == 0
+    assert _cache.stats()["misses"] == 2
+
+
+def test_key_jar_fingerprint():
+    _key_jar = _verifier_key_jar()
+    _fingerprint = key_jar_fingerprint(_key_jar)
+    # Same keys in another key jar
+    assert key_jar_fingerprint(_verifier_key_jar()) == _fingerprint
+
+    _new_key_jar = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+    _key_jar.import_jwks(_new_key_jar.export_jwks(), ALICE)
+    # Within max_age the key jar is not looked at
+    assert key_jar_fingerprint(_key_jar, max_age=60) == _fingerprint
+    assert key_jar_fingerprint(_key_jar) != _fingerprint
+
+    # A key jar that is garbage collected does not leave anything behind
+    del _key_jar
+    gc.collect()
+    _other = KeyJar()
+    assert key_jar_fingerprint(_other, max_age=60) == hash(())
+
+
+def test_disclosure_cache():
+    _msg = _message()
+    _cache = DisclosureCache(max_size=10)
+    charlie = Verifier(key_jar=_verifier_key_jar(), disclosure_cache=_cache)
+    charlie.verify(_msg)
+    assert _cache.stats() == {"hits": 0, "misses": 2, "size": 2}
+    _res = charlie.verify(_msg)
+    assert _cache.stats()["hits"] == 2
+    assert _res.payload["given_name"] == "John"
+
+    _disclosure = _msg.split("~")[1]
+    assert parse_disclosure(_disclosure, cache=_cache) == parse_disclosure(_disclosure)
+
+
+def test_disclosure_cache_copies_values():
+    _cache = DisclosureCache(max_size=1)
+    _disclosure = ObjectDisclosure({"country": "SE", "phone": ["+46 8 123"]},
+                                   "address").make()[0]
+    _first, _ = parse_disclosure(_disclosure, cache=_cache)
+    _second, _ = parse_disclosure(_disclosure, cache=_cache)
+    assert _second == _first
+    assert _second[2] is not _first[2]
+
+    # Changing a result does not change the cache or later results
+    _first[2]["country"] = "NO"
+    _second[2]["phone"].append("+46 8 456")
+    _third, _ = parse_disclosure(_disclosure, cache=_cache)
+    assert _third[2] == {"country": "SE", "phone": ["+46 8 123"]}
+
+    parse_disclosure(ObjectDisclosure("John", "given_name").make()[0], cache=_cache)
+    assert len(_cache) == 1
+
+
+def test_serialization_cache():
+    _cache = SerializationCache(max_size=8)
+    for value in ["US", "Möbius", 1, True, None, ("A", 2)]:
+        assert _cache.dumps(value) == json.dumps(value)
+        assert _cache.dumps(value) == json.dumps(value)
+    assert _cache.hits == 6
+    # Not hashable, never cached
+    assert _cache.dumps({"a": [1]}) == json.dumps({"a": [1]})
+    # Floats are not cached, 0.0 == -0.0 and NaN != NaN
+    for value in [0.0, -0.0, 1.0, float("nan"), (1, -0.0)]:
+        assert _cache.dumps(value) == json.dumps(value)
+    assert _cache.dumps(0.0) == "0.0"
+    assert len(_cache) == 6
+
+    for i in range(20):
+        _cache.dumps(f"value {i}")
+    assert len(_cache) <= 8
+
+
+def test_encode_disclosures_with_value_cache():
+    _specs = [["country", "US"], ["family_name", "Möbius"], ["US"], [{"a": 1}], ["n", 1.5]] * 3
+    _salts = make_salts(len(_specs))
+    _cache = SerializationCache()
+    assert encode_disclosures(_specs, salts=_salts, value_cache=_cache) == encode_disclosures(
+        _specs, salts=_salts)
+    assert _cache.hits > 0
+
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256",
+                   objective_disclosure={"address": {"country": "US"}},
+                   value_cache=SerializationCache())
+    _msgs = alice.create_holder_messages([{"sub": "a"}, {"sub": "b"}])
+    # Salts are still unique per disclosure
+    assert _msgs[0].split("~")[1] != _msgs[1].split("~")[1]
+    for _msg in _msgs:
+        _verifier = Verifier(key_jar=_verifier_key_jar())
+        assert _verifier.verify(_msg).payload["address"] == {"country": "US"}
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cryptojwt import KeyJar
+from cryptojwt.key_jar import build_keyjar
+from idpysdjwt.claims import LazyClaims
+from idpysdjwt.compact import CompactSDJWT
+from idpysdjwt.compact import referenced_digests
+from idpysdjwt.disclosure import ObjectDisclosure
+from idpysdjwt.disclosure import make_hash
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.template import CredentialTemplate
+from idpysdjwt.verifier import Verifier
+
+ALICE = "https://example.org/issuer"
+
+ALICE_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+ALICE_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(private=True), ALICE)
+
+SELECTIVE_ATTRIBUTE_DISCLOSURES = {
+    "": {
+        "given_name": "John",
+        "family_name": "Doe",
+    },
+    "address": {
+        "street_address": "123 Main St",
+        "locality": "Anytown",
+        "country": "US"
+    }
+}
+
+SELECTIVE_ARRAY_DISCLOSURES = {
+    "nationalities": ["US", "DE"],
+}
+
+
+def test_lazy_claims():
+    _template = CredentialTemplate(SELECTIVE_ATTRIBUTE_DISCLOSURES, SELECTIVE_ARRAY_DISCLOSURES)
+    _payload, _disclosures = _template.construct({"sub": "sub", "address": {"region": "X"}})
+    _parser = CompactSDJWT("~".join(["a.b.c"] + _disclosures + [""]))
+
+    _claims = LazyClaims(_payload, _parser)
+    assert _claims.get(["address", "country"]) == "US"
+    # Only the disclosures on the path to address.country has been decoded,
+    # none of the nationalities
+    assert len(_parser.decoded) == 5
+    assert _claims.get(["nationalities", 1]) == "DE"
+    assert _claims.get(["nationalities", 2]) is None
+    assert _claims.get(["address", "postal_code"], "none") == "none"
+    assert _claims["given_name"] == "John"
+    assert "family_name" in _claims
+    assert _claims.get("address") == {"street_address": "123 Main St", "locality": "Anytown",
+                                      "country": "US", "region": "X"}
+    assert set(_claims.to_dict().keys()) == {"sub", "address", "given_name", "family_name",
+                                             "nationalities"}
+
+
+def test_verify_lazy():
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+                   array_disclosure=SELECTIVE_ARRAY_DISCLOSURES)
+    _msg = alice.create_holder_message(payload={"sub": "sub"})
+
+    _key_jar = KeyJar()
+    _key_jar.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+    charlie = Verifier(key_jar=_key_jar)
+
+    _lazy = charlie.verify(_msg, lazy=True)
+    _eager = charlie.verify(_msg)
+    assert isinstance(_lazy.payload, LazyClaims)
+    assert _lazy.get(["address", "country"]) == _eager.get(["address", "country"]) == "US"
+    assert _lazy.get(["nationalities", 0]) == _eager.get(["nationalities", 0]) == "US"
+    assert _lazy.payload.to_dict() == _eager.payload
+
+
+def test_lazy_claims_digest_used_twice():
+    _inner = ObjectDisclosure("X", "region").make()[0]
+    _outer = ObjectDisclosure({"_sd": [make_hash(_inner)]}, "address").make()[0]
+    _payload = {"_sd": [make_hash(_outer)], "home": {"_sd": [make_hash(_inner)]}}
+    _claims = LazyClaims(_payload, CompactSDJWT("~".join(["a.b.c", _inner, _outer, ""])))
+
+    assert _claims.get(["home", "region"]) == "X"
+    # The same disclosure once more, somewhere else
+    with pytest.raises(ValueError):
+        _claims.get("address")
+    with pytest.raises(ValueError):
+        _claims.to_dict()
+
+    # Directly in the payload, found when the SD-JWT is verified
+    _payload = {"_sd": [make_hash(_inner)], "home": {"_sd": [make_hash(_inner)]}}
+    with pytest.raises(ValueError):
+        referenced_digests(_payload, unique=True)
+
+
+def test_lazy_claims_threads():
+    _template = CredentialTemplate(SELECTIVE_ATTRIBUTE_DISCLOSURES, SELECTIVE_ARRAY_DISCLOSURES)
+    _payload, _disclosures = _template.construct({"sub": "sub"})
+    _claims = LazyClaims(_payload, CompactSDJWT("~".join(["a.b.c"] + _disclosures + [""])))
+
+    # Negative positions are the same claim as the positive ones
+    assert _claims.get(["nationalities", -1]) == _claims.get(["nationalities", 1]) == "DE"
+    _paths = [["address", "country"], "address", ["nationalities", 0], "given_name"] * 50
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        _res = list(executor.map(_claims.get, _paths))
+    assert _res[:4] == ["US", {"street_address": "123 Main St", "locality": "Anytown",
+                               "country": "US"}, "US", "John"]
+    assert _res == _res[:4] * 50
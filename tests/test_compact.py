@@ -0,0 +1,62 @@
+from idpysdjwt.compact import CompactSDJWT
+from idpysdjwt.compact import referenced_digests
+from idpysdjwt.disclosure import parse_disclosure
+from idpysdjwt.template import CredentialTemplate
+from idpysdjwt.verifier import display_sdjwt
+
+TEMPLATE = CredentialTemplate(
+    {"": {"given_name": "John", "family_name": "Doe"}, "address": {"country": "US"}},
+    {"nationalities": ["US", "DE"]})
+
+
+def _message(key_binding: str = "") -> tuple:
+    _payload, _disclosures = TEMPLATE.construct({"sub": "sub"})
+    # The JWT part is not verified by the parser
+    return _payload, "~".join(["header.payload.signature"] + _disclosures + [key_binding])
+
+
+def test_parse_str_and_bytes():
+    _payload, _msg = _message("kb.jwt.sig")
+    for _input in [_msg, _msg.encode("ascii"), memoryview(_msg.encode("ascii"))]:
+        _parser = CompactSDJWT(_input)
+        assert _parser.jwt == "header.payload.signature"
+        assert _parser.key_binding_jwt == "kb.jwt.sig"
+        assert len(_parser) == 5
+        assert [bytes(d).decode() for d in _parser.iter_disclosures()] == _msg.split("~")[1:-1]
+
+
+def test_digests():
+    _payload, _msg = _message()
+    _parser = CompactSDJWT(_msg)
+    _expected = {parse_disclosure(d)[1] for d in _msg.split("~")[1:-1]}
+    assert set(_parser.digests().keys()) == _expected
+    assert referenced_digests(_payload) == _expected
+
+
+def test_lazy_decode():
+    _payload, _msg = _message()
+    _parser = CompactSDJWT(_msg)
+    _digest = _payload["address"]["_sd"][0]
+    assert _parser.disclosure(_digest)[1:] == ["country", "US"]
+    # Only the one asked for has been decoded
+    assert list(_parser.decoded.keys()) == [_digest]
+
+    _resolved = _parser.resolve(_payload)
+    assert len(_resolved) == 5
+    assert _parser.disclosure("unknown") is None
+
+
+def test_no_disclosures():
+    _parser = CompactSDJWT("header.payload.signature~")
+    assert _parser.jwt == "header.payload.signature"
+    assert _parser.key_binding_jwt == ""
+    assert len(_parser) == 0
+
+
+def test_display_sdjwt():
+    _msg = ("eyJhbGciOiAiRVMyNTYifQ.eyJzdWIiOiAidXNlcl80MiJ9.c2ln"
+            "~WyJsa2x4RjVqTVlsR1RQVW92TU5JdkNBIiwgIlVTIl0~")
+    _payload, _discl = display_sdjwt(_msg)
+    assert _payload == {"sub": "user_42"}
+    assert _discl == [(['lklxF5jMYlGTPUovMNIvCA', 'US'],
+                       parse_disclosure("WyJsa2x4RjVqTVlsR1RQVW92TU5JdkNBIiwgIlVTIl0")[1])]
@@ -0,0 +1,86 @@
+import pickle
+
+import pytest
+from cryptojwt.key_jar import build_keyjar
+from idpysdjwt.decoy import DecoyPolicy
+from idpysdjwt.decoy import DecoyPool
+from idpysdjwt.holder import Holder
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.template import CredentialTemplate
+from idpysdjwt.template import Disclosed
+
+ALICE = "https://example.org/issuer"
+
+ALICE_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+ALICE_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(private=True), ALICE)
+
+BOB_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+BOB_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+
+TEMPLATE = CredentialTemplate({"": {"given_name": "John", "family_name": "Doe"},
+                               "address": {"country": "US"}})
+
+
+def test_pool():
+    _pool = DecoyPool("sha-384", size=100, refill_at=50)
+    _pool.fill()
+    assert len(_pool) == 100
+    _digests = _pool.take(60)
+    assert len(set(_digests)) == 60
+    assert all(len(d) == 64 for d in _digests)
+    # More than there is in the pool, the rest is made inline
+    assert len(_pool.take(200)) == 200
+    _pool.close()
+
+
+def test_policy_number():
+    assert DecoyPolicy(count=2).number(5) == 2
+    assert DecoyPolicy(minimum=8).number(5) == 3
+    assert DecoyPolicy(minimum=8).number(10) == 0
+    assert DecoyPolicy(count=4, minimum=8).number(5) == 4
+    assert all(2 <= DecoyPolicy(random_range=(2, 4)).number(5) <= 4 for _ in range(20))
+
+
+def test_policy_arguments():
+    for _kwargs in [{"count": -1}, {"minimum": -1}, {"pool_size": -1},
+                    {"random_range": (4, 2)}, {"random_range": (-1, 2)},
+                    {"random_range": (1, 2, 3)}]:
+        with pytest.raises(ValueError):
+            DecoyPolicy(**_kwargs)
+
+
+def test_policy_close():
+    _decoys = DecoyPolicy(count=3, pool_size=64)
+    _threads = []
+    for _hash_func in ["sha-256", "sha-384"]:
+        assert len(_decoys.digests(1, _hash_func)) == 3
+        _threads.append(_decoys.pool(_hash_func)._thread)
+    _decoys.close()
+    assert not any(_thread.is_alive() for _thread in _threads)
+    # Still works, without a refill thread
+    assert len(_decoys.digests(1, "sha-512")) == 3
+    assert _decoys.pool("sha-512")._thread is None
+
+
+def test_template_decoys():
+    _payload, _disclosures = TEMPLATE.construct(
+        {"sub": "sub", "degree": Disclosed("MSc")}, decoys=DecoyPolicy(minimum=6))
+    assert len(_disclosures) == 4
+    assert len(_payload["_sd"]) == 6
+    assert _payload["_sd"] == sorted(_payload["_sd"])
+    assert len(_payload["address"]["_sd"]) == 6
+
+
+def test_issuer_decoys():
+    _decoys = DecoyPolicy(count=3)
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure={"": {"given_name": "John"}}, decoys=_decoys)
+    for _msg in [alice.create_holder_message(payload={"sub": "sub"}),
+                 alice.create_holder_messages([{"sub": "sub"}])[0]]:
+        bob = Holder(key_jar=BOB_KEY_JAR)
+        bob.parse(_msg)
+        assert len(bob.jwt["_sd"]) == 4
+        assert bob.payload["given_name"] == "John"
+
+    # Worker processes get the policy but not the pools
+    assert pickle.loads(pickle.dumps(_decoys)).number(1) == 3
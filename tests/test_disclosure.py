@@ -1,4 +1,8 @@
+import pytest
+from idpysdjwt.disclosure import ArrayDisclosure
 from idpysdjwt.disclosure import ObjectDisclosure
+from idpysdjwt.disclosure import encode_disclosures
+from idpysdjwt.disclosure import make_salts
 from idpysdjwt.disclosure import parse_disclosure
 from idpysdjwt.payload import Payload
 
@@ -26,6 +30,26 @@ def test_hashed_disclosure_2():
     assert b == _hash
 
 
+def test_encode_disclosures():
+    _salts = make_salts(3)
+    assert len(set(_salts)) == 3
+    assert all(len(s) == 22 for s in _salts)
+
+    _encoded = encode_disclosures([["family_name", "Möbius"], ["FR"], [{"a": [1, 2]}]],
+                                  salts=_salts)
+    assert _encoded[0] == ObjectDisclosure("Möbius", "family_name").make(salt=_salts[0])
+    assert _encoded[1:] == ArrayDisclosure(["FR", {"a": [1, 2]}]).make(salt=_salts[1:])
+    for _disc, _hash in _encoded:
+        assert parse_disclosure(_disc)[1] == _hash
+
+
+def test_encode_disclosures_salt_count():
+    with pytest.raises(ValueError):
+        encode_disclosures([["family_name", "Möbius"], ["FR"]], salts=make_salts(1))
+    with pytest.raises(ValueError):
+        ArrayDisclosure(["FR", "DE"]).make(salt=make_salts(3))
+
+
 SELECTIVE_ATTRIBUTE_DISCLOSURE = {
     "": {
         "given_name": "John",
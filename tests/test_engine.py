@@ -0,0 +1,76 @@
+import pytest
+from cryptojwt import KeyJar
+from cryptojwt.jwe.jwe import factory as jwe_factory
+from cryptojwt.key_jar import build_keyjar
+from idpysdjwt.engine import IssuanceEngine
+from idpysdjwt.holder import Holder
+from idpysdjwt.instrumentation import StatsInstrumentation
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.verifier import Verifier
+
+ALICE = "https://example.org/issuer"
+CHARLIE = "https://example.com/verifier"
+
+ALICE_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+ALICE_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(private=True), ALICE)
+
+BOB_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+BOB_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+
+
+def test_engine_keeps_order():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure={"": {"given_name": "John"}},
+        array_disclosure={"nationalities": ["US", "DE"]}
+    )
+
+    payloads = [{"sub": f"sub_{i}"} for i in range(25)]
+    with IssuanceEngine(alice, max_workers=2, chunk_size=4) as engine:
+        _msgs = engine.issue(payloads)
+
+    assert len(_msgs) == 25
+    for i, _msg in enumerate(_msgs):
+        bob = Holder(key_jar=BOB_KEY_JAR)
+        bob.parse(_msg)
+        assert bob.payload["sub"] == f"sub_{i}"
+        assert bob.payload["given_name"] == "John"
+
+
+def test_engine_issuer_settings():
+    _charlie_key_jar = build_keyjar([{"type": "RSA", "use": ["enc"]}])
+    _charlie_key_jar.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+    _alice_key_jar = KeyJar()
+    _alice_key_jar.import_jwks(ALICE_KEY_JAR.export_jwks(private=True, issuer_id=ALICE), ALICE)
+    _alice_key_jar.import_jwks(_charlie_key_jar.export_jwks(), CHARLIE)
+    alice = Issuer(key_jar=_alice_key_jar, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   encrypt=True, enc_alg="RSA-OAEP", enc_enc="A256GCM", zip="DEF",
+                   hash_func="sha-384", objective_disclosure={"": {"given_name": "John"}})
+    alice.with_jti = True
+
+    _direct = alice.create_holder_message(payload={"sub": "sub"}, recv=CHARLIE)
+    with IssuanceEngine(alice, max_workers=1) as engine:
+        _msgs = engine.issue([{"sub": "sub"}], recv=CHARLIE)
+
+    charlie = Verifier(key_jar=_charlie_key_jar)
+    for _msg in [_direct, _msgs[0]]:
+        _jwe = _msg.split("~")[0]
+        # Encrypted the same way
+        assert _jwe.count(".") == 4
+        _headers = jwe_factory(_jwe).jwt.headers
+        assert (_headers["alg"], _headers["enc"], _headers["zip"]) == ("RSA-OAEP", "A256GCM",
+                                                                       "DEF")
+        _verified = charlie.verify(_msg)
+        assert _verified.payload["given_name"] == "John"
+        assert _verified.jwt["_sd_alg"] == "sha-384"
+        assert "jti" in _verified.jwt
+
+
+def test_engine_instrumentation():
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256",
+                   instrumentation=StatsInstrumentation())
+    with pytest.raises(ValueError):
+        IssuanceEngine(alice, max_workers=1)
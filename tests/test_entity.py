@@ -1,10 +1,24 @@
+import asyncio
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+import pytest
+from cryptojwt import JWT
 from cryptojwt import KeyJar
+from cryptojwt import as_unicode
+from cryptojwt.exception import VerificationError
 from cryptojwt.jws.jws import factory
 from cryptojwt.key_jar import build_keyjar
+from cryptojwt.utils import b64e
+from idpysdjwt.async_verifier import AsyncVerifier
+from idpysdjwt.compact import referenced_digests
+from idpysdjwt.disclosure import make_hash
 from idpysdjwt.holder import Holder
+from idpysdjwt.issuer import MAX_PREPARED_SIGNERS
 from idpysdjwt.issuer import Issuer
+from idpysdjwt.template import Disclosed
+from idpysdjwt.verifier import VerifiedSDJWT
 from idpysdjwt.verifier import Verifier
 
 ALICE = "https://example.org/issuer"
@@ -86,6 +100,30 @@ def test_issuer():
     assert "nationalities" in _msg and len(_msg["nationalities"]) == 2
 
 
+def test_issuer_payload():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES
+    )
+    assert alice.get_disclosure() == ""
+
+    alice.payload.add_arrays([], SELECTIVE_ARRAY_DISCLOSURES)
+    _msg = alice.create_holder_message(payload={"sub": "sub", "aud": BOB})
+    _part = _msg.split("~")
+    assert len(_part) == 12
+    assert alice.get_disclosure() == _part[1:-1]
+
+    # Used as the callback from JWT.pack
+    _load = json.loads(alice.message(sub="sub"))
+    assert len(_load["_sd"]) == 2
+    assert len(_load["nationalities"]) == 2
+    assert len(alice.get_disclosure()) == 10
+    assert alice.get_disclosure() != _part[1:-1]
+
+
 def test_issuer_2():
     alice = Issuer(
         key_jar=ALICE_KEY_JAR,
@@ -114,6 +152,7 @@ def test_issuer_2():
     assert "_sd_alg" in _msg
     assert "nationalities" in _msg and len(_msg["nationalities"]) == 2
 
+
 def test_issuer_holder():
     alice = Issuer(
         key_jar=ALICE_KEY_JAR,
@@ -328,3 +367,391 @@ def test_issuer_holder_verifier_holder_of_key():
     # Will tell the verifier that there are data on these attributes but not what they are
     assert charlie.payload['address'] == {}  #
     assert charlie.payload['nationalities'] == []
+
+
+def test_issuer_batch():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+        array_disclosure=SELECTIVE_ARRAY_DISCLOSURES,
+    )
+
+    payloads = [{"sub": f"sub_{i}", "aud": BOB} for i in range(5)]
+    _msgs = alice.create_holder_messages(payloads)
+    assert len(_msgs) == 5
+
+    for i, _msg in enumerate(_msgs):
+        _jwt = factory(_msg.split("~")[0])
+        assert _jwt.jwt.headers["typ"] == "example+sd-jwt"
+        assert _jwt.jwt.headers["alg"] == "ES256"
+
+        bob = Holder(key_jar=BOB_KEY_JAR)
+        bob.parse(_msg)
+        assert bob.payload["sub"] == f"sub_{i}"
+        assert bob.payload["given_name"] == "John"
+        assert set(bob.payload["nationalities"]) == {"US", "DE"}
+
+
+def test_verify_many():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+        array_disclosure=SELECTIVE_ARRAY_DISCLOSURES,
+        holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0]
+    )
+
+    _msgs = []
+    for i in range(3):
+        _msg = alice.create_holder_message(payload={"sub": f"sub_{i}"})
+        bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256")
+        bob.parse(_msg)
+        _disclose = [_hash for _hash, _spec in bob.disclosure_by_hash.items()
+                     if _spec[1] == "given_name"]
+        _msgs.append(bob.create_verifier_message(_disclose, key_holder_jwt=True, aud=CHARLIE))
+
+    # Tampered with
+    _msgs.insert(1, _msgs[0][:-5] + "AAAAA")
+
+    charlie = Verifier(key_jar=CHARLIE_KEY_JAR)
+    _keys = CHARLIE_KEY_JAR.export_jwks(issuer_id="")
+    _res = charlie.verify_many(_msgs)
+    assert len(_res) == 4
+    assert [r.ok for r in _res] == [True, False, True, True]
+    assert _res[1].error is not None
+    assert [r.payload["sub"] for r in _res if r.ok] == ["sub_0", "sub_1", "sub_2"]
+    assert _res[0].payload["given_name"] == "John"
+    assert _res[0].payload_audience == CHARLIE
+    # Nothing stored on the verifier
+    assert charlie.payload == {}
+    assert CHARLIE_KEY_JAR.export_jwks(issuer_id="") == _keys
+
+
+def test_verify_shared_verifier():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+        holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0]
+    )
+    _msg = alice.create_holder_message(payload={"sub": "sub"})
+    bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256")
+    bob.parse(_msg)
+    _msg = bob.create_verifier_message(list(bob.disclosure_by_hash.keys()),
+                                       key_holder_jwt=True, aud=CHARLIE)
+
+    _key_jar = KeyJar()
+    _key_jar.import_jwks(_pub_jwks, ALICE)
+    charlie = Verifier(key_jar=_key_jar)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        _res = list(executor.map(charlie.verify, [_msg] * 8))
+
+    assert all(isinstance(r, VerifiedSDJWT) for r in _res)
+    assert {r.payload["given_name"] for r in _res} == {"John"}
+    assert {r.payload_audience for r in _res} == {CHARLIE}
+    # The holder key has not been added to the key jar
+    assert _key_jar.owners() == [ALICE]
+    assert charlie.payload == {}
+
+
+def test_async_verifier():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+        holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0]
+    )
+    _msgs = []
+    for _msg in alice.create_holder_messages([{"sub": f"sub_{i}"} for i in range(4)]):
+        bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256")
+        bob.parse(_msg)
+        _msgs.append(bob.create_verifier_message(list(bob.disclosure_by_hash.keys()),
+                                                 key_holder_jwt=True, aud=CHARLIE))
+    _msgs.append("not.a.jwt~")
+
+    charlie = AsyncVerifier(Verifier(key_jar=CHARLIE_KEY_JAR), max_workers=2)
+    _verified = asyncio.run(charlie.verify(_msgs[0]))
+    assert _verified.payload["sub"] == "sub_0"
+    assert _verified.payload_audience == CHARLIE
+
+    _res = asyncio.run(charlie.verify_many(_msgs))
+    charlie.shutdown()
+    assert [r.ok for r in _res] == [True, True, True, True, False]
+    assert [r.payload["sub"] for r in _res[:4]] == ["sub_0", "sub_1", "sub_2", "sub_3"]
+
+
+def test_async_verifier_event_loops():
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES)
+    _msg = alice.create_holder_message(payload={"sub": "sub"})
+    charlie = AsyncVerifier(Verifier(key_jar=CHARLIE_KEY_JAR), max_workers=2, max_in_flight=1)
+    # One event loop after the other, with verifications waiting for the semaphore
+    for _ in range(2):
+        _res = asyncio.run(charlie.verify_many([_msg] * 5))
+        assert all(r.ok for r in _res)
+    charlie.shutdown()
+
+
+def test_holder_present():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+        array_disclosure=SELECTIVE_ARRAY_DISCLOSURES,
+        holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0]
+    )
+    _msg = alice.create_holder_message(payload={"sub": "sub"})
+
+    bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256")
+    with pytest.raises(ValueError):
+        bob.present(claims=[["address", "country"]])
+    # Parsed when the holder is created
+    assert Holder(key_jar=BOB_KEY_JAR, sdjwt=_msg).present(claims=[["given_name"]])
+
+    bob.parse(_msg)
+    _msg = bob.present(claims=[["address", "country"], ["nationalities", 1], ["foo"]],
+                       key_holder_jwt=True, aud=CHARLIE)
+
+    charlie = Verifier(key_jar=CHARLIE_KEY_JAR)
+    _res = charlie.verify(_msg)
+    assert len(_res.disclosure_by_hash) == 3
+    assert _res.payload["address"] == {"country": "US"}
+    assert _res.payload["nationalities"] == ["DE"]
+    assert _res.payload["foo"] == {"bar": {"bell": True}}
+    assert "given_name" not in _res.payload
+
+
+def test_holder_passes_disclosures_unchanged():
+    # A disclosure that json.dumps would not reproduce, compact and not ASCII escaped
+    _disclosure = as_unicode(b64e('["2GLC42sKQveCfGfryNRN9w","given_name","Jöhn"]'.encode()))
+    _hash = make_hash(_disclosure)
+
+    alice = JWT(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600)
+    _jwt = alice.pack(payload={"sub": "sub", "_sd": [_hash], "_sd_alg": "sha-256"})
+    _msg = "~".join([_jwt, _disclosure, ""])
+
+    bob = Holder(key_jar=BOB_KEY_JAR)
+    bob.parse(_msg)
+    _msg = bob.present(claims=[["given_name"]])
+    assert _msg.split("~")[1] == _disclosure
+
+    charlie = Verifier(key_jar=CHARLIE_KEY_JAR)
+    _res = charlie.verify(_msg)
+    assert _res.payload["given_name"] == "Jöhn"
+
+
+def test_holder_not_a_sdjwt():
+    bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256")
+    bob.sdjwt = "a.b.c"
+    with pytest.raises(VerificationError):
+        bob.create_verifier_message([])
+
+
+def test_holder_digests_match_issuer():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+        array_disclosure=SELECTIVE_ARRAY_DISCLOSURES,
+    )
+    _msg = alice.create_holder_message(payload={"sub": "sub"})
+    bob = Holder(key_jar=BOB_KEY_JAR)
+    bob.parse(_msg)
+
+    _presentation = bob.create_verifier_message(list(bob.disclosure_by_hash.keys()))
+    _issued = {make_hash(d) for d in _msg.split("~")[1:-1]}
+    _presented = {make_hash(d) for d in _presentation.split("~")[1:-1]}
+    assert _presented == _issued
+    assert _presented == referenced_digests(factory(_msg.split("~")[0]).jwt.payload())
+
+
+def test_key_binding():
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+        holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0]
+    )
+    _msg = alice.create_holder_message(payload={"sub": "sub"})
+
+    bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256", kb_cache_ttl=30)
+    bob.parse(_msg)
+    _msg = bob.present(claims=[["given_name"], ["family_name"]], key_holder_jwt=True,
+                       aud=CHARLIE, nonce="1234567890")
+
+    _kb_jwt = factory(_msg.split("~")[-1])
+    assert _kb_jwt.jwt.headers["typ"] == "kb+jwt"
+    _kb = _kb_jwt.jwt.payload()
+    assert _kb["nonce"] == "1234567890"
+    assert _kb["aud"] == CHARLIE
+    assert "sd_hash" in _kb
+
+    charlie = Verifier(key_jar=CHARLIE_KEY_JAR)
+    assert charlie.verify(_msg).payload_audience == CHARLIE
+
+    # Remove one of the disclosures, the sd_hash no longer matches
+    _part = _msg.split("~")
+    with pytest.raises(VerificationError):
+        charlie.verify("~".join(_part[:1] + _part[2:]))
+
+    # Same verifier, nonce and presentation, the key binding JWT is reused
+    assert bob.present(claims=[["given_name"], ["family_name"]], key_holder_jwt=True,
+                       aud=CHARLIE, nonce="1234567890") == _msg
+    assert bob.key_binding_signer().stats()["cache_hits"] == 1
+
+    _msgs = bob.create_verifier_messages(list(bob.disclosure_by_hash.keys()),
+                                         audiences=[CHARLIE, BOB], nonces=["n1", "n2"])
+    assert [charlie.verify(m).payload_audience for m in _msgs] == [CHARLIE, BOB]
+
+
+@pytest.mark.parametrize("hash_func", ["sha-384", "sha-512", "sha3-256", "sha3-512"])
+def test_hash_algorithms(hash_func):
+    alice = Issuer(
+        key_jar=ALICE_KEY_JAR,
+        iss=ALICE,
+        sign_alg="ES256",
+        lifetime=600,
+        objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES,
+        array_disclosure=SELECTIVE_ARRAY_DISCLOSURES,
+        holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0],
+        hash_func=hash_func
+    )
+    _msgs = [alice.create_holder_message(payload={"sub": "sub"})]
+    _msgs.extend(alice.create_holder_messages([{"sub": "sub"}]))
+
+    for _msg in _msgs:
+        bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256")
+        bob.parse(_msg)
+        assert bob.jwt["_sd_alg"] == hash_func
+        _part = _msg.split("~")
+        assert set(bob.disclosure_by_hash.keys()) == {make_hash(d, hash_func)
+                                                      for d in _part[1:-1]}
+
+        _msg = bob.present(claims=[["address", "country"], ["nationalities", 1]],
+                           key_holder_jwt=True, aud=CHARLIE, nonce="1234567890")
+        charlie = Verifier(key_jar=CHARLIE_KEY_JAR)
+        for lazy in [False, True]:
+            _verified = charlie.verify(_msg, lazy=lazy)
+            assert _verified.get(["address", "country"]) == "US"
+            assert _verified.get("nationalities") == ["DE"]
+            assert _verified.payload_audience == CHARLIE
+
+
+def test_hash_algorithm_not_supported():
+    with pytest.raises(ValueError):
+        Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", hash_func="md5")
+
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256")
+    with pytest.raises(ValueError):
+        alice.create_holder_message(payload={"sub": "sub"}, hash_func="sha-1")
+
+    _msg = alice.pack({"sub": "sub", "_sd_alg": "sha-1"}) + "~"
+    with pytest.raises(ValueError):
+        Verifier(key_jar=CHARLIE_KEY_JAR).verify(_msg)
+
+
+def test_recursive_disclosures():
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600)
+    _msg = alice.create_holder_message(payload={
+        "sub": "sub",
+        "address": Disclosed({"street_address": Disclosed("123 Main St"),
+                              "locality": Disclosed("Anytown"),
+                              "country": "US"})
+    })
+
+    bob = Holder(key_jar=BOB_KEY_JAR)
+    bob.parse(_msg)
+    assert bob.payload["address"]["locality"] == "Anytown"
+    _msg = bob.present(claims=[["address", "street_address"]])
+
+    charlie = Verifier(key_jar=CHARLIE_KEY_JAR)
+    for lazy in [False, True]:
+        _verified = charlie.verify(_msg, lazy=lazy)
+        assert _verified.get("address") == {"street_address": "123 Main St", "country": "US"}
+
+
+def test_prepared_signer():
+    _key_jar = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+    _key_jar.import_jwks(_key_jar.export_jwks(private=True), ALICE)
+    alice = Issuer(key_jar=_key_jar, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES, prepared_signer=True,
+                   key_check_interval=0)
+    _msg = alice.create_holder_message(payload={"sub": "sub"}, aud=[CHARLIE])
+    _signer = alice.prepare_signer()
+    assert alice.create_holder_messages([{"sub": "sub"}])
+    assert alice.prepare_signer() is _signer
+
+    _charlie_key_jar = KeyJar()
+    _charlie_key_jar.import_jwks(_key_jar.export_jwks(issuer_id=ALICE), ALICE)
+    _verified = Verifier(key_jar=_charlie_key_jar).verify(_msg)
+    assert _verified.jwt["aud"] == [CHARLIE]
+    assert _verified.payload["given_name"] == "John"
+    assert factory(_msg.split("~")[0]).jwt.headers["kid"] == _signer.key.kid
+
+    # New keys, the signer is prepared again
+    _key_jar.import_jwks(build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+                         .export_jwks(private=True), ALICE)
+    assert alice.prepare_signer() is not _signer
+    # Only the signers for the present keys are kept, and not too many of them
+    assert len(alice._signers) == 1
+    for i in range(MAX_PREPARED_SIGNERS + 1):
+        alice.prepare_signer(jws_headers={"typ": f"example+sd-jwt; v={i}"})
+    assert len(alice._signers) <= MAX_PREPARED_SIGNERS
+
+
+def test_encrypted_sdjwt():
+    _charlie_key_jar = build_keyjar([{"type": "RSA", "use": ["enc"]}])
+    _charlie_key_jar.import_jwks(_pub_jwks, ALICE)
+    _alice_key_jar = KeyJar()
+    _alice_key_jar.import_jwks(_priv_jwks, ALICE)
+    _alice_key_jar.import_jwks(_charlie_key_jar.export_jwks(), CHARLIE)
+    alice = Issuer(key_jar=_alice_key_jar, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   encrypt=True, objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES)
+    _msg = alice.create_holder_message(payload={"sub": "sub"}, recv=CHARLIE)
+    # A JWE
+    assert _msg.split("~")[0].count(".") == 4
+
+    _verified = Verifier(key_jar=_charlie_key_jar).verify(_msg)
+    assert _verified.payload["given_name"] == "John"
+    assert _verified.jwt["iss"] == ALICE
+
+
+class Profile(dict):
+    """A message class that requires sub."""
+
+    def verify(self, **kwargs):
+        if "sub" not in self:
+            raise VerificationError("sub missing")
+
+
+def test_message_class_profile():
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure=SELECTIVE_ATTRIBUTE_DISCLOSURES)
+    charlie = Verifier(key_jar=CHARLIE_KEY_JAR, msg_cls=Profile)
+
+    _verified = charlie.verify(alice.create_holder_message(payload={"sub": "sub"}))
+    assert isinstance(_verified.jwt, Profile)
+    assert _verified.payload["given_name"] == "John"
+
+    with pytest.raises(VerificationError):
+        charlie.verify(alice.create_holder_message(payload={"nickname": "Jo"}))
+
+    # Same through iss2msg_cls
+    charlie = Verifier(key_jar=CHARLIE_KEY_JAR, iss2msg_cls={ALICE: Profile})
+    with pytest.raises(VerificationError):
+        charlie.verify(alice.create_holder_message(payload={"nickname": "Jo"}))
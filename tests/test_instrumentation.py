@@ -0,0 +1,157 @@
+import pytest
+from cryptojwt import KeyJar
+from cryptojwt.exception import VerificationError
+from cryptojwt.key_jar import build_keyjar
+from idpysdjwt.holder import Holder
+from idpysdjwt.instrumentation import CallbackInstrumentation
+from idpysdjwt.instrumentation import Instrumentation
+from idpysdjwt.instrumentation import OpenTelemetryInstrumentation
+from idpysdjwt.instrumentation import PrometheusInstrumentation
+from idpysdjwt.instrumentation import StatsInstrumentation
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.verifier import Verifier
+
+ALICE = "https://example.org/issuer"
+BOB = "https://example.com/holder"
+CHARLIE = "https://example.com/verifier"
+
+ALICE_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+ALICE_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(private=True), ALICE)
+
+BOB_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+BOB_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(issuer_id=ALICE), ALICE)
+
+CHARLIE_KEY_JAR = KeyJar()
+CHARLIE_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(issuer_id=ALICE), ALICE)
+
+OBJECTIVE_DISCLOSURE = {"": {"given_name": "John", "family_name": "Doe"}}
+
+
+def _round_trip(instrumentation) -> Verifier:
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure=OBJECTIVE_DISCLOSURE,
+                   holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0],
+                   instrumentation=instrumentation)
+    bob = Holder(key_jar=BOB_KEY_JAR, iss=BOB, sign_alg="ES256", instrumentation=instrumentation)
+    bob.parse(alice.create_holder_message(payload={"sub": "sub"}))
+    _msg = bob.create_verifier_message(list(bob.disclosure_by_hash.keys()), key_holder_jwt=True,
+                                       aud=CHARLIE, nonce="abc")
+    charlie = Verifier(key_jar=CHARLIE_KEY_JAR, instrumentation=instrumentation)
+    charlie.verify(_msg)
+    return charlie
+
+
+def test_callback():
+    _operations = []
+    _round_trip(CallbackInstrumentation(_operations.append))
+
+    assert [(o.entity, o.name) for o in _operations] == [
+        ("Issuer", "issue"), ("Holder", "verify"), ("Holder", "present"), ("Verifier", "verify")]
+    _issue, _parse, _present, _verify = _operations
+    assert list(_issue.stages.keys()) == ["construct", "sign", "serialize"]
+    assert list(_parse.stages.keys()) == ["split", "signature", "disclosures", "expand"]
+    assert list(_present.stages.keys()) == ["select", "key_binding"]
+    assert list(_verify.stages.keys()) == [
+        "split", "signature", "disclosures", "expand", "key_binding"]
+
+    for _operation in _operations:
+        assert _operation.disclosures == 2
+        assert _operation.seconds >= sum(_operation.stages.values())
+    assert _present.nbytes > _parse.nbytes == _issue.nbytes
+
+
+def test_stats():
+    _instrumentation = StatsInstrumentation()
+    charlie = _round_trip(_instrumentation)
+    _round_trip(_instrumentation)
+
+    _stats = _instrumentation.stats()
+    assert _stats[("Issuer", "issue", "total")]["count"] == 2
+    assert _stats[("Issuer", "issue", "total")]["disclosures"] == 4
+    assert _stats[("Verifier", "verify", "key_binding")]["count"] == 2
+
+    assert _stats[("Verifier", "verify", "total")]["errors"] == 0
+
+    # A failed verification is counted as an error
+    with pytest.raises(Exception):
+        charlie.verify("foo~bar~")
+    assert _instrumentation.stats()[("Verifier", "verify", "total")]["count"] == 3
+    assert _instrumentation.stats()[("Verifier", "verify", "total")]["errors"] == 1
+
+    _instrumentation.clear()
+    assert _instrumentation.stats() == {}
+
+
+def test_failures():
+    _operations = []
+    _instrumentation = CallbackInstrumentation(_operations.append)
+    charlie = _round_trip(_instrumentation)
+    del _operations[:]
+
+    with pytest.raises(VerificationError):
+        charlie.verify("foo~bar~")
+    bob = Holder(key_jar=BOB_KEY_JAR, iss=BOB, sign_alg="ES256",
+                 instrumentation=_instrumentation)
+    with pytest.raises(VerificationError):
+        bob.create_verifier_message([])
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure=OBJECTIVE_DISCLOSURE, instrumentation=_instrumentation)
+    with pytest.raises(ValueError):
+        alice.create_holder_messages([{"sub": "sub"}], hash_func="md5")
+
+    assert [(o.entity, o.name, o.error) for o in _operations] == [
+        ("Verifier", "verify", "VerificationError"), ("Holder", "present", "VerificationError"),
+        ("Issuer", "issue_batch", "ValueError")]
+    assert all(o.disclosures == o.nbytes == 0 for o in _operations)
+    assert list(_operations[-1].stages.keys()) == []
+
+
+def test_no_op():
+    # Measurements are dropped
+    _round_trip(Instrumentation())
+
+
+def test_batch():
+    _operations = []
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure=OBJECTIVE_DISCLOSURE,
+                   instrumentation=CallbackInstrumentation(_operations.append))
+    _msgs = alice.create_holder_messages([{"sub": f"user_{i}"} for i in range(5)])
+
+    assert len(_operations) == 1
+    assert _operations[0].name == "issue_batch"
+    assert list(_operations[0].stages.keys()) == ["prepare", "construct", "sign", "serialize"]
+    assert _operations[0].disclosures == 10
+    assert _operations[0].nbytes == sum(len(m) for m in _msgs)
+
+
+def test_prometheus():
+    prometheus_client = pytest.importorskip("prometheus_client")
+    _registry = prometheus_client.CollectorRegistry()
+    _round_trip(PrometheusInstrumentation(registry=_registry))
+
+    _labels = {"entity": "Verifier", "operation": "verify"}
+    assert _registry.get_sample_value("sdjwt_operation_seconds_count", _labels) == 1
+    assert _registry.get_sample_value("sdjwt_disclosures_total", _labels) == 2
+    assert _registry.get_sample_value("sdjwt_stage_seconds_count",
+                                      dict(_labels, stage="key_binding")) == 1
+    assert _registry.get_sample_value("sdjwt_errors_total",
+                                      dict(_labels, error="VerificationError")) is None
+
+
+def test_opentelemetry():
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    _exporter = InMemorySpanExporter()
+    _provider = TracerProvider()
+    _provider.add_span_processor(SimpleSpanProcessor(_exporter))
+    _round_trip(OpenTelemetryInstrumentation(tracer=_provider.get_tracer("test")))
+
+    _spans = _exporter.get_finished_spans()
+    assert [s.name for s in _spans] == [
+        "Issuer.issue", "Holder.verify", "Holder.present", "Verifier.verify"]
+    assert _spans[-1].attributes["sdjwt.disclosures"] == 2
+    assert "sdjwt.stage.key_binding.seconds" in _spans[-1].attributes
@@ -0,0 +1,70 @@
+import pytest
+from cryptojwt import KeyJar
+from cryptojwt.key_jar import build_keyjar
+from idpysdjwt import json_codec
+from idpysdjwt.cache import SerializationCache
+from idpysdjwt.disclosure import encode_disclosures
+from idpysdjwt.disclosure import make_salts
+from idpysdjwt.disclosure import parse_disclosure
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.verifier import Verifier
+
+ALICE = "https://example.org/issuer"
+
+ALICE_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+ALICE_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(private=True), ALICE)
+
+SPECS = [["family_name", "Möbius"], ["US"], ["address", {"country": "US", "zip": [1, 2]}],
+         ["big", 2 ** 70]]
+
+
+@pytest.fixture(params=["auto", "json", "orjson"])
+def backend(request):
+    json_codec.set_backend(request.param)
+    yield request.param
+    json_codec.set_backend()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        json_codec.set_backend("simplejson")
+
+
+def test_disclosures(backend):
+    _salts = make_salts(len(SPECS))
+    _encoded = encode_disclosures(SPECS, salts=_salts)
+    # Deterministic, and the same with and without the value cache
+    assert _encoded == encode_disclosures(SPECS, salts=_salts)
+    assert _encoded == encode_disclosures(SPECS, salts=_salts, value_cache=SerializationCache())
+    for (_disclosure, _digest), _salt, _spec in zip(_encoded, _salts, SPECS):
+        assert parse_disclosure(_disclosure) == ([_salt, *_spec], _digest)
+
+
+def test_non_finite_floats(backend):
+    _specs = [["n", float("nan")], ["inf", [1, {"a": float("-inf")}]], ["none", None]]
+    _salts = make_salts(len(_specs))
+    for (_disclosure, _digest), _salt, _spec in zip(encode_disclosures(_specs, salts=_salts),
+                                                    _salts, _specs):
+        _decoded = parse_disclosure(_disclosure)[0]
+        assert _decoded[:2] == [_salt, _spec[0]]
+        assert repr(_decoded[2]) == repr(_spec[1])
+
+
+def test_backends_agree():
+    _salts = make_salts(len(SPECS))
+    json_codec.set_backend("json")
+    _json = encode_disclosures(SPECS, salts=_salts)
+    json_codec.set_backend("auto")
+    assert encode_disclosures(SPECS, salts=_salts) == _json
+
+
+def test_issue_and_verify(backend):
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure={"": {"given_name": "Jöhn"}, "address": {"country": "US"}})
+    _msg = alice.create_holder_message(payload={"sub": "sub"})
+    _key_jar = KeyJar()
+    _key_jar.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+    for lazy in [False, True]:
+        _verified = Verifier(key_jar=_key_jar).verify(_msg, lazy=lazy)
+        assert _verified.get("given_name") == "Jöhn"
+        assert _verified.get(["address", "country"]) == "US"
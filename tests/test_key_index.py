@@ -0,0 +1,95 @@
+import gc
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cryptojwt import KeyJar
+from cryptojwt.exception import BadSignature
+from cryptojwt.jws.exception import NoSuitableSigningKeys
+from cryptojwt.key_jar import build_keyjar
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.key_index import KeyIndex
+from idpysdjwt.verifier import Verifier
+
+ALICE = "https://example.org/issuer"
+DAVE = "https://example.net/issuer"
+
+
+def make_issuer(iss: str, key_conf: dict, sign_alg: str) -> Issuer:
+    _key_jar = build_keyjar([key_conf])
+    _key_jar.import_jwks(_key_jar.export_jwks(private=True), iss)
+    return Issuer(key_jar=_key_jar, iss=iss, sign_alg=sign_alg, lifetime=600,
+                  objective_disclosure={"": {"given_name": "John"}})
+
+
+ALICE_ISSUER = make_issuer(ALICE, {"type": "EC", "crv": "P-256", "use": ["sig"]}, "ES256")
+DAVE_ISSUER = make_issuer(DAVE, {"type": "RSA", "use": ["sig"]}, "PS256")
+
+
+def _verifier_key_jar() -> KeyJar:
+    _key_jar = KeyJar()
+    for _issuer in [ALICE_ISSUER, DAVE_ISSUER]:
+        _key_jar.import_jwks(_issuer.key_jar.export_jwks(issuer_id=_issuer.iss), _issuer.iss)
+    return _key_jar
+
+
+def test_key_index():
+    _index = KeyIndex(check_interval=0)
+    charlie = Verifier(key_jar=_verifier_key_jar(), key_index=_index)
+    for _issuer in [ALICE_ISSUER, DAVE_ISSUER] * 3:
+        _msg = _issuer.create_holder_message(payload={"sub": "sub"})
+        assert charlie.verify(_msg).payload["given_name"] == "John"
+    assert _index.stats()["misses"] == 2
+    assert _index.stats()["hits"] == 4
+    _msg = ALICE_ISSUER.create_holder_message(payload={"sub": "sub"})
+
+    # Signature of some other JWT
+    _jws = _msg.split("~")[0].split(".")
+    _jws[2] = ALICE_ISSUER.create_holder_message(payload={"sub": "sub"}).split("~")[0].split(".")[2]
+    with pytest.raises(BadSignature):
+        charlie.verify(".".join(_jws) + "~")
+
+    # Signed with a key the verifier does not know about
+    _other = make_issuer(ALICE, {"type": "EC", "crv": "P-256", "use": ["sig"]}, "ES256")
+    _msg = _other.create_holder_message(payload={"sub": "sub"})
+    with pytest.raises(NoSuitableSigningKeys):
+        charlie.verify(_msg)
+
+    # New keys in the key jar, the index is emptied
+    charlie.key_jar.import_jwks(_other.key_jar.export_jwks(issuer_id=ALICE), ALICE)
+    assert charlie.verify(_msg).payload["given_name"] == "John"
+    assert _index.stats()["invalidations"] == 1
+
+
+def test_key_index_shared():
+    _index = KeyIndex()
+    charlie = Verifier(key_jar=_verifier_key_jar(), key_index=_index)
+    _msgs = ALICE_ISSUER.create_holder_messages([{"sub": f"sub_{i}"} for i in range(50)])
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        _res = list(executor.map(lambda m: charlie.verify(m).payload["sub"], _msgs))
+    assert _res == [f"sub_{i}" for i in range(50)]
+    assert _index.hits + _index.misses == 50
+    # The threads that missed at the same time waited for the first one
+    assert _index.misses == 1
+
+
+def test_key_index_key_jar_gone():
+    _index = KeyIndex(check_interval=300)
+    for i in range(10):
+        # Ids of key jars that are gone are reused for new ones, and the keys
+        # are told apart by the key jar only
+        _jwks = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}]).export_jwks(
+            private=True)
+        _jwks["keys"][0]["kid"] = "signing"
+        _issuer_key_jar = KeyJar()
+        _issuer_key_jar.import_jwks(_jwks, ALICE)
+        _issuer = Issuer(key_jar=_issuer_key_jar, iss=ALICE, sign_alg="ES256", lifetime=600,
+                         objective_disclosure={"": {"given_name": "John"}})
+        _key_jar = KeyJar()
+        _key_jar.import_jwks(_issuer.key_jar.export_jwks(issuer_id=ALICE), ALICE)
+        charlie = Verifier(key_jar=_key_jar, key_index=_index)
+        _msg = _issuer.create_holder_message(payload={"sub": "sub"})
+        assert charlie.verify(_msg).payload["given_name"] == "John"
+        del charlie, _key_jar
+        gc.collect()
+        assert len(_index._key_jars) == 0
+    assert _index.stats()["misses"] == 10
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cryptojwt import KeyJar
+from cryptojwt.exception import VerificationError
+from cryptojwt.jwt import utc_time_sans_frac
+from cryptojwt.key_jar import build_keyjar
+from idpysdjwt.holder import Holder
+from idpysdjwt.issuer import Issuer
+from idpysdjwt.key_binding import KeyBindingSigner
+from idpysdjwt.replay import MemoryReplayStore
+from idpysdjwt.replay import ReplayStoreFull
+from idpysdjwt.replay import SQLiteReplayStore
+from idpysdjwt.verifier import Verifier
+
+ALICE = "https://example.org/issuer"
+CHARLIE = "https://example.com/verifier"
+
+ALICE_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+ALICE_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(private=True), ALICE)
+
+BOB_KEY_JAR = build_keyjar([{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+BOB_KEY_JAR.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+
+
+def test_memory_store():
+    _store = MemoryReplayStore()
+    assert _store.add("a", 110, now=100)
+    assert not _store.add("a", 110, now=105)
+    assert _store.add("b", 200, now=105)
+    # "a" has expired
+    assert _store.add("a", 130, now=120)
+    assert len(_store) == 2
+
+
+def test_memory_store_bounded():
+    _store = MemoryReplayStore(max_entries=3)
+    for i in range(3):
+        assert _store.add(f"k{i}", 100 + i, now=0)
+    # Full, and nothing has expired
+    with pytest.raises(ReplayStoreFull):
+        _store.add("k3", 200, now=0)
+    assert not _store.add("k0", 200, now=0)
+    assert len(_store) == 3
+
+    # k0 and k1 have expired
+    assert _store.add("k3", 200, now=102)
+    assert _store.add("k4", 200, now=102)
+    assert len(_store) == 3
+
+
+def test_sqlite_store(tmp_path):
+    _path = str(tmp_path / "replay.db")
+    _store = SQLiteReplayStore(_path, purge_interval=2)
+    assert _store.add("a", 110, now=100)
+    assert not _store.add("a", 110, now=105)
+
+    # Another process, same database
+    _other = SQLiteReplayStore(_path)
+    assert not _other.add("a", 110, now=105)
+    assert _other.add("a", 130, now=120)
+    _store.purge(now=200)
+    assert len(_store) == 0
+
+
+def test_sqlite_store_threads(tmp_path):
+    with pytest.raises(ValueError):
+        SQLiteReplayStore(":memory:")
+
+    _store = SQLiteReplayStore(str(tmp_path / "replay.db"), purge_interval=10)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        _res = list(executor.map(lambda k: _store.add(k, 110, now=100),
+                                 [f"k{i % 50}" for i in range(200)]))
+    assert _res.count(True) == 50
+    assert _store._additions == 200
+
+
+def test_verifier_rejects_replay():
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure={"": {"given_name": "John"}},
+                   holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0])
+    bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256")
+    bob.parse(alice.create_holder_message(payload={"sub": "sub"}))
+    _msg = bob.present(claims=[["given_name"]], key_holder_jwt=True, aud=CHARLIE, nonce="n-1")
+
+    _key_jar = KeyJar()
+    _key_jar.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+    charlie = Verifier(key_jar=_key_jar, replay_store=MemoryReplayStore())
+    assert charlie.verify(_msg).payload["given_name"] == "John"
+    with pytest.raises(VerificationError):
+        charlie.verify(_msg)
+
+    _msg = bob.present(claims=[["given_name"]], key_holder_jwt=True, aud=CHARLIE, nonce="n-2")
+    assert charlie.verify(_msg).payload_audience == CHARLIE
+
+
+def test_verifier_replay_retention():
+    alice = Issuer(key_jar=ALICE_KEY_JAR, iss=ALICE, sign_alg="ES256", lifetime=600,
+                   objective_disclosure={"": {"given_name": "John"}},
+                   holder_key=BOB_KEY_JAR.get_signing_key(key_type="EC")[0])
+    bob = Holder(key_jar=BOB_KEY_JAR, sign_alg="ES256")
+    bob.parse(alice.create_holder_message(payload={"sub": "sub"}))
+    _presentation = bob.present(claims=[["given_name"]])
+    _key = BOB_KEY_JAR.get_signing_key(key_type="EC")[0]
+
+    _key_jar = KeyJar()
+    _key_jar.import_jwks(ALICE_KEY_JAR.export_jwks(), ALICE)
+    _store = MemoryReplayStore(max_entries=3)
+    charlie = Verifier(key_jar=_key_jar, replay_store=_store)
+    _now = utc_time_sans_frac()
+    _ten_years = 10 * 365 * 86400
+
+    # Issued in the future, refused and not remembered
+    for i in range(5):
+        _kb_jwt = KeyBindingSigner(_key).sign(CHARLIE, nonce=f"future-{i}",
+                                              presentation=_presentation, iat=_now + _ten_years)
+        with pytest.raises(VerificationError):
+            charlie.verify(_presentation + _kb_jwt)
+    assert len(_store) == 0
+
+    # A far away exp does not keep the nonce longer than the replay window
+    _kb_jwt = KeyBindingSigner(_key, lifetime=_ten_years).sign(
+        CHARLIE, nonce="long-lived", presentation=_presentation, iat=_now)
+    assert charlie.verify(_presentation + _kb_jwt).payload["given_name"] == "John"
+    assert len(_store) == 1
+    _later = _now + charlie.replay_window + 2 * charlie.skew + 2 * _store.granularity
+    assert _store.add("nonce:long-lived", _later + 60, now=_later)
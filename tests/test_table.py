@@ -0,0 +1,39 @@
+import pytest
+from idpysdjwt.claims import LazyClaims
+from idpysdjwt.disclosure import ObjectDisclosure
+from idpysdjwt.disclosure import parse_disclosure
+from idpysdjwt.table import DisclosureTable
+from idpysdjwt.template import CredentialTemplate
+
+TEMPLATE = CredentialTemplate(
+    {"": {"given_name": "Jöhn", "family_name": "Doe"},
+     "address": {"street_address": "123 Main St", "country": "US"}},
+    {"nationalities": ["US", {"code": "DE"}]})
+
+
+def test_slots():
+    _disclosure = ObjectDisclosure("Doe", "family_name")
+    with pytest.raises(AttributeError):
+        _disclosure.other = 1
+
+
+@pytest.mark.parametrize("hash_func", ["sha-256", "sha3-512"])
+def test_table(hash_func):
+    _payload, _disclosures = TEMPLATE.construct({"sub": "sub"}, hash_func=hash_func)
+    _table = DisclosureTable(hash_func)
+    for d in _disclosures:
+        _table.add(d)
+    assert len(_table) == len(_disclosures)
+
+    _by_hash = dict(parse_disclosure(d, hash_func)[::-1] for d in _disclosures)
+    assert set(_table.digests()) == set(_by_hash.keys())
+    for _digest, _disclosure in _by_hash.items():
+        assert _table.get(_digest) == _disclosure
+        assert _digest in _table
+    assert _table.get("not-a-digest") is None
+    assert DisclosureTable.from_dict(_by_hash, hash_func).get(_digest) == _by_hash[_digest]
+
+    _claims = LazyClaims(_payload, _table)
+    assert _claims["given_name"] == "Jöhn"
+    assert _claims["nationalities"] == ["US", {"code": "DE"}]
+    assert _claims.to_dict() == LazyClaims(_payload, _by_hash).to_dict()
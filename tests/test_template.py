@@ -0,0 +1,162 @@
+import pytest
+from idpysdjwt import template
+from idpysdjwt.claims import ClaimIndex
+from idpysdjwt.claims import LazyClaims
+from idpysdjwt.claims import expand
+from idpysdjwt.disclosure import parse_disclosure
+from idpysdjwt.template import CredentialTemplate
+from idpysdjwt.template import Disclosed
+from idpysdjwt.template import build_disclosures
+
+SELECTIVE_ATTRIBUTE_DISCLOSURES = {
+    "": {
+        "given_name": "John",
+        "family_name": "Doe",
+    },
+    "address": {
+        "street_address": "123 Main St",
+        "locality": "Anytown",
+        "country": "US"
+    },
+    "foo": {
+        "bar": {
+            "bell": True
+        }
+    }
+}
+
+SELECTIVE_ARRAY_DISCLOSURES = {
+    "nationalities": ["US", "DE"],
+    "team": {
+        "group": ['A', 'B']
+    }
+}
+
+
+def test_template_construct():
+    template = CredentialTemplate(SELECTIVE_ATTRIBUTE_DISCLOSURES, SELECTIVE_ARRAY_DISCLOSURES)
+    args = {"sub": "sub", "address": {"region": "Anystate"}}
+    _payload, _disclosure = template.construct(args)
+
+    assert len(_disclosure) == 10
+    assert set(_payload.keys()) == {'_sd', '_sd_alg', 'address', 'foo', 'nationalities', 'sub',
+                                    'team'}
+    assert len(_payload['_sd']) == 2
+    assert _payload['_sd'] == sorted(_payload['_sd'])
+    assert _payload['address']['region'] == "Anystate"
+    assert len(_payload['address']['_sd']) == 3
+    assert len(_payload['foo']['bar']['_sd']) == 1
+    assert len(_payload['team']['group']) == 2
+    # The arguments are left untouched
+    assert args == {"sub": "sub", "address": {"region": "Anystate"}}
+
+
+def test_template_no_shared_state():
+    template = CredentialTemplate(SELECTIVE_ATTRIBUTE_DISCLOSURES, SELECTIVE_ARRAY_DISCLOSURES)
+    _payload_1, _disclosure_1 = template.construct({"sub": "a"})
+    _payload_2, _disclosure_2 = template.construct({"sub": "b"})
+
+    assert len(_disclosure_1) == len(_disclosure_2) == 10
+    assert set(_disclosure_1).isdisjoint(set(_disclosure_2))
+    assert len(_payload_2['_sd']) == 2
+
+
+def test_template_values():
+    template = CredentialTemplate(SELECTIVE_ATTRIBUTE_DISCLOSURES, SELECTIVE_ARRAY_DISCLOSURES)
+    _payload, _disclosure = template.construct(
+        {"sub": "sub"},
+        objective_values={"": {"given_name": "Jane"}},
+        array_values={"nationalities": ["SE"]})
+
+    _values = [parse_disclosure(d)[0] for d in _disclosure]
+    assert ["given_name", "Jane"] in [_v[1:] for _v in _values]
+    assert ["given_name", "John"] not in [_v[1:] for _v in _values]
+    assert len(_payload['nationalities']) == 1
+
+
+def test_template_empty_name():
+    template = CredentialTemplate({"": {"": "FR"}})
+    _payload, _disclosure = template.construct({})
+    assert len(_disclosure) == 1
+    assert parse_disclosure(_disclosure[0])[0][1:] == ["FR"]
+
+
+def test_recursive_disclosures():
+    _claims = {
+        "sub": "sub",
+        "address": Disclosed({
+            "street_address": Disclosed("123 Main St"),
+            "country": "US"
+        }),
+        "degrees": [{"type": Disclosed("BSc")}, Disclosed({"type": Disclosed("MSc")})]
+    }
+    _payload, _disclosures = CredentialTemplate(
+        {"": {"given_name": "John"}}).construct(_claims)
+    assert len(_disclosures) == 6
+    assert set(_payload.keys()) == {"sub", "degrees", "_sd", "_sd_alg"}
+    assert len(_payload["_sd"]) == 2
+
+    _by_hash = dict(parse_disclosure(d)[::-1] for d in _disclosures)
+    _expected = {
+        "sub": "sub",
+        "given_name": "John",
+        "address": {"street_address": "123 Main St", "country": "US"},
+        "degrees": [{"type": "BSc"}, {"type": "MSc"}]
+    }
+    assert expand(_payload, _by_hash.get) == _expected
+    assert LazyClaims(_payload, _by_hash).get(["address", "street_address"]) == "123 Main St"
+    assert LazyClaims(_payload, _by_hash).get(["degrees", 1, "type"]) == "MSc"
+
+    # Releasing the street address also releases the address
+    assert len(ClaimIndex(_payload, _by_hash).digests([["address", "street_address"]])) == 2
+
+
+def test_deep_recursive_disclosures():
+    _depth = 3000
+    _claims = {"level": 0}
+    for i in range(1, _depth):
+        _claims = {"level": i, "inner": Disclosed(_claims)}
+    _payload, _disclosures = build_disclosures(_claims)
+    assert len(_disclosures) == _depth - 1
+
+    _by_hash = dict(parse_disclosure(d)[::-1] for d in _disclosures)
+    _value = expand(_payload, _by_hash.get)
+    _levels = []
+    while _value is not None:
+        _levels.append(_value["level"])
+        _value = _value.get("inner")
+    assert _levels == list(range(_depth - 1, -1, -1))
+
+
+def test_digest_used_twice():
+    _payload, _disclosures = build_disclosures({"a": Disclosed("b")})
+    _payload["c"] = {"_sd": _payload["_sd"]}
+    _by_hash = dict(parse_disclosure(d)[::-1] for d in _disclosures)
+    with pytest.raises(ValueError):
+        expand(_payload, _by_hash.get)
+
+
+def test_build_disclosures_one_encode_per_depth(monkeypatch):
+    _calls = []
+    _encode_disclosures = template.encode_disclosures
+
+    def _encode(specs, *args, **kwargs):
+        _calls.append(len(specs))
+        return _encode_disclosures(specs, *args, **kwargs)
+
+    monkeypatch.setattr(template, "encode_disclosures", _encode)
+    _payload, _disclosures = build_disclosures({
+        "given_name": Disclosed("John"),
+        "family_name": Disclosed("Doe"),
+        "nationalities": [Disclosed("US"), Disclosed("DE")],
+        "address": Disclosed({"locality": Disclosed("Anytown")})
+    })
+    assert len(_disclosures) == 6
+    assert _calls == [3, 3]
+
+
+def test_build_disclosures_disclosed_twice():
+    with pytest.raises(ValueError):
+        build_disclosures({"a": Disclosed(Disclosed("b"))})
+    with pytest.raises(ValueError):
+        build_disclosures({"a": Disclosed("b")}, salts=[])